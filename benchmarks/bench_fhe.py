@@ -0,0 +1,44 @@
+# benchmarks/bench_fhe.py
+#
+# Compares one-value-per-ciphertext encryption with encrypt_vector,
+# in-process and on a process pool, and reports the serialized batch
+# size. Only the mock backend packs slots; simplefhe has one slot, so
+# on it "packed" measures the pool and the batch format alone. Usage:
+# python benchmarks/bench_fhe.py [--backend NAME] [--slots N] [--workers N] [counts...]
+
+import argparse
+import time
+from dustapi.goha.fhe import BACKENDS, MockBackend, CiphertextBatch, encrypt_vector, decrypt_vector
+
+DEFAULT_COUNTS = [1000, 10000, 100000, 1000000]
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def run(count, backend, workers):
+    values = [float(n % 1000) for n in range(count)]
+
+    _, single = timed(lambda: [backend.encrypt([v]) for v in values])
+    batch, packed = timed(lambda: encrypt_vector(values, backend, workers=0))
+    _, pooled = timed(lambda: encrypt_vector(values, backend, workers=workers, parallel_threshold=0))
+    data, serialize = timed(batch.to_bytes)
+    _, load = timed(lambda: CiphertextBatch.from_bytes(data))
+    decrypted, decrypt = timed(lambda: decrypt_vector(batch, backend, workers=0))
+    assert list(decrypted) == values
+
+    print(f"{backend.name:>9} {count:>8} values  per-value {single * 1000:9.1f}ms  packed {packed * 1000:9.1f}ms"
+          f"  pool({workers}) {pooled * 1000:9.1f}ms  decrypt {decrypt * 1000:9.1f}ms"
+          f"  {len(data) / count:6.1f} B/value  serialize {serialize * 1000:7.1f}ms  load {load * 1000:7.1f}ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="simplefhe", choices=sorted(BACKENDS))
+    parser.add_argument("--slots", type=int, default=4096, help="slots per ciphertext for the mock backend")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("counts", nargs="*", type=int, default=DEFAULT_COUNTS)
+    args = parser.parse_args()
+    backend = MockBackend(args.slots) if args.backend == MockBackend.name else BACKENDS[args.backend]()
+    for count in args.counts:
+        run(count, backend, args.workers)
@@ -0,0 +1,58 @@
+# benchmarks/bench_import.py
+#
+# Cold-start regression check. Imports dustapi.application and builds a
+# Dust() in fresh interpreters under -X importtime, reports the median
+# import and construction times, and lists the optional dependencies
+# that got loaded along the way. Usage:
+# python benchmarks/bench_import.py [--runs N] [--max-ms MS]
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Optional subsystems that must not load until they are used
+DEFERRED = ["jinja2", "cryptography", "jwt", "pydantic", "yaml", "websockets", "Crypto", "dustapi.goha.sse_engine"]
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import dustapi.application
+from dustapi.application import Dust
+imported = time.perf_counter()
+app = Dust(log_file='/dev/null')
+built = time.perf_counter()
+print((imported - start) * 1000, (built - imported) * 1000)
+print(' '.join(m for m in {deferred!r} if m in sys.modules))
+"""
+
+def run_once():
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT.format(deferred=DEFERRED)],
+                          capture_output=True, text=True, check=True)
+    timings, loaded = (proc.stdout.splitlines() + [""])[:2]
+    import_ms, build_ms = map(float, timings.split())
+    # -X importtime reports microseconds; the last line is the top-level import
+    modules = [line.split("|") for line in proc.stderr.splitlines() if line.startswith("import time:") and "|" in line]
+    modules = [cols for cols in modules[1:] if cols[2].strip() != "dustapi.application"]
+    heaviest = sorted(modules, key=lambda cols: -int(cols[1]))[:5]
+    return import_ms, build_ms, loaded.split(), heaviest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median import+construct time exceeds this")
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    import_ms = statistics.median(r[0] for r in results)
+    build_ms = statistics.median(r[1] for r in results)
+    loaded = sorted({m for r in results for m in r[2]})
+
+    print(f"import dustapi.application {import_ms:8.1f}ms   Dust() {build_ms:8.1f}ms")
+    print("heaviest imports (cumulative):")
+    for cols in results[-1][3]:
+        print(f"  {int(cols[1]) / 1000:8.1f}ms {cols[2].strip()}")
+    print(f"deferred modules loaded: {', '.join(loaded) or 'none'}")
+
+    failed = bool(loaded) or (args.max_ms is not None and import_ms + build_ms > args.max_ms)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,201 @@
+# benchmarks/bench_pipeline.py
+#
+# Micro-benchmarks for the request pipeline: routing with many routes,
+# the full WSGI round trip, session load/save, JSON responses, template
+# rendering, SSEEngine search/update and WebSocket broadcast. Each case
+# reports the median time per operation over --repeat runs.
+#
+# --save appends the results to a JSON lines file under the current git
+# commit and compares them with the last run stored there. Usage:
+# python benchmarks/bench_pipeline.py [--save benchmarks/results.jsonl] [--max-regression 0.2] [case...]
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from werkzeug.test import EnvironBuilder
+from dustapi.application import Dust
+from dustapi.config import DustConfig
+from dustapi.loadgen import record, history, compare
+from dustapi.responses import JsonResponse
+from dustapi.routing import Router
+
+ROUTES = 1000
+PAYLOAD = {"id": 42, "name": "dust", "tags": ["a", "b", "c"], "items": [{"n": n, "ok": n % 2 == 0} for n in range(50)]}
+
+def quiet_app(**changes):
+    return Dust(config=DustConfig(log_file=None, enable_docs=False).replace(**changes))
+
+def start_response(status, headers, exc_info=None):
+    return lambda data: None
+
+def time_calls(fn, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number
+
+async def time_async(fn, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        await fn()
+    return (time.perf_counter() - start) / number
+
+def bench_routing(number):
+    router = Router()
+    for n in range(ROUTES):
+        async def handler(request):
+            return "ok"
+        router.add_route(f"/route/{n}", handler, ["GET"])
+    request = EnvironBuilder(path=f"/route/{ROUTES - 1}").get_request()
+    return asyncio.run(time_async(lambda: router.dispatch(request), number))
+
+def bench_wsgi_round_trip(number):
+    app = quiet_app()
+
+    @app.route("/hello")
+    async def hello():
+        return "Hello, World!"
+
+    environ = EnvironBuilder(path="/hello").get_environ()
+    return time_calls(lambda: b"".join(app(dict(environ), start_response)), number)
+
+def bench_session(number):
+    app = quiet_app()
+    sessions = app.session_interface
+    session_id = sessions.create_session(repr({"user": "dust", "visits": 0}))
+
+    def load_and_save():
+        data = sessions.get_session(session_id)
+        data["visits"] += 1
+        sessions.save_session(session_id, data)
+    return time_calls(load_and_save, number)
+
+def bench_json(number):
+    return time_calls(lambda: JsonResponse(PAYLOAD).get_data(), number)
+
+def bench_template(number):
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "page.html"), "w") as f:
+            f.write("<h1>{{ title }}</h1><ul>{% for item in items %}<li>{{ item.n }} {{ item.ok }}</li>{% endfor %}</ul>")
+        app = quiet_app(template_folder=tmp)
+        return time_calls(lambda: app.render_template("page.html", title="Dust", items=PAYLOAD["items"]).get_data(), number)
+
+def sse_engine(tmp, terms):
+    from dustapi.goha.sse_engine import SSEEngine
+
+    engine = SSEEngine(tmp, index_backend="memory")
+    query = []
+    for n in range(terms):
+        k1, k2 = f"k1-{n}", f"k2-{n}".ljust(16, "x")
+        engine.add_mail(os.urandom(256), f"msg{n}", "0")
+        engine.update([(SSEEngine.PRF(k1, "body"), SSEEngine.enc(k2.encode(), f"msg{n}").decode(), "0")])
+        query.append((k1, k2, "body"))
+    return engine, query
+
+def bench_sse_search(number):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, query = sse_engine(tmp, 100)
+        try:
+            return time_calls(lambda: engine.search(query), number)
+        finally:
+            engine.close()
+
+def bench_sse_update(number):
+    from dustapi.goha.sse_engine import SSEEngine
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, _ = sse_engine(tmp, 0)
+        counter = iter(range(10 ** 9))
+
+        def update():
+            n = next(counter)
+            engine.update([(SSEEngine.PRF(f"k1-{n}", "body"), SSEEngine.enc(b"k2".ljust(16, b"x"), f"msg{n}").decode(), "0")])
+        try:
+            return time_calls(update, number)
+        finally:
+            engine.close()
+
+def bench_websocket_broadcast(number, clients=20):
+    import websockets
+    from websockets.asyncio.client import connect
+    from websockets.asyncio.server import serve
+    from dustapi.web_sockets import WebSocketRouter
+
+    router = WebSocketRouter()
+    connected = set()
+
+    async def broadcast_route(websocket, path):
+        connected.add(websocket)
+        try:
+            await websocket.wait_closed()
+        finally:
+            connected.discard(websocket)
+    router.add_route("/broadcast", broadcast_route)
+
+    async def main():
+        async with serve(lambda ws: router.handler(ws, ws.request.path), "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            sockets = [await connect(f"ws://127.0.0.1:{port}/broadcast") for _ in range(clients)]
+            while len(connected) < clients:
+                await asyncio.sleep(0.001)
+
+            async def one():
+                # Time from sending until every client has the message
+                websockets.broadcast(connected, "tick")
+                await asyncio.gather(*(ws.recv() for ws in sockets))
+            try:
+                return await time_async(one, number)
+            finally:
+                for ws in sockets:
+                    await ws.close()
+    return asyncio.run(main())
+
+CASES = {
+    "routing": (bench_routing, 2000),
+    "wsgi_round_trip": (bench_wsgi_round_trip, 500),
+    "session": (bench_session, 500),
+    "json": (bench_json, 2000),
+    "template": (bench_template, 1000),
+    "sse_search": (bench_sse_search, 200),
+    "sse_update": (bench_sse_update, 500),
+    "websocket_broadcast": (bench_websocket_broadcast, 200),
+}
+
+def run(names, repeat, scale):
+    results = {}
+    for name in names:
+        fn, number = CASES[name]
+        number = max(1, int(number * scale))
+        seconds = statistics.median(fn(number) for _ in range(repeat))
+        results[name] = {"us_per_op": round(seconds * 1e6, 2), "ops_per_s": round(1 / seconds, 1)}
+        print(f"{name:>20} {seconds * 1e6:10.2f}us/op {1 / seconds:12.1f} ops/s")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cases", nargs="*", help=f"cases to run (default: all of {', '.join(CASES)})")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the iterations per run")
+    parser.add_argument("--save", default=None, help="append results to this JSON lines file and compare with the last run")
+    parser.add_argument("--max-regression", type=float, default=None, help="exit non-zero if a case is this much slower (0.2 is 20%%)")
+    args = parser.parse_args()
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    results = run(args.cases or list(CASES), args.repeat, args.scale)
+    regressions = []
+    if args.save:
+        for name, metrics in results.items():
+            previous = history(args.save, f"pipeline/{name}")
+            if previous:
+                for regression in compare(metrics, previous[-1]["results"], args.max_regression or 0.1, ("us_per_op",)):
+                    regressions.append(f"{name} {regression} (since {previous[-1]['commit']})")
+            record(args.save, f"pipeline/{name}", metrics)
+    for regression in regressions:
+        print(f"regression: {regression}")
+    sys.exit(1 if args.max_regression is not None and regressions else 0)
@@ -0,0 +1,45 @@
+# benchmarks/bench_sse_counters.py
+#
+# Compares per-call PRF against the batched prf_labels generator and
+# times counter-based keyword lookups. Usage:
+# python benchmarks/bench_sse_counters.py [--backend NAME] [counts...]
+
+import argparse
+import os
+import tempfile
+import time
+from dustapi.goha.sse_engine import SSEEngine, PRF, prf_labels
+
+DEFAULT_COUNTS = [10, 1000, 100000]
+
+def run(count, backend):
+    start = time.perf_counter()
+    naive = [PRF("k1", str(c)) for c in range(count)]
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = list(prf_labels("k1", range(count)))
+    batch = time.perf_counter() - start
+    assert naive == batched
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = SSEEngine(tmp, index_backend=backend, index_path=os.path.join(tmp, "index"))
+        try:
+            engine.bulk_import((label, "00") for label in batched)
+            start = time.perf_counter()
+            entries = engine.counter_entries(b"k1")
+            lookup = time.perf_counter() - start
+            assert len(entries) == count
+        finally:
+            engine.close()
+
+    print(f"{backend:>6} {count:>7} counters  PRF {single * 1000:9.2f}ms  prf_labels {batch * 1000:9.2f}ms"
+          f"  counter_entries {lookup * 1000:9.2f}ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="sqlite")
+    parser.add_argument("counts", nargs="*", type=int, default=DEFAULT_COUNTS)
+    args = parser.parse_args()
+    for count in args.counts:
+        run(count, args.backend)
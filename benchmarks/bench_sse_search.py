@@ -0,0 +1,49 @@
+# benchmarks/bench_sse_search.py
+#
+# Measures SSEEngine.lookup throughput for queries of 1, 100 and 10k
+# terms. Usage: python benchmarks/bench_sse_search.py [--backend NAME] [terms...]
+
+import argparse
+import os
+import tempfile
+import time
+from dustapi.goha.sse_engine import SSEEngine, DELIMETER
+
+DEFAULT_TERMS = [1, 100, 10000]
+POSTINGS_PER_TERM = 4
+REPEAT = 5
+
+def build(engine, terms):
+    query = []
+    entries = []
+    for n in range(terms):
+        k1, k2 = f"k1-{n}", f"k2-{n}".ljust(16, "x")
+        messages = DELIMETER.join(f"msg{(n + p) % (terms + POSTINGS_PER_TERM)}" for p in range(POSTINGS_PER_TERM))
+        entries.append((SSEEngine.PRF(k1, "body"), SSEEngine.enc(k2.encode(), messages).decode()))
+        query.append((k1, k2, "body"))
+    engine.bulk_import(entries)
+    return query
+
+def run(terms, backend):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = SSEEngine(tmp, index_backend=backend, index_path=os.path.join(tmp, "index"))
+        try:
+            query = build(engine, terms)
+            engine.lookup(query)
+
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                engine.lookup(query)
+            elapsed = (time.perf_counter() - start) / REPEAT
+        finally:
+            engine.close()
+
+    print(f"{backend:>6} {terms:>6} terms  {elapsed * 1000:9.2f}ms/query  {terms / elapsed:12.0f} terms/s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="sqlite")
+    parser.add_argument("terms", nargs="*", type=int, default=DEFAULT_TERMS)
+    args = parser.parse_args()
+    for terms in args.terms:
+        run(terms, args.backend)
@@ -0,0 +1,40 @@
+# benchmarks/bench_sse_update.py
+#
+# Times SSEEngine.bulk_import and SSEEngine.update against indexes of
+# growing size, 10^4 up to 10^7 entries by default. The 10^7 run takes
+# several minutes and a few GB of disk; pass smaller sizes to skip it.
+# Usage: python benchmarks/bench_sse_update.py [--backend NAME] [sizes...]
+
+import argparse
+import os
+import tempfile
+import time
+from dustapi.goha.sse_engine import SSEEngine
+
+DEFAULT_SIZES = [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+UPDATE_BATCH = 1000
+
+def run(size, backend):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = SSEEngine(tmp, index_backend=backend, index_path=os.path.join(tmp, "index"))
+        try:
+            start = time.perf_counter()
+            engine.bulk_import((f"key{i}", f"value{i}") for i in range(size))
+            imported = time.perf_counter() - start
+
+            batch = [(f"new{i}", f"value{i}", f"key{i}") for i in range(UPDATE_BATCH)]
+            start = time.perf_counter()
+            engine.update(batch)
+            updated = time.perf_counter() - start
+        finally:
+            engine.close()
+
+    print(f"{backend:>6} {size:>10} entries  bulk_import {imported:8.3f}s  update({UPDATE_BATCH}) {updated * 1000:8.2f}ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="sqlite")
+    parser.add_argument("sizes", nargs="*", type=int, default=DEFAULT_SIZES)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.backend)
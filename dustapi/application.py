@@ -4,91 +4,286 @@ import threading
 import os
 import contextvars
 import logging
-from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
+import time
 from werkzeug.wrappers import Request, Response as WerkzeugResponse
 from werkzeug.middleware.shared_data import SharedDataMiddleware
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from cryptography.fernet import Fernet
 from .routing import Router
+from .conditional import is_not_modified, not_modified_response, make_conditional
 from .responses import Response
-from .sessions import SessionManager
-from .jwt import JWTHandler
+from .helpers import lazy, is_loaded, unload
+from .config import DustConfig
 from .openapi import OpenAPI
 from .swagger_ui import SwaggerUI
-# from .sse import SSE  # Import the SSE class we implemented
-from goha.sse_engine import SSEEngine
-# from .web_sockets import WebSocketRouter
-from .web_sockets import WebSocketRouter
+# Jinja, cryptography, pyjwt, pydantic, websockets and the SSE engine are
+# imported by the subsystems below on first use, keeping cold start cheap
 
 # Create a context variable to store the request
 request_context = contextvars.ContextVar('request')
 
+# Settings that decide which routes exist, so configure() can't change them
+CONSTRUCTION_ONLY = ('enable_docs', 'enable_metrics', 'metrics_path', 'metrics_dir')
+
 class Dust:
-    def __init__(self, template_folder='templates', static_folder='static', static_url_path='/static', log_file='app.log', secret_key=None, jwt_secret_key=None):
+    def __init__(self, template_folder='templates', static_folder='static', static_url_path='/static', log_file='app.log', secret_key=None, jwt_secret_key=None, auto_etag=True, swagger_ui=True, config=None):
+        # The keyword arguments are shorthand for a DustConfig; a config passed in wins
+        if config is None:
+            config = DustConfig(template_folder=template_folder, static_folder=static_folder, static_url_path=static_url_path,
+                                log_file=log_file, secret_key=secret_key, jwt_secret_key=jwt_secret_key,
+                                auto_etag=auto_etag, enable_docs=swagger_ui)
         self.router = Router()
-        self.template_env = Environment(
-            loader=FileSystemLoader(template_folder),
-            autoescape=select_autoescape(['html', 'xml'])
-        )
-        self.static_folder = static_folder
-        self.static_url_path = static_url_path
         self.error_handlers = {}
-        self.logger = self.setup_logger(log_file)
-        self.secret_key = secret_key or Fernet.generate_key().decode()
-        self.session_interface = SessionManager(self.secret_key)
-        self.jwt_handler = JWTHandler(jwt_secret_key)
+        self.log_handlers = []
         self.openapi = OpenAPI(title="dustapi Framework API", version="0.0.5", description="API documentation for dustapi Framework")
-        self.sse = SSEEngine()  # Initialize the SSE object
-        
-        # Middleware to serve static files
-        self.shared_data = SharedDataMiddleware(self.wsgi_app, {
-            static_url_path: os.path.join(os.getcwd(), static_folder)
-        })
-        
-        # Initialize SwaggerUI after shared_data is set up
-        self.swagger_ui = SwaggerUI(self)
+        self.apply_config(config)
+
+        # Production deployments can leave out the docs routes entirely
+        self.swagger_ui = SwaggerUI(self) if config.enable_docs else None
+        if config.enable_metrics:
+            self.route(config.metrics_path, methods=['GET'])(self.serve_metrics)
         
         self.http_thread = None
         self.stop_event = threading.Event()
         
-        self.websocket_router = WebSocketRouter()
         self.http_server = None
         self.websocket_server = None
 
+    def configure(self, **changes):
+        """Change settings after construction, rebuilding whatever depends on them."""
+        config = self.config.replace(**changes)
+        for name in CONSTRUCTION_ONLY:
+            if getattr(config, name) != getattr(self.config, name):
+                raise ValueError(f"{name} can only be set when the application is created")
+        self.apply_config(config, self.config)
+        return self
+
+    def apply_config(self, config, previous=None):
+        def changed(*names):
+            return previous is None or any(getattr(previous, name) != getattr(config, name) for name in names)
+
+        self.config = config
+        self.auto_etag = config.auto_etag
+        self.template_folder = config.template_folder
+        self.static_folder = config.static_folder
+        self.static_url_path = config.static_url_path
+        self.log_file = config.log_file
+        self.jwt_secret_key = config.jwt_secret_key
+
+        if changed('log_file'):
+            self.logger = self.setup_logger(config.log_file)
+        if changed('template_folder', 'enable_templates'):
+            unload(self, 'template_env')
+        if changed('static_folder', 'static_url_path', 'enable_static'):
+            # Middleware to serve static files
+            if config.enable_static:
+                self.shared_data = SharedDataMiddleware(self.wsgi_app, {
+                    config.static_url_path: os.path.join(os.getcwd(), config.static_folder)
+                })
+            else:
+                self.shared_data = self.wsgi_app
+        if changed('secret_key', 'enable_sessions'):
+            unload(self, 'secret_key')
+            unload(self, 'session_interface')
+            if config.secret_key:
+                self.secret_key = config.secret_key
+        if changed('jwt_secret_key'):
+            unload(self, 'jwt_handler')
+        if changed('enable_sse'):
+            unload(self, 'sse')
+        if changed('enable_websockets') and not config.enable_websockets:
+            unload(self, 'websocket_router')
+        if changed('enable_profiling', 'profile_dir', 'profile_header', 'profile_token', 'profile_sample_rate',
+                   'slow_request_ms'):
+            unload(self, 'profiler')
+        if changed('enable_tracing', 'trace_service_name', 'trace_sample_ratio', 'trace_file'):
+            if is_loaded(self, 'tracer'):
+                self.tracer.shutdown()
+            unload(self, 'tracer')
+
+    @lazy
+    def template_env(self):
+        if not self.config.enable_templates:
+            raise RuntimeError("Templates are disabled (enable_templates=False)")
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+        return Environment(
+            loader=FileSystemLoader(self.template_folder),
+            autoescape=select_autoescape(['html', 'xml'])
+        )
+
+    @lazy
+    def secret_key(self):
+        from cryptography.fernet import Fernet
+        return Fernet.generate_key().decode()
+
+    @lazy
+    def session_interface(self):
+        if not self.config.enable_sessions:
+            return None
+        from .sessions import SessionManager
+        return SessionManager(self.secret_key)
+
+    @lazy
+    def jwt_handler(self):
+        from .jwt import JWTHandler
+        return JWTHandler(self.jwt_secret_key)
+
+    @lazy
+    def sse(self):
+        if not self.config.enable_sse:
+            raise RuntimeError("The SSE engine is disabled (enable_sse=False)")
+        from .goha.sse_engine import SSEEngine
+        engine = SSEEngine()
+        if self.config.enable_metrics:
+            engine.metrics = self.metrics
+        return engine
+
+    @lazy
+    def websocket_router(self):
+        if not self.config.enable_websockets:
+            raise RuntimeError("WebSockets are disabled (enable_websockets=False)")
+        from .web_sockets import WebSocketRouter
+        router = WebSocketRouter()
+        if self.config.enable_metrics:
+            router.metrics = self.metrics
+        return router
+
+    @lazy
+    def metrics(self):
+        if not self.config.enable_metrics:
+            raise RuntimeError("Metrics are disabled (enable_metrics=False)")
+        from .metrics import RequestMetrics
+        return RequestMetrics(self.config.metrics_dir)
+
+    @lazy
+    def profiler(self):
+        if not self.config.enable_profiling:
+            raise RuntimeError("Profiling is disabled (enable_profiling=False)")
+        from .profiling import Profiler
+        config = self.config
+        return Profiler(config.profile_dir, config.profile_header, config.profile_token, config.profile_sample_rate,
+                        config.slow_request_ms)
+
+    @lazy
+    def tracer(self):
+        if not self.config.enable_tracing:
+            raise RuntimeError("Tracing is disabled (enable_tracing=False)")
+        from .tracing import Tracer, FileExporter
+        config = self.config
+        exporter = FileExporter(config.trace_file) if config.trace_file else None
+        return Tracer(exporter, config.trace_service_name, config.trace_sample_ratio)
+
+    async def serve_metrics(self):
+        from .metrics import CONTENT_TYPE
+        return WerkzeugResponse(self.metrics.render(), content_type=CONTENT_TYPE, headers={'Cache-Control': 'no-store'})
+
     def setup_logger(self, log_file):
         logger = logging.getLogger('dustapi_logger')
         logger.setLevel(logging.INFO)
 
-        # Create file handler which logs messages
-        fh = logging.FileHandler(log_file)
-        fh.setLevel(logging.INFO)
+        # Drop the handlers this app added before, so reconfiguring doesn't duplicate output
+        for handler in self.log_handlers:
+            logger.removeHandler(handler)
+            handler.close()
+        self.log_handlers = []
+
+        # Create formatter and add it to the handlers
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+        if log_file:
+            # Create file handler which logs messages; the file is opened on the first record
+            fh = logging.FileHandler(log_file, delay=True)
+            fh.setLevel(logging.INFO)
+            self.log_handlers.append(fh)
 
         # Create console handler with a higher log level
         ch = logging.StreamHandler()
         ch.setLevel(logging.ERROR)
-
-        # Create formatter and add it to the handlers
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        ch.setFormatter(formatter)
+        self.log_handlers.append(ch)
 
         # Add the handlers to the logger
-        logger.addHandler(fh)
-        logger.addHandler(ch)
+        for handler in self.log_handlers:
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
 
         return logger
 
     def log_request(self, request, response):
         self.logger.info(f'{request.method} {request.path} - {response.status_code}')
 
-    def route(self, path, methods=["GET"], summary=None, description=None, responses=None, parameters=None, request_body=None):
+    def route(self, path, methods=["GET"], summary=None, description=None, responses=None, parameters=None, request_body=None, etag=None, last_modified=None, tags=None, body=None, query=None, response_model=None, rate_limit=None, concurrency=None):
         def wrapper(handler):
+            models = None
+            if body is not None or query is not None or response_model is not None:
+                from .validation import RouteModels
+                models = RouteModels(body, query, response_model)
+
+            async def call_handler():
+                if models is None:
+                    return await handler()
+                from .validation import RequestValidationError
+                try:
+                    kwargs = models.parse(get_request())
+                except RequestValidationError as exc:
+                    return exc.response()
+                return models.serialize(await handler(**kwargs))
+
             async def wrapped_handler(*args, **kwargs):
-                return await handler()
+                # Metrics label requests by the route that matched, not the raw URL
+                request = get_request()
+                request.route_path = path
+                timer = getattr(request, 'timer', None)
+                if timer is None:
+                    return await limited_handler()
+                timer.mark('dispatch')
+                try:
+                    span = getattr(request, 'span', None)
+                    if span is None:
+                        return await limited_handler()
+                    # A live span, so SSE lookups and outgoing calls nest under the handler
+                    with span.tracer.span('dust.handler', {'http.route': path}):
+                        return await limited_handler()
+                finally:
+                    timer.mark('handler')
+
+            async def limited_handler():
+                # Over-limit requests are turned away before any handler work
+                if rate_limit is None and concurrency is None:
+                    return await conditional_handler()
+                from .ratelimit import enforce
+                return await enforce(get_request(), rate_limit, concurrency, conditional_handler)
+
+            async def conditional_handler():
+                if etag is None and last_modified is None:
+                    return await call_handler()
+
+                # Cheap version tokens let us answer a conditional GET
+                # without running the handler or serializing its body.
+                request = get_request()
+                current_etag = etag() if etag else None
+                current_last_modified = last_modified() if last_modified else None
+                if is_not_modified(request, current_etag, current_last_modified):
+                    return not_modified_response(current_etag, current_last_modified)
+
+                response = await call_handler()
+                if not isinstance(response, WerkzeugResponse):
+                    response = WerkzeugResponse(response)
+                if current_etag is not None and 'ETag' not in response.headers:
+                    response.set_etag(current_etag, weak=True)
+                if current_last_modified is not None and response.last_modified is None:
+                    response.last_modified = current_last_modified
+                return response
             self.router.add_route(path, wrapped_handler, methods)
-            if summary and description and responses:
+
+            if models is not None:
+                # Declared models document the route even without a summary
+                model_parameters, model_body, model_responses, schemas = models.openapi()
+                self.openapi.add_schemas(schemas)
                 for method in methods:
-                    self.openapi.add_path(path, method, summary, description, responses, parameters, request_body)
+                    self.openapi.add_path(path, method, summary or handler.__name__, description or handler.__doc__ or '',
+                                          {**model_responses, **(responses or {})}, (parameters or []) + model_parameters,
+                                          request_body or model_body, tags)
+            elif summary and description and responses:
+                for method in methods:
+                    self.openapi.add_path(path, method, summary, description, responses, parameters, request_body, tags)
             return handler
         return wrapper
     
@@ -131,35 +326,86 @@ class Dust:
         return decorator
 
     async def async_wsgi_app(self, environ, start_response):
-        request = Request(environ)
-        request.form = self.parse_form_data(environ)
-
-        if self.session_interface:
-            session_id = request.cookies.get('session_id')
-            request.session = self.session_interface.get_session(session_id) if session_id else None
-        else:
-            request.session = None
-
-        token = request_context.set(request)  # Set the request context
-
+        metrics = self.metrics if self.config.enable_metrics else None
+        if metrics is not None:
+            start = time.perf_counter()
+            metrics.in_flight.inc()
+        # Phase timing and captures cost nothing unless profiling is enabled
+        profiler = self.profiler if self.config.enable_profiling else None
+        tracer = self.tracer if self.config.enable_tracing else None
+        timer = capture = span = span_token = token = None
+        # Whatever fails below, the gauge, the context vars and the capture are released
         try:
-            response = await self.router.dispatch(request)
-            if not isinstance(response, WerkzeugResponse):
-                if isinstance(response, Response):
-                    response = WerkzeugResponse(response.body, status=response.status, content_type=response.content_type)
-                else:
-                    response = WerkzeugResponse(response)
-        except Exception as exc:
-            response = self.handle_exception(exc)
-
-        self.log_request(request, response)  # Log the request details
-
-        if self.session_interface:
+            if profiler is not None or tracer is not None:
+                from .profiling import RequestTimer
+                timer = RequestTimer()
+            if profiler is not None:
+                capture = profiler.start(environ)
+            if tracer is not None:
+                from .tracing import current_span
+                span = tracer.start_request(environ)
+                span_token = current_span.set(span)
+
+            request = Request(environ)
+            request.route_path = None
+            request.timer = timer
+            request.span = span
+            request.form = self.parse_form_data(environ)
+            if timer is not None:
+                timer.mark('parse')
+
+            # The session store is only built once a request carries a session cookie
             session_id = request.cookies.get('session_id')
-            if session_id and request.session:
+            request.session = self.session_interface.get_session(session_id) if session_id and self.session_interface else None
+            if metrics is not None and session_id and self.session_interface:
+                metrics.observe_session(request.session is not None)
+            if timer is not None:
+                timer.mark('session')
+
+            token = request_context.set(request)  # Set the request context
+
+            try:
+                response = await self.router.dispatch(request)
+                if not isinstance(response, WerkzeugResponse):
+                    if isinstance(response, Response):
+                        response = WerkzeugResponse(response.body, status=response.status, content_type=response.content_type)
+                    else:
+                        response = WerkzeugResponse(response)
+            except Exception as exc:
+                response = self.handle_exception(exc)
+
+            response = make_conditional(request, response, auto_etag=self.auto_etag)
+            if timer is not None:
+                timer.mark('serialize')
+
+            self.log_request(request, response)  # Log the request details
+            if timer is not None:
+                timer.mark('logging')
+
+            if session_id and request.session and self.session_interface:
                 self.session_interface.save_session(session_id, request.session)
-
-        request_context.reset(token)  # Reset the context
+            if timer is not None:
+                timer.mark('session_save')
+            if profiler is not None:
+                profiler.finish(request, response, timer, capture)
+            if tracer is not None:
+                tracer.finish_request(span, request, response, timer)
+            if metrics is not None:
+                metrics.observe_request(request.method, request.route_path, response.status_code, time.perf_counter() - start)
+        except BaseException as exc:
+            if capture is not None:
+                capture.disable()
+            if span is not None:
+                span.record_error(exc)
+                span.end()
+            raise
+        finally:
+            if token is not None:
+                request_context.reset(token)  # Reset the context
+            if span_token is not None:
+                current_span.reset(span_token)
+            if metrics is not None:
+                metrics.in_flight.dec()
         return response(environ, start_response)
 
     def wsgi_app(self, environ, start_response):
@@ -177,6 +423,8 @@ class Dust:
         self.logger.info('Dust server gracefully stopped')
 
     def run(self, host='localhost', port=5000, websocket_port=5001):
+        from wsgiref.simple_server import make_server
+
         def run_http():
             with make_server(host, port, self) as httpd:
                 self.http_server = httpd
@@ -192,10 +440,12 @@ class Dust:
             loop.run_forever()
 
         self.http_thread = threading.Thread(target=run_http)
-        self.websocket_thread = threading.Thread(target=run_websocket)
+        # Only apps that registered a WebSocket route start the WebSocket server
+        self.websocket_thread = threading.Thread(target=run_websocket) if is_loaded(self, 'websocket_router') else None
 
         self.http_thread.start()
-        self.websocket_thread.start()
+        if self.websocket_thread:
+            self.websocket_thread.start()
 
         def handle_sigint(signum, frame):
             self.stop()
@@ -211,7 +461,8 @@ class Dust:
             self.stop()
 
         self.http_thread.join()
-        self.websocket_thread.join()
+        if self.websocket_thread:
+            self.websocket_thread.join()
 
     def setup_sse(self, key):
         """
@@ -232,10 +483,17 @@ class Dust:
         return self.sse.search(keyword)
 
     def websocket(self, path):
+        # Fails at decoration time when WebSockets are disabled
+        router = self.websocket_router
         def wrapper(handler):
-            self.websocket_router.add_route(path, handler)
+            router.add_route(path, handler)
             return handler
         return wrapper
 
 def get_request():
     return request_context.get()
+
+def create_app(config=None, **overrides):
+    """Build an application from config (default: DustConfig.load(), i.e. $DUST_CONFIG and DUST_* variables) plus overrides."""
+    config = (config or DustConfig.load()).replace(**overrides)
+    return Dust(config=config)
@@ -1,5 +1,6 @@
 import click
 from dustapi.application import Dust
+from dustapi.config import DustConfig, read_file
 import os
 import importlib.util
 import sys
@@ -12,10 +13,11 @@ def cli():
 @cli.command()
 @click.option('--host', default='127.0.0.1', help='Host to run the server on.')
 @click.option('--port', default=5000, type=int, help='Port to run the server on.')
-@click.option('--template-folder', default='templates', help='Folder to look for templates.')
-@click.option('--static-folder', default='static', help='Folder to serve static files from.')
-@click.option('--log-file', default='app.log', help='File to log requests.')
-def runserver(host, port, template_folder, static_folder, log_file):
+@click.option('--config', 'config_path', default=None, type=click.Path(exists=True, dir_okay=False), help='JSON or TOML config file (default: $DUST_CONFIG).')
+@click.option('--template-folder', default=None, help='Folder to look for templates.')
+@click.option('--static-folder', default=None, help='Folder to serve static files from.')
+@click.option('--log-file', default=None, help='File to log requests.')
+def runserver(host, port, config_path, template_folder, static_folder, log_file):
     """Run the dustapi development server."""
     app_module_path = os.path.join(os.getcwd(), 'app.py')
     
@@ -30,19 +32,93 @@ def runserver(host, port, template_folder, static_folder, log_file):
     except Exception as e:
         click.echo(f"Error loading app.py: {str(e)}", err=True)
         sys.exit(1)
-    
-    if not hasattr(app_module, 'app') or not isinstance(app_module.app, Dust):
-        click.echo("Error: 'app' instance of Dust class not found in app.py.", err=True)
+
+    # Only the options actually given override what app.py chose
+    overrides = {name: value for name, value in (('template_folder', template_folder),
+                                                 ('static_folder', static_folder),
+                                                 ('log_file', log_file)) if value is not None}
+    try:
+        if callable(getattr(app_module, 'create_app', None)):
+            # A factory gets the whole config, so nothing is built twice
+            app = app_module.create_app(DustConfig.load(config_path).replace(**overrides))
+        elif isinstance(getattr(app_module, 'app', None), Dust):
+            if config_path:
+                # Only keys the file sets; the rest stay as app.py configured them
+                overrides = {**read_file(config_path), **overrides}
+            app = app_module.app.configure(**overrides)
+        else:
+            click.echo("Error: 'app' instance of Dust class or 'create_app' factory not found in app.py.", err=True)
+            sys.exit(1)
+    except (TypeError, ValueError) as e:
+        click.echo(f"Error configuring app: {str(e)}", err=True)
         sys.exit(1)
     
-    app = app_module.app
-    app.template_folder = template_folder
-    app.static_folder = static_folder
-    app.log_file = log_file
-    
-    click.echo(f"Running server on {host}:{port} with templates from '{template_folder}', static files from '{static_folder}', and logging to '{log_file}'")
+    config = app.config
+    click.echo(f"Running server on {host}:{port} with templates from '{config.template_folder}', static files from '{config.static_folder}', and logging to '{config.log_file}'")
     app.run(host=host, port=port)
 
+@cli.command()
+@click.argument('url')
+@click.option('--duration', default=10.0, type=float, help='Seconds to run for.')
+@click.option('--requests', 'total', default=None, type=int, help='Stop after this many requests instead.')
+@click.option('--concurrency', default=16, type=int, help='Concurrent keep-alive clients.')
+@click.option('--method', default='GET', help='HTTP method.')
+@click.option('--data', default='', help='Request body.')
+@click.option('--header', 'headers', multiple=True, help="Extra header, as 'Name: value'.")
+@click.option('--warmup', default=1.0, type=float, help='Seconds of traffic to discard first.')
+@click.option('--save', default=None, help='Append the results to this JSON lines file.')
+@click.option('--name', default=None, help='Name the results are stored under (default: METHOD URL).')
+@click.option('--max-regression', default=None, type=float, help='Exit non-zero if a metric is this much worse than the last saved run (0.1 is 10%).')
+def loadtest(url, duration, total, concurrency, method, data, headers, warmup, save, name, max_regression):
+    """Load test a running server and report latency percentiles and throughput."""
+    import asyncio
+    from dustapi.loadgen import run_load, record, history, compare
+
+    headers = dict(header.split(':', 1) for header in headers)
+    headers = {key.strip(): value.strip() for key, value in headers.items()}
+    results = asyncio.run(run_load(url, duration, total, concurrency, method.upper(), data.encode(), headers, warmup))
+
+    click.echo(f"{results['requests']} requests in {results['elapsed_s']}s, {results['errors']} errors, statuses {results['statuses']}")
+    click.echo(f"{results['rps']} req/s  p50 {results['p50_ms']}ms  p90 {results['p90_ms']}ms  p99 {results['p99_ms']}ms  max {results['max_ms']}ms")
+
+    regressions = []
+    if save:
+        name = name or f'{method.upper()} {url}'
+        previous = history(save, name)
+        if previous:
+            regressions = compare(results, previous[-1]['results'], max_regression or 0.1)
+            for regression in regressions:
+                click.echo(f"Regression since {previous[-1]['commit']}: {regression}", err=True)
+        record(save, name, results)
+    if max_regression is not None and regressions:
+        sys.exit(1)
+
+@cli.command()
+@click.argument('archive', type=click.Path(exists=True, dir_okay=False))
+@click.option('--upload-folder', default='uploads', help='Folder holding the encrypted mail blobs.')
+@click.option('--index-backend', default='dbm', help='Index backend: dbm, sqlite, lmdb or memory.')
+@click.option('--index-path', default=None, help='Path of the index store.')
+@click.option('--batch-size', default=256, type=int, help='Records applied per batch.')
+@click.option('--workers', default=4, type=int, help='Threads writing mail blobs.')
+@click.option('--checkpoint', default=None, help='Checkpoint file used to resume an interrupted ingest.')
+def ingest(archive, upload_folder, index_backend, index_path, batch_size, workers, checkpoint):
+    """Bulk load encrypted mail and index deltas from a tar or frame archive."""
+    from dustapi.goha.sse_engine import SSEEngine
+    from dustapi.goha.ingest import BulkIngester, iter_archive
+
+    os.makedirs(upload_folder, exist_ok=True)
+    engine = SSEEngine(upload_folder, index_backend=index_backend, index_path=index_path)
+    ingester = BulkIngester(engine, batch_size=batch_size, workers=workers, checkpoint_path=checkpoint)
+    try:
+        stats = ingester.ingest(iter_archive(archive))
+    except ValueError as e:
+        click.echo(f"Error ingesting {archive}: {str(e)}", err=True)
+        sys.exit(1)
+    finally:
+        engine.close()
+
+    click.echo(f"Ingested {stats['mail']} messages and {stats['index']} index entries ({stats['skipped']} records skipped from checkpoint)")
+
 @cli.command()
 @click.argument('project_name')
 def createproject(project_name):
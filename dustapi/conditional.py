@@ -0,0 +1,49 @@
+import hashlib
+from werkzeug.http import is_resource_modified
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+def weak_etag(data):
+    """Compute a fast, non-cryptographic ETag value for the given body."""
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def is_not_modified(request, etag=None, last_modified=None):
+    """Check the request's If-None-Match/If-Modified-Since against a version."""
+    if request.method not in CONDITIONAL_METHODS:
+        return False
+    if etag is None and last_modified is None:
+        return False
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+def not_modified_response(etag=None, last_modified=None, weak=True):
+    """Create an empty 304 response carrying the validators."""
+    response = WerkzeugResponse(status=304)
+    if etag is not None:
+        response.set_etag(etag, weak=weak)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def make_conditional(request, response, auto_etag=True):
+    """Attach a weak ETag to a buffered response and turn it into a 304 if the client copy is fresh."""
+    if request.method not in CONDITIONAL_METHODS or response.status_code != 200:
+        return response
+    if auto_etag and 'ETag' not in response.headers and not response.is_streamed:
+        response.set_etag(weak_etag(response.get_data()), weak=True)
+    return response.make_conditional(request)
+
+def accepts_gzip(request):
+    return request.accept_encodings['gzip'] > 0
+
+def precompressed_response(request, data, gzipped, etag, mimetype, cache_control=None):
+    """Serve prebuilt bytes, picking the gzip copy when the client accepts it."""
+    use_gzip = gzipped is not None and accepts_gzip(request)
+    response = WerkzeugResponse(gzipped if use_gzip else data, mimetype=mimetype)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag, weak=True)
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,149 @@
+import json
+import os
+from dataclasses import dataclass, fields, replace
+from typing import Any, Dict, Mapping, Optional, Union, get_args, get_origin, get_type_hints
+
+ENV_PREFIX = 'DUST_'
+# Environment variable naming a config file for DustConfig.load
+CONFIG_FILE_ENV = ENV_PREFIX + 'CONFIG'
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+@dataclass(frozen=True)
+class DustConfig:
+    """Settings for a Dust application. Subsystems switched off here are never built."""
+    template_folder: str = 'templates'
+    static_folder: str = 'static'
+    static_url_path: str = '/static'
+    log_file: Optional[str] = 'app.log'
+    secret_key: Optional[str] = None
+    jwt_secret_key: Optional[str] = None
+    auto_etag: bool = True
+    enable_docs: bool = True
+    enable_static: bool = True
+    enable_templates: bool = True
+    enable_sessions: bool = True
+    enable_sse: bool = True
+    enable_websockets: bool = True
+    enable_metrics: bool = False
+    metrics_path: str = '/metrics'
+    # Worker processes that share this directory report each other's metrics
+    metrics_dir: Optional[str] = None
+    enable_profiling: bool = False
+    profile_dir: str = 'profiles'
+    # Requests carrying this header are profiled; with a token, only when the value matches it
+    profile_header: Optional[str] = 'X-Dust-Profile'
+    profile_token: Optional[str] = None
+    profile_sample_rate: float = 0.0
+    slow_request_ms: Optional[float] = None
+    enable_tracing: bool = False
+    trace_service_name: str = 'dustapi'
+    trace_sample_ratio: float = 1.0
+    # Spans are appended here as JSON lines; without a file they are kept in memory
+    trace_file: Optional[str] = None
+
+    def __post_init__(self):
+        for name, expected in get_type_hints(type(self)).items():
+            value = getattr(self, name)
+            allowed = _allowed_types(expected)
+            if float in allowed:
+                allowed += (int,)
+            if not isinstance(value, allowed) or (bool not in allowed and isinstance(value, bool)):
+                raise TypeError(f"{name} must be {' or '.join(t.__name__ for t in allowed)}, got {value!r}")
+        for name in ('static_url_path', 'metrics_path'):
+            if not getattr(self, name).startswith('/'):
+                raise ValueError(f"{name} must start with '/': {getattr(self, name)!r}")
+        for name in ('profile_sample_rate', 'trace_sample_ratio'):
+            if not 0.0 <= getattr(self, name) <= 1.0:
+                raise ValueError(f"{name} must be between 0 and 1, got {getattr(self, name)!r}")
+
+    def replace(self, **changes) -> 'DustConfig':
+        return replace(self, **changes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    @classmethod
+    def from_mapping(cls, values: Mapping[str, Any], base: 'DustConfig' = None) -> 'DustConfig':
+        known = {f.name for f in fields(cls)}
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+        return replace(base or cls(), **values)
+
+    @classmethod
+    def from_file(cls, path: str, base: 'DustConfig' = None) -> 'DustConfig':
+        """Read a JSON or TOML file of top-level keys named like the fields."""
+        return cls.from_mapping(read_file(path), base)
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = None, prefix: str = ENV_PREFIX, base: 'DustConfig' = None) -> 'DustConfig':
+        """Read DUST_<FIELD> variables, e.g. DUST_ENABLE_DOCS=false."""
+        environ = os.environ if environ is None else environ
+        hints = get_type_hints(cls)
+        values = {}
+        for f in fields(cls):
+            key = prefix + f.name.upper()
+            if key in environ:
+                values[f.name] = _parse(key, environ[key], hints[f.name])
+        return cls.from_mapping(values, base)
+
+    @classmethod
+    def load(cls, path: str = None, environ: Mapping[str, str] = None, prefix: str = ENV_PREFIX) -> 'DustConfig':
+        """Defaults, then the config file (path or $DUST_CONFIG), then environment overrides."""
+        environ = os.environ if environ is None else environ
+        path = path or environ.get(CONFIG_FILE_ENV)
+        config = cls.from_file(path) if path else cls()
+        return cls.from_env(environ, prefix, base=config)
+
+def read_file(path: str) -> Dict[str, Any]:
+    """Only the keys a JSON or TOML config file sets, so they can be layered over other settings."""
+    if path.endswith('.toml'):
+        tomllib = _tomllib()
+        with open(path, 'rb') as f:
+            values = tomllib.load(f)
+    else:
+        with open(path) as f:
+            values = json.load(f)
+    if not isinstance(values, dict):
+        raise ValueError(f"Config file {path} must hold an object")
+    known = {f.name for f in fields(DustConfig)}
+    unknown = set(values) - known
+    if unknown:
+        raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+    return values
+
+def _tomllib():
+    try:
+        import tomllib
+    except ImportError:
+        # Python < 3.11
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ValueError("TOML config files need Python 3.11 or the 'tomli' package: pip install tomli")
+    return tomllib
+
+def _allowed_types(annotation) -> tuple:
+    if get_origin(annotation) is Union:
+        return tuple(type(None) if a is type(None) else a for a in get_args(annotation))
+    return (annotation,)
+
+def _parse(key: str, raw: str, annotation):
+    allowed = _allowed_types(annotation)
+    if type(None) in allowed and raw == '':
+        return None
+    if bool in allowed:
+        if raw.lower() in TRUE_VALUES:
+            return True
+        if raw.lower() in FALSE_VALUES:
+            return False
+        raise ValueError(f"{key} must be a boolean, got {raw!r}")
+    for number in (int, float):
+        if number in allowed:
+            try:
+                return number(raw)
+            except ValueError:
+                raise ValueError(f"{key} must be a number, got {raw!r}")
+    return raw
@@ -0,0 +1,117 @@
+############
+#
+#  blob_store.py
+#
+#  Content-addressed storage for encrypted mail. Blobs are named by
+#  the SHA-256 of their bytes and sharded into nested directories;
+#  a small name index maps upload filenames to blob ids.
+#
+############
+
+import asyncio
+import binascii
+import hashlib
+import os
+import tempfile
+from typing import Iterable, Optional
+from dustapi.goha.index_store import IndexStore, open_index_store
+
+TMP_DIR = ".tmp"
+NAMES_FILE = "names.sqlite3"
+
+
+class BlobStore:
+    def __init__(self, root: str, depth: int = 2, width: int = 2, names: IndexStore = None, fsync: bool = False):
+        self.root = root
+        self.depth = depth
+        self.width = width
+        self.fsync = fsync
+        self.tmp_dir = os.path.join(root, TMP_DIR)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.names = names if names is not None else open_index_store("sqlite", os.path.join(root, NAMES_FILE))
+
+    @staticmethod
+    def blob_id(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, blob_id: str) -> str:
+        shards = [blob_id[n * self.width:(n + 1) * self.width] for n in range(self.depth)]
+        return os.path.join(self.root, *shards, blob_id)
+
+    def exists(self, blob_id: str) -> bool:
+        return os.path.exists(self.path(blob_id))
+
+    def put(self, data: bytes) -> str:
+        blob_id = self.blob_id(data)
+        path = self.path(blob_id)
+        # Identical ciphertexts share one blob
+        if os.path.exists(path):
+            return blob_id
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write aside and rename so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return blob_id
+
+    def put_stream(self, chunks: Iterable[bytes]) -> str:
+        # Hash while spooling to a temp file so arbitrarily large blobs
+        # never sit in memory
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            blob_id = digest.hexdigest()
+            path = self.path(blob_id)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return blob_id
+
+    @staticmethod
+    def is_blob_id(blob_id: str) -> bool:
+        return isinstance(blob_id, str) and len(blob_id) == 64 and all(c in "0123456789abcdef" for c in blob_id)
+
+    async def put_async(self, data: bytes) -> str:
+        return await asyncio.to_thread(self.put, data)
+
+    def link(self, filename: str, blob_id: str) -> None:
+        # Store the raw 32-byte digest rather than its hex form
+        self.names[filename.encode()] = binascii.unhexlify(blob_id)
+
+    def resolve(self, filename: str) -> Optional[str]:
+        digest = self.names.get(filename.encode())
+        return binascii.hexlify(digest).decode() if digest else None
+
+    def add(self, data: bytes, filename: str) -> str:
+        blob_id = self.put(data)
+        self.link(filename, blob_id)
+        return blob_id
+
+    async def add_async(self, data: bytes, filename: str) -> str:
+        return await asyncio.to_thread(self.add, data, filename)
+
+    def close(self) -> None:
+        self.names.close()
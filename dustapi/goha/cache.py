@@ -0,0 +1,92 @@
+############
+#
+#  cache.py
+#
+#  Bounded LRU cache used by the SSE engine for PRF labels and
+#  decrypted posting lists. Caches are per process.
+#
+############
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# Rough per-entry bookkeeping cost added to every sized entry
+ENTRY_OVERHEAD = 64
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 0, max_bytes: int = 0, sizeof: Callable[[Hashable, Any], int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_entries or self.max_bytes)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if not self.enabled:
+            return
+        size = self.sizeof(key, value) + ENTRY_OVERHEAD if self.sizeof else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        with self.lock:
+            self._remove(key)
+            self.data[key] = value
+            self.sizes[key] = size
+            self.current_bytes += size
+            while (self.max_entries and len(self.data) > self.max_entries) or \
+                    (self.max_bytes and self.current_bytes > self.max_bytes):
+                oldest = next(iter(self.data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+            self.sizes.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        if key in self.data:
+            del self.data[key]
+            self.current_bytes -= self.sizes.pop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.data),
+                "bytes": self.current_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self.data)
@@ -1,21 +1,368 @@
-# fhe_operations.py
-import simplefhe
+############
+#
+#  fhe.py
+#
+#  Homomorphic encryption helpers. Keys are generated on first use
+#  rather than at import. Vectors are cut into ciphertexts of
+#  `backend.slots` values, and large vectors are split across a
+#  process pool. simplefhe encrypts scalars, so SimpleFHEBackend has
+#  one slot and does no packing; only MockBackend packs several
+#  values per ciphertext. A CiphertextBatch serializes to:
+#
+#    magic "DFHE", >B version, >B backend name length, backend name,
+#    >I slots, >Q value count, >I ciphertext count,
+#    then per ciphertext >I size followed by its bytes
+#
+#  Backends work on ciphertexts as opaque bytes, so batches move
+#  between processes and onto disk without extra copies. Batches come
+#  from clients, so nothing in them is ever unpickled: a simplefhe
+#  ciphertext is >I value count, then per value >I size followed by
+#  the bytes simplefhe serializes it to.
+#
+############
+
+import os
+import struct
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+MAGIC = b"DFHE"
+VERSION = 1
+HEADER = struct.Struct(">4sBB")
+SHAPE = struct.Struct(">IQI")
+SIZE = struct.Struct(">I")
+
+# Vectors with fewer values than this are encrypted in-process
+PARALLEL_THRESHOLD = 65536
+
+
+def as_doubles(values: Any) -> array:
+    # NumPy arrays convert through their buffer instead of value by value
+    if isinstance(values, array) and values.typecode == "d":
+        return values
+    if hasattr(values, "astype") and hasattr(values, "tobytes"):
+        doubles = array("d")
+        doubles.frombytes(values.astype("float64").tobytes())
+        return doubles
+    return array("d", values)
+
+
+def doubles_from_bytes(data: bytes) -> array:
+    values = array("d")
+    values.frombytes(data)
+    return values
+
+
+def pack_values(parts: Sequence[bytes]) -> bytes:
+    out = [SIZE.pack(len(parts))]
+    for part in parts:
+        out.append(SIZE.pack(len(part)))
+        out.append(part)
+    return b"".join(out)
+
+
+def unpack_values(data: bytes) -> List[bytes]:
+    view = memoryview(data)
+    try:
+        (count,) = SIZE.unpack_from(view)
+        offset = SIZE.size
+        parts = []
+        for _ in range(count):
+            (size,) = SIZE.unpack_from(view, offset)
+            offset += SIZE.size
+            if offset + size > len(view):
+                raise ValueError("Truncated ciphertext")
+            parts.append(bytes(view[offset:offset + size]))
+            offset += size
+    except struct.error:
+        raise ValueError("Truncated ciphertext")
+    if offset != len(view):
+        raise ValueError("Extra data after ciphertext")
+    return parts
+
+
+class FHEBackend:
+    name = ""
+    slots = 1
+
+    def encrypt(self, values: Sequence[float]) -> bytes:
+        raise NotImplementedError
+
+    def decrypt(self, ciphertext: bytes, count: int) -> List[float]:
+        raise NotImplementedError
+
+    def add(self, a: bytes, b: bytes) -> bytes:
+        raise NotImplementedError
+
+    def multiply(self, a: bytes, b: bytes) -> bytes:
+        raise NotImplementedError
+
+    def multiply_plain(self, a: bytes, values: Sequence[float]) -> bytes:
+        raise NotImplementedError
+
+
+class SimpleFHEBackend(FHEBackend):
+    # simplefhe encrypts scalars, so every ciphertext holds one value
+    name = "simplefhe"
+    slots = 1
+
+    def __init__(self):
+        self.keys = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Workers need the same keys, so generate them before pickling
+        return {"keys": self.get_keys()}
+
+    def __setstate__(self, state):
+        self.keys = state["keys"]
+        self.lock = threading.Lock()
+
+    def get_keys(self):
+        with self.lock:
+            if self.keys is None:
+                self.keys = generate_keys()
+            return self.keys
+
+    # The only two places that touch simplefhe's wire format
+    def serialize_value(self, value) -> bytes:
+        return value.serialize()
+
+    def load_value(self, data: bytes):
+        context, _, _ = self.get_keys()
+        return context.load_ciphertext(data)
+
+    def dump(self, values: Iterable[Any]) -> bytes:
+        return pack_values([self.serialize_value(value) for value in values])
+
+    def load(self, ciphertext: bytes) -> list:
+        return [self.load_value(part) for part in unpack_values(ciphertext)]
+
+    def encrypt(self, values: Sequence[float]) -> bytes:
+        _, _, public_key = self.get_keys()
+        return self.dump(public_key.encrypt(value) for value in values)
+
+    def decrypt(self, ciphertext: bytes, count: int) -> List[float]:
+        _, secret_key, _ = self.get_keys()
+        return [secret_key.decrypt(value) for value in self.load(ciphertext)[:count]]
+
+    def add(self, a: bytes, b: bytes) -> bytes:
+        return self.dump(x + y for x, y in zip(self.load(a), self.load(b)))
+
+    def multiply(self, a: bytes, b: bytes) -> bytes:
+        return self.dump(x * y for x, y in zip(self.load(a), self.load(b)))
+
+    def multiply_plain(self, a: bytes, values: Sequence[float]) -> bytes:
+        return self.dump(x * y for x, y in zip(self.load(a), values))
+
+
+class MockBackend(FHEBackend):
+    """Packs values in the clear. For tests and benchmarks only."""
+
+    name = "mock"
+
+    def __init__(self, slots: int = 4096):
+        self.slots = slots
+
+    def encrypt(self, values: Sequence[float]) -> bytes:
+        return as_doubles(values).tobytes()
+
+    def decrypt(self, ciphertext: bytes, count: int) -> List[float]:
+        return doubles_from_bytes(ciphertext)[:count].tolist()
+
+    def add(self, a: bytes, b: bytes) -> bytes:
+        a, b = self._pad(doubles_from_bytes(a), doubles_from_bytes(b))
+        return array("d", map(float.__add__, a, b)).tobytes()
+
+    def multiply(self, a: bytes, b: bytes) -> bytes:
+        a, b = self._pad(doubles_from_bytes(a), doubles_from_bytes(b))
+        return array("d", map(float.__mul__, a, b)).tobytes()
+
+    def multiply_plain(self, a: bytes, values: Sequence[float]) -> bytes:
+        a, b = self._pad(doubles_from_bytes(a), as_doubles(values))
+        return array("d", map(float.__mul__, a, b)).tobytes()
+
+    @staticmethod
+    def _pad(a: array, b: array):
+        # Unused slots count as zero, like an unfilled packed ciphertext
+        size = max(len(a), len(b))
+        return a + array("d", bytes(8 * (size - len(a)))), b + array("d", bytes(8 * (size - len(b))))
+
+
+BACKENDS = {
+    SimpleFHEBackend.name: SimpleFHEBackend,
+    MockBackend.name: MockBackend,
+}
+
+_backend: Optional[FHEBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> FHEBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = SimpleFHEBackend()
+        return _backend
+
+
+def set_backend(backend: FHEBackend) -> None:
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+class CiphertextBatch:
+    def __init__(self, backend: str, slots: int, length: int, ciphertexts: List[bytes]):
+        self.backend = backend
+        self.slots = slots
+        self.length = length
+        self.ciphertexts = ciphertexts
+
+    def __len__(self) -> int:
+        return self.length
+
+    def to_bytes(self) -> bytes:
+        name = self.backend.encode()
+        parts = [HEADER.pack(MAGIC, VERSION, len(name)), name,
+                 SHAPE.pack(self.slots, self.length, len(self.ciphertexts))]
+        for ciphertext in self.ciphertexts:
+            parts.append(SIZE.pack(len(ciphertext)))
+            parts.append(ciphertext)
+        return b"".join(parts)
+
+    @staticmethod
+    def read_header(data: bytes) -> Tuple[str, int, int, int, int]:
+        """Returns (backend, slots, length, ciphertext count, header size)."""
+        try:
+            magic, version, name_length = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a ciphertext batch")
+            offset = HEADER.size
+            backend = bytes(data[offset:offset + name_length]).decode()
+            offset += name_length
+            slots, length, count = SHAPE.unpack_from(data, offset)
+        except (struct.error, UnicodeDecodeError):
+            raise ValueError("Truncated ciphertext batch")
+        if slots < 1:
+            raise ValueError("Ciphertext batch has no slots")
+        return backend, slots, length, count, offset + SHAPE.size
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CiphertextBatch":
+        view = memoryview(data)
+        backend, slots, length, count, offset = cls.read_header(view)
+        ciphertexts = []
+        try:
+            for _ in range(count):
+                (size,) = SIZE.unpack_from(view, offset)
+                offset += SIZE.size
+                if offset + size > len(view):
+                    raise ValueError("Truncated ciphertext batch")
+                ciphertexts.append(bytes(view[offset:offset + size]))
+                offset += size
+        except struct.error:
+            raise ValueError("Truncated ciphertext batch")
+        if offset != len(view):
+            raise ValueError("Extra data after ciphertext batch")
+        return cls(backend, slots, length, ciphertexts)
+
+
+# Process pool workers get the backend once, through the initializer
+_worker_backend: Optional[FHEBackend] = None
+
+
+def _init_worker(backend: FHEBackend) -> None:
+    global _worker_backend
+    _worker_backend = backend
+
+
+def _encrypt_chunks(chunks: List[bytes]) -> List[bytes]:
+    return [_worker_backend.encrypt(doubles_from_bytes(chunk)) for chunk in chunks]
+
+
+def _decrypt_chunks(items: List[tuple]) -> List[List[float]]:
+    return [_worker_backend.decrypt(ciphertext, count) for ciphertext, count in items]
+
+
+def _groups(items: List[Any], workers: int) -> List[List[Any]]:
+    # A few tasks per worker keeps pickling overhead low and load even
+    size = max(1, -(-len(items) // (workers * 4)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _pool_size(workers: Optional[int], length: int, threshold: int) -> int:
+    if workers == 0 or length < threshold:
+        return 0
+    return workers or os.cpu_count() or 1
+
+
+def encrypt_vector(values: Any, backend: FHEBackend = None, workers: int = None,
+                   parallel_threshold: int = PARALLEL_THRESHOLD) -> CiphertextBatch:
+    """Encrypt a sequence or NumPy array, `backend.slots` values per ciphertext."""
+    backend = backend or get_backend()
+    doubles = as_doubles(values)
+    slots = backend.slots
+    pool_size = _pool_size(workers, len(doubles), parallel_threshold)
+    if pool_size == 0:
+        ciphertexts = [backend.encrypt(doubles[i:i + slots]) for i in range(0, len(doubles), slots)]
+    else:
+        raw = doubles.tobytes()
+        width = slots * doubles.itemsize
+        chunks = [raw[i:i + width] for i in range(0, len(raw), width)]
+        with ProcessPoolExecutor(pool_size, initializer=_init_worker, initargs=(backend,)) as pool:
+            ciphertexts = [c for group in pool.map(_encrypt_chunks, _groups(chunks, pool_size)) for c in group]
+    return CiphertextBatch(backend.name, slots, len(doubles), ciphertexts)
+
+
+def decrypt_vector(batch: CiphertextBatch, backend: FHEBackend = None, workers: int = None,
+                   parallel_threshold: int = PARALLEL_THRESHOLD) -> array:
+    """Decrypt a batch to an array of doubles; numpy.frombuffer views it without copying."""
+    backend = backend or get_backend()
+    if batch.backend != backend.name:
+        raise ValueError(f"Batch was encrypted with {batch.backend}, not {backend.name}")
+    items = [(ciphertext, min(batch.slots, batch.length - n * batch.slots))
+             for n, ciphertext in enumerate(batch.ciphertexts)]
+    pool_size = _pool_size(workers, batch.length, parallel_threshold)
+    if pool_size == 0:
+        parts = [backend.decrypt(ciphertext, count) for ciphertext, count in items]
+    else:
+        with ProcessPoolExecutor(pool_size, initializer=_init_worker, initargs=(backend,)) as pool:
+            parts = [p for group in pool.map(_decrypt_chunks, _groups(items, pool_size)) for p in group]
+    result = array("d")
+    for part in parts:
+        result.extend(part)
+    return result
+
 
 # Key generation
 def generate_keys():
+    import simplefhe
+
     context = simplefhe.Context()
     secret_key = simplefhe.SecretKey(context)
     public_key = simplefhe.PublicKey(context)
     return context, secret_key, public_key
 
-context, secret_key, public_key = generate_keys()
+
+def __getattr__(name: str):
+    # `context`, `secret_key` and `public_key` used to be created at import
+    keys = ("context", "secret_key", "public_key")
+    backend = get_backend()
+    if name in keys and isinstance(backend, SimpleFHEBackend):
+        return backend.get_keys()[keys.index(name)]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Encryption
-def encrypt_data(data, public_key):
+def encrypt_data(data: Iterable[float], public_key) -> list:
     encrypted_data = [public_key.encrypt(value) for value in data]
     return encrypted_data
 
+
 # Decryption
-def decrypt_data(encrypted_data, secret_key):
+def decrypt_data(encrypted_data: Iterable[Any], secret_key) -> list:
     decrypted_data = [secret_key.decrypt(value) for value in encrypted_data]
     return decrypted_data
@@ -0,0 +1,256 @@
+############
+#
+#  fhe_service.py
+#
+#  Aggregates over encrypted datasets. Clients upload CiphertextBatch
+#  vectors, which are stored on disk under a name, and then ask for
+#  sums, counts, means and dot products. The server never decrypts:
+#  a sum comes back as one ciphertext whose slots add up to the
+#  total, and the client finishes with decrypt_total. On simplefhe
+#  that is one ciphertext per value folded down to one; there is no
+#  slot-level batching.
+#
+#  Queries run on a process pool whose workers read datasets straight
+#  from disk. Results are cached by dataset version.
+#
+############
+
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+from dustapi.responses import JsonResponse
+from .cache import LRUCache
+from .fhe import FHEBackend, CiphertextBatch, as_doubles, decrypt_vector, doubles_from_bytes, get_backend
+
+SUM = "sum"
+COUNT = "count"
+MEAN = "mean"
+DOT = "dot"
+OPERATIONS = (SUM, COUNT, MEAN, DOT)
+
+DATASET_SUFFIX = ".dfhe"
+DATASET_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}$")
+
+
+class DatasetStore:
+    def __init__(self, root: str = "fhe_datasets"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        if not DATASET_NAME.match(name):
+            raise ValueError(f"Invalid dataset name: {name!r}")
+        return os.path.join(self.root, name + DATASET_SUFFIX)
+
+    def put(self, name: str, batch: CiphertextBatch) -> None:
+        path = self.path(name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(batch.to_bytes())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, name: str) -> CiphertextBatch:
+        path = self.path(name)
+        try:
+            with open(path, "rb") as f:
+                return CiphertextBatch.from_bytes(f.read())
+        except FileNotFoundError:
+            raise KeyError(name)
+
+    def header(self, name: str) -> tuple:
+        # Enough of the file for the header, whatever the backend name length
+        try:
+            with open(self.path(name), "rb") as f:
+                return CiphertextBatch.read_header(f.read(512))
+        except FileNotFoundError:
+            raise KeyError(name)
+
+    def version(self, name: str) -> tuple:
+        # Replaced files get a new inode and mtime, so cached results go stale
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            raise KeyError(name)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def delete(self, name: str) -> bool:
+        try:
+            os.unlink(self.path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def names(self) -> List[str]:
+        return sorted(f[:-len(DATASET_SUFFIX)] for f in os.listdir(self.root) if f.endswith(DATASET_SUFFIX))
+
+
+def fold_add(backend: FHEBackend, ciphertexts: List[bytes]) -> bytes:
+    # Pairwise tree keeps noise growth logarithmic in the vector length
+    while len(ciphertexts) > 1:
+        paired = [backend.add(a, b) for a, b in zip(ciphertexts[::2], ciphertexts[1::2])]
+        if len(ciphertexts) % 2:
+            paired.append(ciphertexts[-1])
+        ciphertexts = paired
+    return ciphertexts[0]
+
+
+def compute(backend: FHEBackend, op: str, batch: CiphertextBatch, other: CiphertextBatch = None,
+            weights: Sequence[float] = None) -> CiphertextBatch:
+    if not batch.ciphertexts:
+        raise ValueError("Dataset is empty")
+    ciphertexts = batch.ciphertexts
+    if op == DOT:
+        if other is not None:
+            if (other.length, other.slots) != (batch.length, batch.slots):
+                raise ValueError("Dot product of datasets with different shapes")
+            ciphertexts = [backend.multiply(a, b) for a, b in zip(ciphertexts, other.ciphertexts)]
+        else:
+            if len(weights) != batch.length:
+                raise ValueError(f"Expected {batch.length} weights, got {len(weights)}")
+            slots = batch.slots
+            ciphertexts = [backend.multiply_plain(c, weights[n * slots:(n + 1) * slots])
+                           for n, c in enumerate(ciphertexts)]
+    return CiphertextBatch(batch.backend, batch.slots, min(batch.slots, batch.length), [fold_add(backend, ciphertexts)])
+
+
+def decrypt_total(result: CiphertextBatch, backend: FHEBackend = None) -> float:
+    return sum(decrypt_vector(result, backend, workers=0))
+
+
+def run_query(backend: FHEBackend, datasets: DatasetStore, op: str, name: str, other: Optional[str],
+              weights: Optional[bytes]) -> bytes:
+    batch = datasets.get(name)
+    other_batch = datasets.get(other) if other else None
+    weights = doubles_from_bytes(weights) if weights is not None else None
+    return compute(backend, op, batch, other_batch, weights).to_bytes()
+
+
+# Process pool workers get the backend and dataset root once
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_worker(backend: FHEBackend, root: str) -> None:
+    _worker_state["backend"] = backend
+    _worker_state["datasets"] = DatasetStore(root)
+
+
+def _worker_query(*args) -> bytes:
+    return run_query(_worker_state["backend"], _worker_state["datasets"], *args)
+
+
+class FHEComputeService:
+    def __init__(self, root: str = "fhe_datasets", backend: FHEBackend = None, workers: int = 4,
+                 cache_entries: int = 256):
+        self.backend = backend or get_backend()
+        self.datasets = DatasetStore(root)
+        self.workers = workers
+        self.cache = LRUCache(max_entries=cache_entries)
+        self.executor: Optional[Executor] = None
+
+    def pool(self) -> Executor:
+        if self.executor is None:
+            if self.workers:
+                self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                    initargs=(self.backend, self.datasets.root))
+            else:
+                # workers=0 runs queries on a thread in this process
+                self.executor = ThreadPoolExecutor(1, thread_name_prefix="fhe-query")
+        return self.executor
+
+    def submit(self, *args) -> bytes:
+        if self.workers:
+            return self.pool().submit(_worker_query, *args).result()
+        return self.pool().submit(run_query, self.backend, self.datasets, *args).result()
+
+    def put_dataset(self, name: str, data: bytes) -> Dict[str, Any]:
+        batch = CiphertextBatch.from_bytes(data)
+        if batch.backend != self.backend.name:
+            raise ValueError(f"Dataset was encrypted with {batch.backend}, not {self.backend.name}")
+        if len(batch.ciphertexts) != -(-batch.length // batch.slots):
+            raise ValueError("Ciphertext count does not match the value count")
+        self.datasets.put(name, batch)
+        return self.describe(name, batch)
+
+    def describe(self, name: str, batch: CiphertextBatch = None) -> Dict[str, Any]:
+        if batch is None:
+            backend, slots, length = self.datasets.header(name)[:3]
+        else:
+            backend, slots, length = batch.backend, batch.slots, batch.length
+        return {"name": name, "count": length, "slots": slots, "backend": backend}
+
+    def query(self, op: str, name: str, other: str = None, weights: Sequence[float] = None) -> Dict[str, Any]:
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {op}")
+        if op == DOT and (other is None) == (weights is None):
+            raise ValueError("A dot product needs exactly one of 'other' or 'weights'")
+        if op != DOT and (other is not None or weights is not None):
+            raise ValueError(f"'{op}' takes no 'other' or 'weights'")
+
+        count = self.describe(name)["count"]
+        if op == COUNT:
+            return {"op": op, "dataset": name, "count": count}
+
+        weight_bytes = as_doubles(weights).tobytes() if weights is not None else None
+        key = (op if op != MEAN else SUM, name, self.datasets.version(name),
+               other, self.datasets.version(other) if other else None,
+               hashlib.sha256(weight_bytes).hexdigest() if weight_bytes is not None else None)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.submit(key[0], name, other, weight_bytes)
+            self.cache.put(key, result)
+        return {"op": op, "dataset": name, "count": count, "result": base64.b64encode(result).decode()}
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def fhe_routes(app, service: FHEComputeService = None, prefix: str = "/fhe") -> FHEComputeService:
+    from dustapi.application import get_request
+
+    service = service or FHEComputeService()
+
+    @app.route(f"{prefix}/datasets", methods=["GET"])
+    async def list_datasets():
+        return JsonResponse({"datasets": [service.describe(name) for name in service.datasets.names()]})
+
+    @app.route(f"{prefix}/datasets", methods=["POST", "PUT", "DELETE"])
+    async def change_dataset():
+        request = get_request()
+        name = request.args.get("name", "")
+        try:
+            if request.method == "DELETE":
+                if not service.datasets.delete(name):
+                    return JsonResponse({"error": f"No dataset named {name!r}"}, status=404)
+                return JsonResponse({"deleted": name})
+            dataset = await asyncio.to_thread(service.put_dataset, name, request.get_data())
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        return JsonResponse(dataset, status=201)
+
+    @app.route(f"{prefix}/query", methods=["POST"])
+    async def query():
+        request = get_request()
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return JsonResponse({"error": "Expected a JSON object"}, status=400)
+        try:
+            result = await asyncio.to_thread(service.query, body.get("op"), body.get("dataset", ""),
+                                             body.get("other"), body.get("weights"))
+        except KeyError as exc:
+            return JsonResponse({"error": f"No dataset named {exc.args[0]!r}"}, status=404)
+        except (ValueError, TypeError) as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        return JsonResponse(result)
+
+    return service
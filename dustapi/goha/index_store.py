@@ -0,0 +1,479 @@
+############
+#
+#  index_store.py
+#
+#  Storage backends for the SSE keyword index. Keys and values are
+#  bytes. Every backend allows concurrent readers and serializes
+#  writers. On sqlite and lmdb, write_batch applies its puts and
+#  deletes in one transaction, so a crash leaves all or none of them.
+#  dbm has no transactions: its batches are written key by key, and
+#  a crash mid-batch can leave part of one behind.
+#
+############
+
+import contextlib
+import dbm
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+SYNC_OFF = "off"
+SYNC_NORMAL = "normal"
+SYNC_FULL = "full"
+SYNC_POLICIES = (SYNC_OFF, SYNC_NORMAL, SYNC_FULL)
+
+# File suffixes the various dbm flavors create next to their path
+DBM_SUFFIXES = ("", ".db", ".dat", ".dir", ".bak", ".pag")
+
+# SQLite caps the number of bound parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+
+def _check_sync(sync: str) -> str:
+    if sync not in SYNC_POLICIES:
+        raise ValueError(f"Unknown sync policy: {sync}")
+    return sync
+
+
+class SharedLock:
+    """Any number of shared holders, or one exclusive holder. A waiting
+    exclusive holder keeps new shared holders out so it can't starve."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.shared_holders = 0
+        self.exclusive_waiting = 0
+        self.exclusive_held = False
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self.condition:
+            while self.exclusive_held or self.exclusive_waiting:
+                self.condition.wait()
+            self.shared_holders += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.shared_holders -= 1
+                if not self.shared_holders:
+                    self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self.condition:
+            self.exclusive_waiting += 1
+            while self.exclusive_held or self.shared_holders:
+                self.condition.wait()
+            self.exclusive_waiting -= 1
+            self.exclusive_held = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.exclusive_held = False
+                self.condition.notify_all()
+
+
+class IndexStore:
+    def get(self, key: bytes) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[bytes]]:
+        return [self.get(k) for k in keys]
+
+    def write_batch(self, puts: Dict[bytes, bytes], deletes: Iterable[bytes] = ()) -> None:
+        raise NotImplementedError
+
+    def keys(self) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def size_on_disk(self) -> int:
+        return 0
+
+    def compact(self) -> None:
+        pass
+
+    def integrity_check(self) -> List[str]:
+        return []
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__, "entries": len(self), "bytes_on_disk": self.size_on_disk()}
+
+    def __contains__(self, key: bytes) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: bytes) -> bytes:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: bytes, value: bytes) -> None:
+        self.write_batch({key: value})
+
+    def __delitem__(self, key: bytes) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self.write_batch({}, [key])
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self.keys()
+
+
+class MemoryIndexStore(IndexStore):
+    def __init__(self, sync: str = SYNC_NORMAL):
+        # Nothing reaches disk, but the policy is still validated so a
+        # typo does not pass silently when switching backends
+        self.sync_policy = _check_sync(sync)
+        self.data = {}
+        self.write_lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def get_many(self, keys):
+        with self.write_lock:
+            return [self.data.get(k) for k in keys]
+
+    def write_batch(self, puts, deletes=()):
+        with self.write_lock:
+            for key in deletes:
+                self.data.pop(key, None)
+            self.data.update(puts)
+
+    def keys(self):
+        with self.write_lock:
+            return iter(list(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+
+class SqliteIndexStore(IndexStore):
+    SYNC_PRAGMAS = {SYNC_OFF: "OFF", SYNC_NORMAL: "NORMAL", SYNC_FULL: "FULL"}
+
+    def __init__(self, path: str = "index.sqlite3", sync: str = SYNC_NORMAL, timeout: float = 30.0):
+        self.path = path
+        self.sync_policy = _check_sync(sync)
+        self.timeout = timeout
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        # Guards the list of per-thread connections. Kept apart from
+        # write_lock because write_batch opens connections while holding it.
+        self.connections_lock = threading.Lock()
+        self.connections = []
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("CREATE TABLE IF NOT EXISTS sse_index (key BLOB PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID")
+        # The entry count is kept by triggers so len() is O(1) and stays
+        # right for writers in other processes too.
+        if conn.execute("SELECT name FROM sqlite_master WHERE name = 'sse_meta'").fetchone() is None:
+            conn.execute("CREATE TABLE sse_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT INTO sse_meta VALUES ('entries', (SELECT COUNT(*) FROM sse_index))")
+            conn.execute("CREATE TRIGGER sse_index_insert AFTER INSERT ON sse_index "
+                         "BEGIN UPDATE sse_meta SET value = value + 1 WHERE name = 'entries'; END")
+            conn.execute("CREATE TRIGGER sse_index_delete AFTER DELETE ON sse_index "
+                         "BEGIN UPDATE sse_meta SET value = value - 1 WHERE name = 'entries'; END")
+        conn.execute("COMMIT")
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads, so every
+        # reader thread gets its own; WAL mode lets them run alongside the
+        # single writer.
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute(f"PRAGMA synchronous={self.SYNC_PRAGMAS[self.sync_policy]}")
+            # Makes INSERT OR REPLACE fire the delete trigger for the row
+            # it replaces, keeping the entry count exact
+            conn.execute("PRAGMA recursive_triggers=ON")
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    def get(self, key):
+        row = self.connection().execute("SELECT value FROM sse_index WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys):
+        conn = self.connection()
+        found = {}
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            for key, value in conn.execute(f"SELECT key, value FROM sse_index WHERE key IN ({placeholders})", chunk):
+                found[bytes(key)] = value
+        return [found.get(k) for k in keys]
+
+    def write_batch(self, puts, deletes=()):
+        with self.write_lock:
+            conn = self.connection()
+            # BEGIN IMMEDIATE takes SQLite's write lock up front, which also
+            # serializes writers living in other processes.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("DELETE FROM sse_index WHERE key = ?", ((k,) for k in deletes))
+                conn.executemany("INSERT OR REPLACE INTO sse_index (key, value) VALUES (?, ?)", puts.items())
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def keys(self):
+        for (key,) in self.connection().execute("SELECT key FROM sse_index"):
+            yield bytes(key)
+
+    def __len__(self):
+        return self.connection().execute("SELECT value FROM sse_meta WHERE name = 'entries'").fetchone()[0]
+
+    def sync(self):
+        self.connection().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def size_on_disk(self):
+        return sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal", "-shm")
+                   if os.path.exists(self.path + suffix))
+
+    def compact(self):
+        # VACUUM rewrites the file under SQLite's write lock; WAL readers
+        # keep serving from their snapshot meanwhile
+        with self.write_lock:
+            conn = self.connection()
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def integrity_check(self):
+        rows = self.connection().execute("PRAGMA integrity_check").fetchall()
+        return [row[0] for row in rows if row[0] != "ok"]
+
+    def close(self):
+        with self.connections_lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+
+class LmdbIndexStore(IndexStore):
+    def __init__(self, path: str = "index.lmdb", sync: str = SYNC_NORMAL, map_size: int = 2 ** 30, max_readers: int = 126):
+        try:
+            import lmdb
+        except ImportError:
+            raise ImportError("The lmdb index backend requires the 'lmdb' package: pip install lmdb")
+
+        self.path = path
+        self.sync_policy = _check_sync(sync)
+        # LMDB already gives lock-free readers and a single writer across
+        # threads and processes sharing the memory map. The locks here only
+        # keep this process off the environment while compact() swaps it.
+        self.write_lock = threading.Lock()
+        self.env_lock = SharedLock()
+        self.env = lmdb.open(
+            path,
+            map_size=map_size,
+            max_readers=max_readers,
+            sync=self.sync_policy != SYNC_OFF,
+            metasync=self.sync_policy == SYNC_FULL,
+        )
+
+    def get(self, key):
+        with self.env_lock.shared(), self.env.begin(buffers=False) as txn:
+            return txn.get(key)
+
+    def get_many(self, keys):
+        with self.env_lock.shared(), self.env.begin(buffers=False) as txn:
+            return [txn.get(k) for k in keys]
+
+    def write_batch(self, puts, deletes=()):
+        with self.write_lock, self.env_lock.shared(), self.env.begin(write=True) as txn:
+            for key in deletes:
+                txn.delete(key)
+            for key, value in puts.items():
+                txn.put(key, value)
+
+    def keys(self):
+        with self.env_lock.shared(), self.env.begin() as txn:
+            keys = list(txn.cursor().iternext(keys=True, values=False))
+        return iter(keys)
+
+    def __len__(self):
+        with self.env_lock.shared():
+            return self.env.stat()["entries"]
+
+    def sync(self):
+        with self.env_lock.shared():
+            self.env.sync(True)
+
+    def size_on_disk(self):
+        with self.env_lock.shared():
+            return self.env.info()["last_pgno"] * self.env.stat()["psize"]
+
+    def compact(self):
+        # Copy live pages into a fresh environment and swap it in. Writers
+        # wait for the whole copy so none is lost; readers carry on until
+        # the swap, which only waits for the reads in flight. Other
+        # processes must reopen the store afterwards.
+        import lmdb
+        tmp_path = self.path + ".compact"
+        with self.write_lock:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            self.env.copy(tmp_path, compact=True)
+            options = {"map_size": self.env.info()["map_size"], "max_readers": self.env.max_readers(),
+                       "sync": self.sync_policy != SYNC_OFF, "metasync": self.sync_policy == SYNC_FULL}
+            with self.env_lock.exclusive():
+                self.env.close()
+                for name in os.listdir(tmp_path):
+                    os.replace(os.path.join(tmp_path, name), os.path.join(self.path, name))
+                os.rmdir(tmp_path)
+                self.env = lmdb.open(self.path, **options)
+
+    def close(self):
+        with self.env_lock.exclusive():
+            self.env.close()
+
+
+class DbmIndexStore(IndexStore):
+    def __init__(self, path: str = "index", sync: str = SYNC_NORMAL):
+        self.path = path
+        self.sync_policy = _check_sync(sync)
+        # dbm handles are not thread safe, so every access is serialized
+        self.lock = threading.RLock()
+        self.db = dbm.open(path, "c")
+        # Some dbm flavors walk every key for len(), so count once here
+        self.count = len(self.db)
+        # While compact() copies entries, writes are also noted here
+        # (None marks a delete) so the copy can catch up before the swap
+        self.journal: Optional[Dict[bytes, Optional[bytes]]] = None
+        self.compact_lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.db.get(key)
+
+    def write_batch(self, puts, deletes=()):
+        with self.lock:
+            for key in deletes:
+                if key in self.db:
+                    del self.db[key]
+                    self.count -= 1
+            for key, value in puts.items():
+                if key not in self.db:
+                    self.count += 1
+                self.db[key] = value
+            if self.journal is not None:
+                self.journal.update(dict.fromkeys(deletes))
+                self.journal.update(puts)
+            if self.sync_policy == SYNC_FULL:
+                self.sync()
+
+    def keys(self):
+        with self.lock:
+            return iter(list(self.db.keys()))
+
+    def __len__(self):
+        return self.count
+
+    def files(self, path: str = None) -> List[str]:
+        path = path or self.path
+        return [path + suffix for suffix in DBM_SUFFIXES if os.path.exists(path + suffix)]
+
+    def size_on_disk(self):
+        return sum(os.path.getsize(f) for f in self.files())
+
+    def compact(self):
+        # dbm files never shrink, so rewrite the live entries into a new
+        # file and swap it in. The copy takes the lock one entry at a time,
+        # so searches and writes carry on; writes made meanwhile are
+        # replayed from the journal while the lock is held for the swap.
+        with self.compact_lock:
+            tmp_path = self.path + ".compact"
+            for f in self.files(tmp_path):
+                os.unlink(f)
+            fresh = dbm.open(tmp_path, "n")
+            try:
+                with self.lock:
+                    self.journal = {}
+                    keys = list(self.db.keys())
+                for key in keys:
+                    value = self.get(key)
+                    if value is not None:
+                        fresh[key] = value
+                with self.lock:
+                    for key, value in self.journal.items():
+                        if value is not None:
+                            fresh[key] = value
+                        elif key in fresh:
+                            del fresh[key]
+                    fresh.close()
+                    self.db.close()
+                    for f in self.files():
+                        os.unlink(f)
+                    for f in self.files(tmp_path):
+                        os.replace(f, self.path + f[len(tmp_path):])
+                    self.db = dbm.open(self.path, "c")
+            except BaseException:
+                fresh.close()
+                raise
+            finally:
+                with self.lock:
+                    self.journal = None
+
+    def sync(self):
+        with self.lock:
+            if hasattr(self.db, "sync"):
+                self.db.sync()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+INDEX_BACKENDS = {
+    "memory": MemoryIndexStore,
+    "sqlite": SqliteIndexStore,
+    "lmdb": LmdbIndexStore,
+    "dbm": DbmIndexStore,
+}
+
+
+def open_index_store(backend: str = "sqlite", path: Optional[str] = None, **options) -> IndexStore:
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend: {backend}")
+
+    store_class = INDEX_BACKENDS[backend]
+    if backend == "memory":
+        if path is not None:
+            raise ValueError("The memory index backend does not take a path")
+        return store_class(**options)
+    if path is not None:
+        options["path"] = os.fspath(path)
+    return store_class(**options)
+
+
+def migrate_index_store(source: IndexStore, target: IndexStore, batch_size: int = 10000) -> int:
+    count = 0
+    batch = {}
+    for key in source.keys():
+        batch[key] = source[key]
+        if len(batch) >= batch_size:
+            target.write_batch(batch)
+            count += len(batch)
+            batch = {}
+    if batch:
+        target.write_batch(batch)
+        count += len(batch)
+    return count
@@ -0,0 +1,210 @@
+############
+#
+#  ingest.py
+#
+#  Bulk loading of encrypted mail and index deltas into an SSEEngine.
+#  Input is either a tar archive (mail/<filename> members plus
+#  index/*.json deltas) or a stream of length-prefixed frames:
+#
+#    >B kind, >I name length, name, >Q data length, data
+#
+#  Records are applied in bounded batches; mail blobs in a batch are
+#  written in parallel and the batch's index deltas go in as one
+#  update. A checkpoint file records how many records are done so an
+#  interrupted load can be resumed; over HTTP, a client names its load
+#  with ?job= and resends the same upload to resume it.
+#
+############
+
+import asyncio
+import json
+import os
+import re
+import struct
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple
+from dustapi.helpers import secure_filename
+from dustapi.responses import JsonResponse
+
+MAIL = 1
+INDEX = 2
+KINDS = (MAIL, INDEX)
+
+FRAME_HEADER = struct.Struct(">BI")
+DATA_LENGTH = struct.Struct(">Q")
+
+TAR_MAIL_DIR = "mail/"
+TAR_INDEX_DIR = "index/"
+
+FRAME_CONTENT_TYPE = "application/x-dust-frames"
+TAR_CONTENT_TYPE = "application/x-tar"
+
+JOB_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+Record = Tuple[int, str, bytes]
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError("Truncated ingest frame")
+        data += chunk
+    return data
+
+
+def pack_frame(kind: int, name: str, data: bytes) -> bytes:
+    name = name.encode()
+    return FRAME_HEADER.pack(kind, len(name)) + name + DATA_LENGTH.pack(len(data)) + data
+
+
+def iter_frames(stream: BinaryIO) -> Iterator[Record]:
+    while True:
+        header = stream.read(FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < FRAME_HEADER.size:
+            header += _read_exact(stream, FRAME_HEADER.size - len(header))
+        kind, name_length = FRAME_HEADER.unpack(header)
+        if kind not in KINDS:
+            raise ValueError(f"Unknown ingest frame kind: {kind}")
+        name = _read_exact(stream, name_length).decode()
+        (data_length,) = DATA_LENGTH.unpack(_read_exact(stream, DATA_LENGTH.size))
+        yield kind, name, _read_exact(stream, data_length)
+
+
+def iter_tar(fileobj: BinaryIO) -> Iterator[Record]:
+    # Stream mode reads members in order without seeking
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if member.name.startswith(TAR_MAIL_DIR):
+                kind, name = MAIL, member.name[len(TAR_MAIL_DIR):]
+            elif member.name.startswith(TAR_INDEX_DIR):
+                kind, name = INDEX, member.name[len(TAR_INDEX_DIR):]
+            else:
+                continue
+            yield kind, name, archive.extractfile(member).read()
+
+
+def parse_delta(name: str, data: bytes) -> List[list]:
+    # Checked before anything in the batch is written
+    try:
+        delta = json.loads(data)
+    except ValueError:
+        raise ValueError(f"Index delta {name} is not valid JSON")
+    if not isinstance(delta, list) or not all(
+            isinstance(entry, list) and 2 <= len(entry) <= 3 and all(isinstance(part, str) for part in entry)
+            for entry in delta):
+        raise ValueError(f"Index delta {name} must be a list of [label, value] or [label, value, old label] entries")
+    return delta
+
+
+def iter_archive(path: str) -> Iterator[Record]:
+    with open(path, "rb") as f:
+        if tarfile.is_tarfile(path):
+            yield from iter_tar(f)
+        else:
+            yield from iter_frames(f)
+
+
+class BulkIngester:
+    def __init__(self, engine, batch_size: int = 256, max_batch_bytes: int = 64 * 1024 * 1024, workers: int = 4,
+                 checkpoint_path: str = None):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+
+    def load_checkpoint(self) -> int:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path) as f:
+            return json.load(f)["records"]
+
+    def save_checkpoint(self, records: int) -> None:
+        if not self.checkpoint_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.checkpoint_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"records": records}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def ingest(self, records: Iterable[Record]) -> Dict[str, int]:
+        done = self.load_checkpoint()
+        stats = {"mail": 0, "index": 0, "skipped": done}
+        position = 0
+        batch: List[Record] = []
+        batch_bytes = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sse-ingest") as executor:
+            for record in records:
+                position += 1
+                if position <= done:
+                    continue
+                batch.append(record)
+                batch_bytes += len(record[2])
+                if len(batch) >= self.batch_size or batch_bytes >= self.max_batch_bytes:
+                    self.apply_batch(batch, executor, stats)
+                    self.save_checkpoint(position)
+                    batch, batch_bytes = [], 0
+            if batch:
+                self.apply_batch(batch, executor, stats)
+                self.save_checkpoint(position)
+
+        return stats
+
+    def apply_batch(self, batch: List[Record], executor: ThreadPoolExecutor, stats: Dict[str, int]) -> None:
+        new_index = []
+        for kind, name, data in batch:
+            if kind == INDEX:
+                new_index.extend(parse_delta(name, data))
+
+        blobs = self.engine.blobs()
+        mail = [(data, secure_filename(name)) for kind, name, data in batch if kind == MAIL]
+        # Blobs land before the index entries that point at them
+        list(executor.map(lambda item: blobs.add(*item), mail))
+        if new_index:
+            self.engine.update(new_index)
+
+        stats["mail"] += len(mail)
+        stats["index"] += len(new_index)
+
+
+def ingest_route(app, path: str = "/sse/ingest", batch_size: int = 256, workers: int = 4,
+                 checkpoint_dir: str = "ingest_checkpoints"):
+    from dustapi.application import get_request
+
+    @app.route(path, methods=["POST"])
+    async def ingest():
+        request = get_request()
+        if request.mimetype == TAR_CONTENT_TYPE:
+            records = iter_tar(request.stream)
+        elif request.mimetype == FRAME_CONTENT_TYPE:
+            records = iter_frames(request.stream)
+        else:
+            return JsonResponse({"error": f"Expected {FRAME_CONTENT_TYPE} or {TAR_CONTENT_TYPE}"}, status=415)
+
+        # With a job id, a resent upload skips the records a broken one already applied
+        job = request.args.get("job")
+        checkpoint_path = None
+        if job is not None:
+            if not JOB_ID.match(job):
+                return JsonResponse({"error": f"Invalid job id: {job!r}"}, status=400)
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            checkpoint_path = os.path.join(checkpoint_dir, job + ".json")
+
+        ingester = BulkIngester(app.sse, batch_size=batch_size, workers=workers, checkpoint_path=checkpoint_path)
+        try:
+            stats = await asyncio.to_thread(ingester.ingest, records)
+        except (ValueError, tarfile.TarError) as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        return JsonResponse({"results": stats})
+
+    return ingest
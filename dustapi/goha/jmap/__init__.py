@@ -0,0 +1 @@
+from .client import JMAPClient, JMAPError
@@ -0,0 +1,319 @@
+############
+#
+#  client.py
+#
+#  Async client for the dust JMAP endpoint. Connections are kept
+#  alive in a small pool. Calls issued within a short window are
+#  coalesced into one JMAP request, and a semaphore caps how many of
+#  those requests are in flight at once. A request that never reached
+#  the server is always retried; one that may have been acted on
+#  (a timeout, a dropped connection or a 5xx) is retried only when
+#  every call in it is read-only.
+#
+############
+
+import asyncio
+import binascii
+import json
+import ssl as ssl_module
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from dustapi.tracing import child_span, inject
+from .jmap import pack_search, pack_update, pack_add_file, ADD_FILE_METHOD, SEARCH_METHOD
+
+JMAP_CORE = "urn:ietf:params:jmap:core"
+
+# Response bodies larger than this are refused
+MAX_RESPONSE_SIZE = 256 * 1024 * 1024
+
+RETRY_ERRORS = (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, OSError)
+
+# Methods that change nothing on the server, so resending them is safe
+READ_ONLY_METHODS = {SEARCH_METHOD}
+READ_ONLY_SUFFIXES = ("/get", "/query", "/changes", "/queryChanges")
+
+logger = getLogger(__name__)
+
+
+class JMAPError(Exception):
+    def __init__(self, error_type: str, description: str = None, status: int = None):
+        super().__init__(f"{error_type}: {description}" if description else error_type)
+        self.error_type = error_type
+        self.description = description
+        self.status = status
+
+
+class HTTPConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
+
+    async def request(self, method: str, host: str, path: str, body: bytes,
+                      headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}", f"Content-Length: {len(body)}",
+                 "Connection: keep-alive"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b"\r\n")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        response_headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        connection = response_headers.get("connection", "").lower()
+        if connection == "close" or (version == "HTTP/1.0" and connection != "keep-alive"):
+            self.reusable = False
+
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            data = await self.read_chunked()
+        elif "content-length" in response_headers:
+            length = int(response_headers["content-length"])
+            if length > MAX_RESPONSE_SIZE:
+                raise JMAPError("responseTooLarge", f"{length} bytes")
+            data = await self.reader.readexactly(length)
+        else:
+            # No framing: the body runs to the end of the connection
+            data = await self.reader.read(MAX_RESPONSE_SIZE)
+            self.reusable = False
+        return int(status), response_headers, data
+
+    async def read_chunked(self) -> bytes:
+        parts = []
+        size = 0
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            length = int(line.split(b";", 1)[0], 16)
+            if length == 0:
+                # Skip trailers
+                while await self.reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return b"".join(parts)
+            size += length
+            if size > MAX_RESPONSE_SIZE:
+                raise JMAPError("responseTooLarge", f"over {MAX_RESPONSE_SIZE} bytes")
+            parts.append(await self.reader.readexactly(length))
+            await self.reader.readexactly(2)
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class ConnectionPool:
+    def __init__(self, host: str, port: int, ssl: Optional[ssl_module.SSLContext] = None, max_connections: int = 8):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.idle: List[HTTPConnection] = []
+        self.max_connections = max_connections
+        # Created on first use, inside the running loop (3.9 binds it at construction)
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.opened = 0
+
+    async def acquire(self) -> HTTPConnection:
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_connections)
+        await self.slots.acquire()
+        # Drop idle connections the server has closed in the meantime
+        while self.idle:
+            conn = self.idle.pop()
+            if not conn.reader.at_eof():
+                return conn
+            conn.close()
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.opened += 1
+        return HTTPConnection(reader, writer)
+
+    def release(self, conn: HTTPConnection, reuse: bool = True) -> None:
+        if reuse and conn.reusable:
+            self.idle.append(conn)
+        else:
+            conn.close()
+        self.slots.release()
+
+    def close(self) -> None:
+        for conn in self.idle:
+            conn.close()
+        self.idle.clear()
+
+
+def is_read_only(method: str) -> bool:
+    return method in READ_ONLY_METHODS or method.endswith(READ_ONLY_SUFFIXES)
+
+
+class JMAPClient:
+    def __init__(self, url: str, max_connections: int = 8, max_in_flight: int = 4, batch_window: float = 0.002,
+                 max_batch_size: int = 64, retries: int = 2, backoff: float = 0.05, timeout: float = 30.0,
+                 headers: Dict[str, str] = None, ssl: Optional[ssl_module.SSLContext] = None):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported JMAP URL scheme: {parts.scheme}")
+        self.host = parts.netloc
+        self.path = parts.path or "/"
+        self.upload_path = self.path.rstrip("/") + "/upload"
+        if parts.scheme == "https" and ssl is None:
+            ssl = ssl_module.create_default_context()
+        self.pool = ConnectionPool(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80),
+                                   ssl, max_connections)
+        self.max_in_flight = max_in_flight
+        self.in_flight: Optional[asyncio.Semaphore] = None
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.pending: List[Tuple[List[Any], asyncio.Future]] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.tasks = set()
+        self.next_id = 0
+
+    async def __aenter__(self) -> "JMAPClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def call(self, method: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue one method call and return its response arguments."""
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(([method, args, f"c{self.next_id}"], future))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self.flush)
+        return await future
+
+    async def _call_packed(self, packed: str) -> Dict[str, Any]:
+        method, args, _ = json.loads(packed)
+        return await self.call(method, args)
+
+    async def search(self, query: List[List[str]], encoding: str = "hex", limit: int = None,
+                     cursor: str = None) -> Dict[str, Any]:
+        method, args, _ = json.loads(pack_search(query, ""))
+        if encoding != "hex":
+            args["encoding"] = encoding
+        if limit is not None:
+            args["limit"] = limit
+        if cursor is not None:
+            args["cursor"] = cursor
+        return await self.call(method, args)
+
+    async def update(self, index: List[List[str]]) -> Dict[str, Any]:
+        return await self._call_packed(pack_update(index, ""))
+
+    async def add_file(self, data: bytes, filename: str) -> Dict[str, Any]:
+        return await self._call_packed(pack_add_file(binascii.hexlify(data).decode(), "", filename))
+
+    async def add_blob(self, blob_id: str, filename: str) -> Dict[str, Any]:
+        return await self.call(ADD_FILE_METHOD, {"blobId": blob_id, "filename": filename})
+
+    async def upload(self, data: bytes, content_type: str = "application/octet-stream") -> Dict[str, Any]:
+        """Send raw bytes to the upload endpoint; returns blobId, type and size."""
+        status, body = await self.post(self.upload_path, data, content_type)
+        if status >= 400:
+            raise JMAPError("uploadFailed", body.decode("utf-8", "replace"), status)
+        return json.loads(body)
+
+    def flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self.send_batch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send_batch(self, batch: List[Tuple[List[Any], asyncio.Future]]) -> None:
+        body = json.dumps({"using": [JMAP_CORE], "methodCalls": [call for call, _ in batch]}).encode()
+        idempotent = all(is_read_only(call[0]) for call, _ in batch)
+        if self.in_flight is None:
+            self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        try:
+            async with self.in_flight:
+                status, data = await self.post(self.path, body, "application/json", idempotent)
+            if status >= 400:
+                try:
+                    error = json.loads(data)
+                except ValueError:
+                    error = {}
+                raise JMAPError(error.get("type", "requestFailed"), error.get("detail"), status)
+            responses = json.loads(data)["methodResponses"]
+        except BaseException as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+            return
+
+        futures = {call[2]: future for call, future in batch}
+        for name, args, id_num in responses:
+            future = futures.pop(id_num, None)
+            if future is None or future.done():
+                continue
+            if name == "error":
+                future.set_exception(JMAPError(args.get("type", "serverFail"), args.get("description")))
+            else:
+                future.set_result(args)
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(JMAPError("serverFail", "No response for call"))
+
+    async def post(self, path: str, body: bytes, content_type: str,
+                   idempotent: bool = False) -> Tuple[int, bytes]:
+        with child_span("jmap.post", {"http.target": path}) as span:
+            status, data = await self.send(path, body, content_type, idempotent)
+            if span is not None:
+                span.set_attribute("http.status_code", status)
+            return status, data
+
+    async def send(self, path: str, body: bytes, content_type: str,
+                   idempotent: bool = False) -> Tuple[int, bytes]:
+        # Inside a traced request the server joins the caller's trace
+        headers = inject(dict(self.headers, **{"Content-Type": content_type, "Accept": "application/json"}))
+        attempt = 0
+        while True:
+            try:
+                conn = await self.pool.acquire()
+            except RETRY_ERRORS as exc:
+                # Nothing was sent, so any request may be retried
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"JMAP connection for {path} failed ({exc!r}), retrying")
+            else:
+                ok = False
+                try:
+                    status, _, data = await asyncio.wait_for(
+                        conn.request("POST", self.host, path, body, headers), self.timeout)
+                    ok = True
+                except RETRY_ERRORS as exc:
+                    # The server may already have acted on the request
+                    if not idempotent or attempt >= self.retries:
+                        raise
+                    logger.warning(f"JMAP request to {path} failed ({exc!r}), retrying")
+                finally:
+                    self.pool.release(conn, reuse=ok)
+                if ok and (status < 500 or not idempotent or attempt >= self.retries):
+                    return status, data
+            attempt += 1
+            await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+    async def close(self) -> None:
+        self.flush()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.pool.close()
@@ -0,0 +1,279 @@
+############
+#
+#  codec.py
+#
+#  Incremental JMAP encoding and decoding. The parser reads a request
+#  from a byte stream and hands large string fields (the "file" of a
+#  putEncryptedMessage call) to a sink chunk by chunk instead of
+#  building them in memory. The encoder yields a response as a series
+#  of bounded chunks, and can emit a JSON array item by item as the
+#  items become available.
+#
+############
+
+import base64
+import binascii
+import codecs
+import json
+import re
+import tempfile
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+# Spooled strings stay in memory up to this size, then move to disk
+SPOOL_MAX_SIZE = 1024 * 1024
+
+STRING_SPECIAL = re.compile(r'["\\\x00-\x1f]')
+LITERAL_CHARS = set("+-0123456789.eEtruefalsn")
+WHITESPACE = " \t\r\n"
+SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class SpooledString:
+    """A JSON string value that was streamed to a spool file."""
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+", encoding="utf-8")
+        self.length = 0
+
+    def write(self, text: str) -> None:
+        self.file.write(text)
+        self.length += len(text)
+
+    def close(self) -> "SpooledString":
+        self.file.seek(0)
+        return self
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self) -> str:
+        return "".join(self.iter_chunks())
+
+    def __len__(self) -> int:
+        return self.length
+
+
+class StreamingParser:
+    def __init__(self, stream: BinaryIO, stream_fields: Dict[str, Callable[[], Any]] = None, chunk_size: int = CHUNK_SIZE):
+        self.stream = stream
+        self.stream_fields = stream_fields or {}
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def parse(self) -> Any:
+        value = self.value()
+        self.skip_whitespace()
+        if self.pos < len(self.buf) or self.fill():
+            raise ValueError("Extra data after JSON value")
+        return value
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        text = self.decoder.decode(data or b"", final=not data)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return bool(text)
+
+    def ensure(self, count: int) -> None:
+        while len(self.buf) - self.pos < count:
+            if not self.fill() and self.eof:
+                raise ValueError("Unexpected end of JSON input")
+
+    def peek(self) -> str:
+        self.ensure(1)
+        return self.buf[self.pos]
+
+    def skip_whitespace(self) -> None:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def expect(self, char: str) -> None:
+        self.skip_whitespace()
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def value(self, key: str = None) -> Any:
+        self.skip_whitespace()
+        char = self.peek()
+        if char == "{":
+            return self.object()
+        if char == "[":
+            return self.array()
+        if char == '"':
+            if key in self.stream_fields:
+                sink = self.stream_fields[key]()
+                self.string(sink.write)
+                return sink.close()
+            parts = []
+            self.string(parts.append)
+            return "".join(parts)
+        return self.literal()
+
+    def object(self) -> Dict[str, Any]:
+        self.expect("{")
+        result = {}
+        self.skip_whitespace()
+        if self.peek() == "}":
+            self.pos += 1
+            return result
+        while True:
+            self.skip_whitespace()
+            if self.peek() != '"':
+                raise ValueError("Expected an object key")
+            parts = []
+            self.string(parts.append)
+            key = "".join(parts)
+            self.expect(":")
+            result[key] = self.value(key)
+            self.skip_whitespace()
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return result
+            if char != ",":
+                raise ValueError(f"Expected ',' or '}}' at {char!r}")
+
+    def array(self) -> list:
+        self.expect("[")
+        result = []
+        self.skip_whitespace()
+        if self.peek() == "]":
+            self.pos += 1
+            return result
+        while True:
+            result.append(self.value())
+            self.skip_whitespace()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return result
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' at {char!r}")
+
+    def literal(self) -> Any:
+        # fill() keeps everything from self.pos on, so the token survives refills
+        length = 0
+        while True:
+            while self.pos + length < len(self.buf) and self.buf[self.pos + length] in LITERAL_CHARS:
+                length += 1
+            if self.pos + length < len(self.buf) or not self.fill():
+                break
+        token = self.buf[self.pos:self.pos + length]
+        if not token:
+            raise ValueError(f"Unexpected character {self.peek()!r}")
+        self.pos += length
+        return json.loads(token)
+
+    def string(self, emit: Callable[[str], Any]) -> None:
+        # Copies plain runs in bulk and only steps through escapes
+        self.pos += 1
+        while True:
+            match = STRING_SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                if self.pos < len(self.buf):
+                    emit(self.buf[self.pos:])
+                self.pos = len(self.buf)
+                self.ensure(1)
+                continue
+            if match.start() > self.pos:
+                emit(self.buf[self.pos:match.start()])
+            self.pos = match.start()
+            char = self.buf[self.pos]
+            if char == '"':
+                self.pos += 1
+                return
+            if char != "\\":
+                raise ValueError("Control character in string")
+            emit(self.escape())
+
+    def escape(self) -> str:
+        self.ensure(2)
+        char = self.buf[self.pos + 1]
+        if char in SIMPLE_ESCAPES:
+            self.pos += 2
+            return SIMPLE_ESCAPES[char]
+        if char != "u":
+            raise ValueError(f"Invalid escape \\{char}")
+        self.ensure(6)
+        code = int(self.buf[self.pos + 2:self.pos + 6], 16)
+        self.pos += 6
+        if 0xD800 <= code < 0xDC00:
+            try:
+                self.ensure(6)
+            except ValueError:
+                return chr(code)
+            if self.buf[self.pos:self.pos + 2] == "\\u":
+                low = int(self.buf[self.pos + 2:self.pos + 6], 16)
+                if 0xDC00 <= low < 0xE000:
+                    self.pos += 6
+                    return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00))
+        return chr(code)
+
+
+def parse_stream(stream: BinaryIO, stream_fields: Dict[str, Callable[[], Any]] = None) -> Any:
+    return StreamingParser(stream, stream_fields).parse()
+
+
+def decode_chunks(chunks: Iterable[str], encoding: str = "hex") -> Iterator[bytes]:
+    # Carry partial hex pairs / base64 quads over to the next chunk
+    group = {"hex": 2, "base64": 4}.get(encoding)
+    if encoding not in ("hex", "base64", "text"):
+        raise ValueError(f"Unknown file encoding: {encoding}")
+    carry = ""
+    for chunk in chunks:
+        if encoding == "text":
+            yield chunk.encode()
+            continue
+        chunk = carry + "".join(chunk.split())
+        cut = len(chunk) - len(chunk) % group
+        carry = chunk[cut:]
+        if cut:
+            try:
+                yield binascii.unhexlify(chunk[:cut]) if encoding == "hex" else base64.b64decode(chunk[:cut], validate=True)
+            except (binascii.Error, ValueError) as exc:
+                raise ValueError(f"file is not valid {encoding}: {exc}")
+    if carry:
+        raise ValueError(f"file is not valid {encoding}: truncated input")
+
+
+def encode_stream(value: Any, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    buffered = []
+    size = 0
+    for piece in json.JSONEncoder().iterencode(value):
+        buffered.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buffered).encode()
+            buffered, size = [], 0
+    if buffered:
+        yield "".join(buffered).encode()
+
+
+def encode_items(items: Iterable[Any], prefix: str = "[", suffix: str = "]",
+                 chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Encode `items` as the elements of a JSON array, flushing after each
+    one so a reader sees it as soon as it is produced."""
+    yield prefix.encode()
+    for n, item in enumerate(items):
+        if n:
+            yield b","
+        yield from encode_stream(item, chunk_size)
+    yield suffix.encode()
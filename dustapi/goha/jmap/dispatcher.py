@@ -0,0 +1,300 @@
+############
+#
+#  dispatcher.py
+#
+#  Server side of the dust JMAP API. A request is a batch of
+#  [method, args, id] calls; each call is looked up in a method
+#  registry and run. Independent calls run concurrently, calls that
+#  use back-references ("#arg": {"resultOf", "name", "path"}) wait for
+#  the call they refer to, and mutating calls act as barriers so
+#  reads never overtake a write issued earlier in the same batch.
+#  Responses are sent in call order, each as soon as it is ready.
+#
+############
+
+import asyncio
+import base64
+import binascii
+import contextvars
+import os
+import queue
+import threading
+from logging import getLogger
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+from werkzeug.wrappers import Response
+from dustapi.responses import JsonResponse
+from dustapi.helpers import secure_filename
+from dustapi.goha.blob_store import BlobStore
+from .jmap import SEARCH_METHOD, UPDATE_METHOD, ADD_FILE_METHOD
+from .codec import SpooledString, CHUNK_SIZE, decode_chunks, encode_items, parse_stream
+
+SEARCH_RESPONSE = "encryptedMessages"
+UPDATE_RESPONSE = "encryptedIndexUpdated"
+ADD_FILE_RESPONSE = "encryptedMessagePut"
+ERROR_RESPONSE = "error"
+
+logger = getLogger(__name__)
+
+
+class MethodError(Exception):
+    def __init__(self, error_type: str, description: str = None):
+        super().__init__(description or error_type)
+        self.error_type = error_type
+        self.description = description
+
+    def response(self, id_num: str) -> List[Any]:
+        args = {"type": self.error_type}
+        if self.description:
+            args["description"] = self.description
+        return [ERROR_RESPONSE, args, id_num]
+
+
+def resolve_path(value: Any, path: str) -> Any:
+    # JSON pointer with JMAP's "*" extension, which maps over arrays
+    parts = [p.replace("~1", "/").replace("~0", "~") for p in path.split("/")[1:]] if path else []
+    return _resolve(value, parts)
+
+
+def _resolve(value: Any, parts: List[str]) -> Any:
+    if not parts:
+        return value
+    head, rest = parts[0], parts[1:]
+    if head == "*":
+        if not isinstance(value, list):
+            raise MethodError("invalidResultReference", "'*' used on a non-array")
+        resolved = []
+        for item in value:
+            item = _resolve(item, rest)
+            resolved.extend(item if isinstance(item, list) else [item])
+        return resolved
+    try:
+        value = value[int(head)] if isinstance(value, list) else value[head]
+    except (KeyError, IndexError, ValueError, TypeError):
+        raise MethodError("invalidResultReference", f"Path segment {head!r} not found")
+    return _resolve(value, rest)
+
+
+class Method:
+    def __init__(self, name: str, handler: Callable, response_name: str, mutating: bool = False):
+        self.name = name
+        self.handler = handler
+        self.response_name = response_name
+        self.mutating = mutating
+
+    async def __call__(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        if asyncio.iscoroutinefunction(self.handler):
+            return await self.handler(args)
+        # Engine calls block on disk and crypto; keep the loop free
+        return await asyncio.to_thread(self.handler, args)
+
+
+class JMAPDispatcher:
+    def __init__(self, engine=None):
+        self.methods: Dict[str, Method] = {}
+        if engine is not None:
+            self.register_sse(engine)
+
+    def register(self, name: str, response_name: str, mutating: bool = False):
+        def decorator(handler):
+            self.methods[name] = Method(name, handler, response_name, mutating)
+            return handler
+        return decorator
+
+    def register_sse(self, engine) -> None:
+        @self.register(SEARCH_METHOD, SEARCH_RESPONSE)
+        def search(args):
+            return engine.search(args["query"], encoding=args.get("encoding", "hex"),
+                                 limit=args.get("limit"), cursor=args.get("cursor"))
+
+        @self.register(UPDATE_METHOD, UPDATE_RESPONSE, mutating=True)
+        def update(args):
+            return engine.update(args["index"])
+
+        @self.register(ADD_FILE_METHOD, ADD_FILE_RESPONSE, mutating=True)
+        def add_file(args):
+            filename = secure_filename(args["filename"])
+            blobs = engine.blobs()
+            if "blobId" in args:
+                # Bytes were sent ahead through the upload endpoint
+                blob_id = args["blobId"]
+                if not BlobStore.is_blob_id(blob_id) or not blobs.exists(blob_id):
+                    raise MethodError("invalidArguments", f"Unknown blobId: {blob_id}")
+            elif isinstance(args["file"], SpooledString):
+                try:
+                    blob_id = blobs.put_stream(decode_chunks(args["file"].iter_chunks(), args.get("encoding", "hex")))
+                except ValueError as exc:
+                    raise MethodError("invalidArguments", str(exc))
+            else:
+                blob_id = blobs.put(decode_file(args["file"], args.get("encoding", "hex")))
+            blobs.link(filename, blob_id)
+            return {"results": "GOOD ADD FILE", "blobId": blob_id}
+
+    async def dispatch(self, calls: List[List[Any]]) -> List[List[Any]]:
+        return [response async for response in self.stream(calls)]
+
+    async def stream(self, calls: List[List[Any]]) -> AsyncIterator[List[Any]]:
+        tasks = self.schedule(calls)
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def schedule(self, calls: List[List[Any]]) -> List[asyncio.Task]:
+        tasks = []
+        by_id: Dict[str, asyncio.Task] = {}
+        barrier: Optional[asyncio.Task] = None
+        for call in calls:
+            if not isinstance(call, list) or len(call) != 3:
+                tasks.append(asyncio.ensure_future(_failed(MethodError("notRequest", "Invalid method call"), None)))
+                continue
+            name, args, id_num = call
+            method = self.methods.get(name)
+            # A mutating call waits for everything before it; later calls
+            # wait for the most recent mutating call
+            waits = list(tasks) if method is not None and method.mutating else ([barrier] if barrier else [])
+            task = asyncio.ensure_future(self.run_call(method, name, args, id_num, dict(by_id), waits))
+            tasks.append(task)
+            by_id[id_num] = task
+            if method is not None and method.mutating:
+                barrier = task
+        return tasks
+
+    async def run_call(self, method: Optional[Method], name: str, args: Any, id_num: str,
+                       previous: Dict[str, asyncio.Task], waits: List[Awaitable]) -> List[Any]:
+        if waits:
+            await asyncio.wait(waits)
+        try:
+            if method is None:
+                raise MethodError("unknownMethod", f"Unknown method: {name}")
+            if not isinstance(args, dict):
+                raise MethodError("invalidArguments", "Arguments must be an object")
+            args = await self.resolve_references(args, previous)
+            result = await method(args)
+            return [method.response_name, result, id_num]
+        except MethodError as exc:
+            return exc.response(id_num)
+        except (KeyError, TypeError, ValueError) as exc:
+            return MethodError("invalidArguments", str(exc)).response(id_num)
+        except Exception as exc:
+            logger.error(f"JMAP method {name} failed: {exc}", exc_info=True)
+            return MethodError("serverFail", str(exc)).response(id_num)
+
+    async def resolve_references(self, args: Dict[str, Any], previous: Dict[str, asyncio.Task]) -> Dict[str, Any]:
+        resolved = {}
+        for key, value in args.items():
+            if not key.startswith("#"):
+                resolved[key] = value
+                continue
+            if key[1:] in args:
+                raise MethodError("invalidArguments", f"Both {key} and {key[1:]} given")
+            try:
+                ref_id, ref_name, path = value["resultOf"], value["name"], value["path"]
+            except (KeyError, TypeError):
+                raise MethodError("invalidResultReference", f"Malformed reference in {key}")
+            if ref_id not in previous:
+                raise MethodError("invalidResultReference", f"No earlier call with id {ref_id}")
+            response_name, result, _ = await previous[ref_id]
+            if response_name != ref_name:
+                raise MethodError("invalidResultReference", f"Call {ref_id} returned {response_name}, not {ref_name}")
+            resolved[key[1:]] = resolve_path(result, path)
+        return resolved
+
+
+async def _failed(error: MethodError, id_num: Optional[str]) -> List[Any]:
+    return error.response(id_num)
+
+
+_DONE = object()
+
+
+def iter_responses(dispatcher: JMAPDispatcher, calls: List[List[Any]]) -> Iterator[List[Any]]:
+    """dispatcher.stream(calls) for a WSGI body.
+
+    The body is read after the request's event loop has finished, so the
+    calls run on a loop of their own in a worker thread, and each response
+    is handed over the moment it is ready.
+    """
+    responses: "queue.Queue" = queue.Queue()
+    stopped = threading.Event()
+
+    async def produce():
+        try:
+            async for response in dispatcher.stream(calls):
+                responses.put(response)
+                if stopped.is_set():
+                    # The client went away; closing stream() cancels the rest
+                    break
+        except BaseException as exc:
+            responses.put(exc)
+        finally:
+            responses.put(_DONE)
+
+    # A copy of the request's context, so spans and the like carry over
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(asyncio.run, produce()), name="jmap-dispatch", daemon=True).start()
+    try:
+        while True:
+            item = responses.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+def decode_file(data: str, encoding: str = "hex") -> bytes:
+    try:
+        if encoding == "hex":
+            return binascii.unhexlify(data)
+        if encoding == "base64":
+            return base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError) as exc:
+        raise MethodError("invalidArguments", f"file is not valid {encoding}: {exc}")
+    if encoding == "text":
+        return data.encode()
+    raise MethodError("invalidArguments", f"Unknown file encoding: {encoding}")
+
+
+def jmap_route(app, dispatcher: JMAPDispatcher = None, path: str = "/jmap", upload_path: str = "/jmap/upload") -> JMAPDispatcher:
+    from dustapi.application import get_request
+
+    dispatcher = dispatcher or JMAPDispatcher(app.sse)
+
+    @app.route(path, methods=["POST"])
+    async def jmap_api():
+        request = get_request()
+        try:
+            # "file" strings are spooled as they arrive, never held whole
+            body = parse_stream(request.stream, {"file": SpooledString})
+        except ValueError:
+            return JsonResponse({"type": "urn:ietf:params:jmap:error:notJSON"}, status=400)
+
+        # Accept a bare call array as well as a full JMAP request object
+        if isinstance(body, dict):
+            calls = body.get("methodCalls")
+        else:
+            calls = body
+        if not isinstance(calls, list):
+            return JsonResponse({"type": "urn:ietf:params:jmap:error:notRequest"}, status=400)
+
+        responses = iter_responses(dispatcher, calls)
+        if isinstance(body, dict):
+            return Response(encode_items(responses, '{"methodResponses":[', ']}'), mimetype="application/json")
+        return Response(encode_items(responses), mimetype="application/json")
+
+    @app.route(upload_path, methods=["POST"])
+    async def jmap_upload():
+        request = get_request()
+        chunks = iter(lambda: request.stream.read(CHUNK_SIZE), b"")
+        blob_id = await asyncio.to_thread(app.sse.blobs().put_stream, chunks)
+        return JsonResponse({
+            "blobId": blob_id,
+            "type": request.mimetype or "application/octet-stream",
+            "size": os.path.getsize(app.sse.blobs().path(blob_id)),
+        }, status=201)
+
+    return dispatcher
@@ -0,0 +1,168 @@
+############
+#
+#  maintenance.py
+#
+#  Statistics, compaction and integrity scans for the SSE keyword
+#  index. Long-running jobs run on a background thread so searches
+#  keep being served, and an admin endpoint exposes the results.
+#
+############
+
+import asyncio
+import binascii
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from dustapi.responses import JsonResponse
+
+COMPACT = "compact"
+VERIFY = "verify"
+
+# Upper bounds (bytes) of the posting list size histogram
+SIZE_BUCKETS = [64, 256, 1024, 4096, 16384, 65536, float("inf")]
+
+# Keys of invalid entries reported by a scan, at most
+MAX_REPORTED = 100
+
+LABEL_LENGTH = 64  # hex-encoded HMAC-SHA256
+IV_LENGTH = 16
+BLOCK_SIZE = 16
+
+CHECKSUM_MODULUS = 2 ** 256
+
+
+def check_entry(key: bytes, value: bytes) -> Optional[str]:
+    if len(key) != LABEL_LENGTH:
+        return "label is not a hex HMAC-SHA256"
+    try:
+        binascii.unhexlify(key)
+        raw = binascii.unhexlify(value)
+    except (binascii.Error, ValueError):
+        return "not hex encoded"
+    if len(raw) < IV_LENGTH + BLOCK_SIZE or (len(raw) - IV_LENGTH) % BLOCK_SIZE:
+        return "not an IV followed by whole AES blocks"
+    return None
+
+
+class IndexMaintenance:
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.threads: Dict[str, threading.Thread] = {}
+
+    def index(self):
+        if self.engine.index is None:
+            self.engine.initialize_index()
+        return self.engine.index
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.index().stats()
+        stats["cache"] = self.engine.cache_stats()
+        stats["jobs"] = self.job_status()
+        return stats
+
+    def histogram(self) -> Dict[str, Any]:
+        counts = [0] * len(SIZE_BUCKETS)
+        total = 0
+        index = self.index()
+        for key in index.keys():
+            value = index.get(key)
+            if value is None:
+                continue
+            size = len(value)
+            total += size
+            counts[next(n for n, bound in enumerate(SIZE_BUCKETS) if size <= bound)] += 1
+        buckets = [{"le": "+Inf" if bound == float("inf") else bound, "count": count}
+                   for bound, count in zip(SIZE_BUCKETS, counts)]
+        return {"value_bytes": {"buckets": buckets, "sum": total, "count": sum(counts)}}
+
+    def compact(self) -> Dict[str, Any]:
+        index = self.index()
+        before = index.size_on_disk()
+        index.compact()
+        return {"bytes_before": before, "bytes_after": index.size_on_disk()}
+
+    def verify(self) -> Dict[str, Any]:
+        index = self.index()
+        checksum = 0
+        invalid: List[Dict[str, str]] = []
+        entries = 0
+        # Entry digests are added up, so replicas holding the same entries get
+        # the same checksum whatever order their stores return keys in
+        for key in index.keys():
+            value = index.get(key)
+            if value is None:
+                continue
+            entries += 1
+            entry = len(key).to_bytes(4, "big") + key + len(value).to_bytes(4, "big") + value
+            checksum = (checksum + int.from_bytes(hashlib.sha256(entry).digest(), "big")) % CHECKSUM_MODULUS
+            problem = check_entry(key, value)
+            if problem and len(invalid) < MAX_REPORTED:
+                invalid.append({"key": key.decode("ascii", "replace"), "problem": problem})
+        return {
+            "entries": entries,
+            "checksum": f"{checksum:064x}",
+            "invalid": invalid,
+            "backend_errors": index.integrity_check(),
+        }
+
+    def start(self, job: str) -> bool:
+        tasks = {COMPACT: self.compact, VERIFY: self.verify}
+        if job not in tasks:
+            raise ValueError(f"Unknown maintenance job: {job}")
+
+        with self.lock:
+            if job in self.threads and self.threads[job].is_alive():
+                return False
+            self.jobs[job] = {"state": "running", "started": time.time()}
+            thread = threading.Thread(target=self._run, args=(job, tasks[job]), name=f"sse-{job}", daemon=True)
+            self.threads[job] = thread
+        thread.start()
+        return True
+
+    def _run(self, job: str, task) -> None:
+        try:
+            result = task()
+            status = {"state": "done", "result": result}
+        except Exception as exc:
+            status = {"state": "failed", "error": str(exc)}
+        with self.lock:
+            status["started"] = self.jobs[job]["started"]
+            status["finished"] = time.time()
+            self.jobs[job] = status
+
+    def wait(self, job: str, timeout: float = None) -> Dict[str, Any]:
+        thread = self.threads.get(job)
+        if thread is not None:
+            thread.join(timeout)
+        return self.job_status().get(job, {})
+
+    def job_status(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {job: dict(status) for job, status in self.jobs.items()}
+
+
+def maintenance_routes(app, prefix: str = "/sse/admin") -> IndexMaintenance:
+    maintenance = IndexMaintenance(app.sse)
+
+    @app.route(f"{prefix}/stats", methods=["GET"])
+    async def index_stats():
+        return JsonResponse(maintenance.stats())
+
+    @app.route(f"{prefix}/histogram", methods=["GET"])
+    async def index_histogram():
+        # A full scan of the store, so keep it off the event loop
+        return JsonResponse(await asyncio.to_thread(maintenance.histogram))
+
+    def job_route(job):
+        async def start_job():
+            started = maintenance.start(job)
+            return JsonResponse({"job": job, "started": started, "status": maintenance.job_status()[job]}, status=202)
+        return start_job
+
+    for job in (COMPACT, VERIFY):
+        app.route(f"{prefix}/{job}", methods=["POST"])(job_route(job))
+
+    return maintenance
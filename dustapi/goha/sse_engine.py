@@ -8,14 +8,29 @@
 ############
 
 import os
+import asyncio
+import base64
 import binascii
-import dbm
+import contextlib
+import functools
+import hashlib
+import hmac
+import json
+import mmap
 import string
-from typing import List, Tuple, Dict, Any
-from Crypto.Hash import HMAC, SHA256
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Any, Iterable, Iterator, AsyncIterator, ContextManager, Optional, Union
+from werkzeug.wrappers import Response
 from Crypto.Cipher import AES
 from dustapi.responses import JsonResponse
 from dustapi.helpers import secure_filename
+from dustapi.tracing import current_span
+from dustapi.goha.index_store import IndexStore, open_index_store
+from dustapi.goha.cache import LRUCache
+from dustapi.goha.blob_store import BlobStore
 
 # Constants
 UPDATE = "update"
@@ -32,84 +47,370 @@ HEADERS = ["from", "sent", "date", "to", "subject", "cc"]
 
 DELIMETER = "++?"
 
+# Search result encodings
+HEX = "hex"
+BASE64 = "base64"
+RAW = "raw"
+ENCODINGS = (HEX, BASE64, RAW)
+TEXT_ENCODINGS = (HEX, BASE64)
+
+CHUNK_SIZE = 64 * 1024
+
+# A query term whose third element is COUNTER walks the keyword's
+# counter-labelled entries PRF(k1, "0"), PRF(k1, "1"), ... until a miss
+COUNTER = "*"
+COUNTER_BATCH = 16
+MAX_COUNTER_BATCH = 1024
+
 DEBUG = 1
 
+def _timed(op: str):
+    # Reports the call's duration to self.metrics and, inside a traced
+    # request, records it as a span; a no-op when neither is in use
+    def decorate(method):
+        @functools.wraps(method)
+        def timed(self, *args, **kwargs):
+            parent = current_span.get()
+            if self.metrics is None and parent is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                if parent is None:
+                    return method(self, *args, **kwargs)
+                with parent.tracer.span(f"sse.{op}", {"sse.index_backend": self.index_backend}):
+                    return method(self, *args, **kwargs)
+            finally:
+                if self.metrics is not None:
+                    self.metrics.observe_sse(op, time.perf_counter() - start)
+        return timed
+    return decorate
+
 class SSEEngine:
-    def __init__(self, upload_folder: str, allowed_extensions: set):
+    def __init__(self, upload_folder: str = "uploads", allowed_extensions: set = None, index_backend: str = "dbm",
+                 index_path: str = None, index_options: Dict[str, Any] = None, index: IndexStore = None,
+                 decrypt_workers: int = None, parallel_threshold: int = 64, prf_cache_size: int = 65536,
+                 posting_cache_bytes: int = 64 * 1024 * 1024, blob_store: BlobStore = None):
         self.upload_folder = upload_folder
-        self.allowed_extensions = allowed_extensions
-        self.index = None  # We'll initialize this when needed
+        self.allowed_extensions = allowed_extensions or set()
+        self.index_backend = index_backend
+        self.index_path = index_path
+        self.index_options = index_options or {}
+        self.index = index  # We'll initialize this when needed
+        self.blob_store = blob_store
+        self.decrypt_workers = decrypt_workers
+        self.parallel_threshold = parallel_threshold
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        # Searches run on parallel threads, and a second open of a dbm
+        # file fails, so the lazy stores are opened under a lock
+        self.init_lock = threading.Lock()
+        # PRF labels keyed by (k1, c), and decrypted posting lists keyed by
+        # label. A size of 0 disables either cache.
+        self.prf_cache = LRUCache(max_entries=prf_cache_size)
+        self.posting_cache = LRUCache(max_bytes=posting_cache_bytes, sizeof=_posting_size)
+        # Bumped by every write so a lookup racing an update never caches
+        # the posting list it read before the write landed.
+        self.generation = 0
+        self.generation_lock = threading.Lock()
+        # Anything with observe_sse(op, seconds), e.g. Dust's RequestMetrics
+        self.metrics = None
 
     def initialize_index(self):
-        self.index = dbm.open("index", "c")
+        with self.init_lock:
+            if self.index is None:
+                self.index = open_index_store(self.index_backend, self.index_path, **self.index_options)
+
+    def initialize_blob_store(self):
+        with self.init_lock:
+            if self.blob_store is None:
+                self.blob_store = BlobStore(self.upload_folder)
+
+    def blobs(self) -> BlobStore:
+        if self.blob_store is None:
+            self.initialize_blob_store()
+        return self.blob_store
 
     def add_mail(self, file: bytes, filename: str, id_num: str) -> Dict[str, str]:
-        filename = secure_filename(filename)
-        path = os.path.join(self.upload_folder, filename)
-        with open(path, "wb") as f:
-            f.write(file)
+        self.blobs().add(file, secure_filename(filename))
+        return {"results": "GOOD ADD FILE"}
+
+    async def add_mail_async(self, file: bytes, filename: str, id_num: str) -> Dict[str, str]:
+        await self.blobs().add_async(file, secure_filename(filename))
         return {"results": "GOOD ADD FILE"}
 
+    @_timed("update")
     def update(self, new_index: List[Tuple[str, str, str]]) -> Dict[str, str]:
-        if not self.index:
+        if self.index is None:
+            self.initialize_index()
+
+        pending = self._prepare_batch(new_index)
+        deletes = [k for k, v in pending.items() if v is None]
+        puts = {k: v for k, v in pending.items() if v is not None}
+        self.index.write_batch(puts, deletes)
+        self._invalidate_postings(pending)
+
+        return {"results": "GOOD UPDATE"}
+
+    @_timed("bulk_import")
+    def bulk_import(self, entries: Iterable[Tuple[str, str]], batch_size: int = 10000) -> int:
+        if self.index is None:
             self.initialize_index()
 
+        count = 0
+        batch = {}
+        for key, value in entries:
+            batch[key.encode('ascii', 'ignore')] = value.encode('ascii', 'ignore')
+            if len(batch) >= batch_size:
+                count += self._import_batch(batch)
+                batch = {}
+        if batch:
+            count += self._import_batch(batch)
+        return count
+
+    def _import_batch(self, batch: Dict[bytes, bytes]) -> int:
+        self.index.write_batch(batch)
+        self._invalidate_postings(batch)
+        return len(batch)
+
+    def _invalidate_postings(self, keys: Iterable[bytes]) -> None:
+        # The bump and the invalidation happen under the same lock as the
+        # check-and-put in _cache_posting, so a stale read can never be
+        # cached after its key was invalidated.
+        with self.generation_lock:
+            self.generation += 1
+            for key in keys:
+                self.posting_cache.invalidate(key)
+
+    def _cache_posting(self, generation: int, label: bytes, value: Tuple[bytes, str]) -> None:
+        with self.generation_lock:
+            if generation == self.generation:
+                self.posting_cache.put(label, value)
+
+    @staticmethod
+    def _prepare_batch(new_index: List[Tuple[str, str, str]]) -> Dict[bytes, Optional[bytes]]:
+        # Collapse the batch into the final state of every touched key
+        # (None marks a delete) so each key costs one lookup instead of a
+        # scan over the whole index, and a malformed entry aborts the
+        # batch before anything is written.
+        pending = {}
         for i in new_index:
             i0 = i[0].encode('ascii', 'ignore')
             i1 = i[1].encode('ascii', 'ignore')
-            match = i0
 
-            try:
-                if i[2]:
-                    i2 = i[2].encode('ascii', 'ignore')
-                    match = i2
-            except IndexError:
-                pass
+            if len(i) > 2 and i[2]:
+                i2 = i[2].encode('ascii', 'ignore')
+                if i2 != i0:
+                    pending[i2] = None
 
-            for k in list(self.index.keys()):
-                if match == k:
-                    del self.index[k]
-                    break
+            pending[i0] = i1
+        return pending
 
-            self.index[i0] = i1
+    def search(self, query: List[Tuple[str, str, str]], encoding: str = "hex", limit: int = None, cursor: str = None) -> Dict[str, Any]:
+        if encoding not in TEXT_ENCODINGS:
+            raise ValueError(f"search() cannot embed {encoding} results in JSON, use stream_response()")
 
-        return {"results": "GOOD UPDATE"}
+        M, next_cursor = self.page(query, limit, cursor)
+
+        if not M:
+            return {"results": "Found no results for query"}
+
+        results = {"results": [self.encode_message(m, encoding) for m in M]}
+        if next_cursor is not None:
+            results["cursor"] = next_cursor
+        return results
+
+    def page(self, query: List[Tuple[str, str, str]], limit: int = None, cursor: str = None) -> Tuple[List[str], Optional[str]]:
+        offset = 0
+        if cursor:
+            if not str(cursor).isdigit():
+                raise ValueError(f"Invalid search cursor: {cursor!r}")
+            offset = int(cursor)
+        if limit is not None and (not isinstance(limit, int) or limit < 1):
+            raise ValueError(f"Search limit must be a positive integer, got {limit!r}")
+
+        # Cursors are plain offsets, so every page re-runs the lookup; hot
+        # postings come from the posting cache on the later pages.
+        M = self.lookup(query)
+        if limit is None:
+            return M[offset:], None
+        end = offset + limit
+        return M[offset:end], (str(end) if end < len(M) else None)
+
+    async def search_stream(self, query: List[Tuple[str, str, str]], encoding: str = "hex", limit: int = None,
+                            cursor: str = None) -> AsyncIterator[Dict[str, Any]]:
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown result encoding: {encoding}")
+
+        M, _ = await asyncio.to_thread(self.page, query, limit, cursor)
+        for m in M:
+            if encoding == RAW:
+                data = await asyncio.to_thread(self.read_message, m)
+            else:
+                data = await asyncio.to_thread(self.encode_message, m, encoding)
+            yield {"name": m, "data": data}
+
+    def stream_response(self, query: List[Tuple[str, str, str]], encoding: str = "hex", limit: int = None,
+                        cursor: str = None) -> Response:
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown result encoding: {encoding}")
+
+        M, next_cursor = self.page(query, limit, cursor)
 
-    def search(self, query: List[Tuple[str, str, str]]) -> Dict[str, Any]:
-        if not self.index:
+        if encoding == RAW:
+            # Frame: >I name length, name, >Q data length, data
+            def frames():
+                for m in M:
+                    name = m.encode()
+                    yield struct.pack(">I", len(name)) + name + struct.pack(">Q", self.message_size(m))
+                    yield from self.iter_message(m)
+            body, mimetype = frames(), "application/octet-stream"
+        else:
+            # One JSON document per line
+            def lines():
+                for m in M:
+                    yield json.dumps({"name": m, "data": self.encode_message(m, encoding)}) + "\n"
+            body, mimetype = lines(), "application/x-ndjson"
+
+        response = Response(body, mimetype=mimetype)
+        if next_cursor is not None:
+            response.headers["X-Search-Cursor"] = next_cursor
+        return response
+
+    def message_path(self, name: str) -> str:
+        blob_id = self.blobs().resolve(name)
+        if blob_id is not None:
+            return self.blobs().path(blob_id)
+        # Mail written before the blob store lived flat in upload_folder
+        return os.path.join(self.upload_folder, secure_filename(name))
+
+    def message_size(self, name: str) -> int:
+        return os.path.getsize(self.message_path(name))
+
+    def read_message(self, name: str) -> bytes:
+        return b"".join(self.iter_message(name))
+
+    def iter_message(self, name: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self.message_path(name), "rb") as fd, _map(fd) as mm:
+            for start in range(0, len(mm), chunk_size):
+                yield mm[start:start + chunk_size]
+
+    @_timed("read_message")
+    def encode_message(self, name: str, encoding: str = "hex") -> str:
+        # Encode straight from the memory map, skipping the bytes copy
+        with open(self.message_path(name), "rb") as fd, _map(fd) as mm:
+            if encoding == BASE64:
+                return base64.b64encode(mm).decode()
+            return binascii.hexlify(mm).decode()
+
+    @_timed("lookup")
+    def lookup(self, query: List[Tuple[str, str, str]]) -> List[str]:
+        if self.index is None:
             self.initialize_index()
 
-        M = []
+        terms = []
         for i in query:
             k1 = i[0].encode('ascii', 'ignore')
             k2 = i[1].encode('ascii', 'ignore')
-            c = i[2].encode('ascii', 'ignore') if len(i) > 2 else None
+            c = i[2].encode('ascii', 'ignore') if len(i) > 2 and i[2] else b''
+            terms.append((k1, k2, c))
 
-            d = self.new_get(k1, c)
-            if d:
-                m = self.dec(k2, d)
-                m = ''.join(filter(lambda x: x in string.printable, m))
-                for msg in m.split(DELIMETER):
-                    if msg and msg not in M:
-                        M.append(msg)
+        counter_terms = [n for n, term in enumerate(terms) if term[2] == COUNTER.encode()]
+        fixed_terms = [n for n, term in enumerate(terms) if term[2] != COUNTER.encode()]
 
-        if not M:
-            return {"results": "Found no results for query"}
+        # Derive every label first so the index sees one multi-get
+        labels = {n: self.label(terms[n][0], terms[n][2]) for n in fixed_terms}
 
-        buf = []
-        for m in M:
-            path = os.path.join(self.upload_folder, m)
-            with open(path, "rb") as fd:
-                buf.append(binascii.hexlify(fd.read()).decode())
+        postings = [[] for _ in terms]
+        missing = []
+        for n in fixed_terms:
+            term, label = terms[n], labels[n]
+            cached = self.posting_cache.get(label)
+            if cached is not None and cached[0] == term[1]:
+                postings[n] = [cached[1]]
+            else:
+                missing.append(n)
+
+        if missing:
+            generation = self.generation
+            entries = self.index.get_many([labels[n] for n in missing])
+            found = [(n, d) for n, d in zip(missing, entries) if d]
+            decrypted = self.decrypt_all([(terms[n][1], d) for n, d in found])
+            for (n, _), m in zip(found, decrypted):
+                postings[n] = [m]
+                self._cache_posting(generation, labels[n], (terms[n][1], m))
+
+        for n in counter_terms:
+            k1, k2, _ = terms[n]
+            postings[n] = self.decrypt_all([(k2, d) for d in self.counter_entries(k1)])
 
-        return {"results": buf}
+        # dict keeps first-seen order and makes the dedupe O(n)
+        M = {}
+        for m in (m for term_postings in postings for m in term_postings):
+            m = ''.join(filter(lambda x: x in string.printable, m))
+            for msg in m.split(DELIMETER):
+                if msg:
+                    M[msg] = None
 
-    def new_get(self, k1: str, c: str) -> str:
-        F = self.PRF(k1, c or '')
-        return self.index.get(F)
+        return list(M)
+
+    def decrypt_all(self, hits: List[Tuple[bytes, bytes]]) -> List[str]:
+        if len(hits) < self.parallel_threshold:
+            return [self.dec(k2, d) for k2, d in hits]
+
+        # pycryptodome drops the GIL inside AES, so decrypts overlap
+        executor = self.get_executor()
+        return list(executor.map(lambda hit: self.dec(*hit), hits))
+
+    def label(self, k1: bytes, c: bytes) -> bytes:
+        key = (k1, c)
+        label = self.prf_cache.get(key)
+        if label is None:
+            label = self.PRF(k1, c).encode()
+            self.prf_cache.put(key, label)
+        return label
+
+    def counter_entries(self, k1: bytes) -> List[bytes]:
+        if self.index is None:
+            self.initialize_index()
+
+        # Fetch counters in growing batches and stop at the first gap
+        entries = []
+        start, size = 0, COUNTER_BATCH
+        while True:
+            labels = [label.encode() for label in prf_labels(k1, range(start, start + size))]
+            for d in self.index.get_many(labels):
+                if not d:
+                    return entries
+                entries.append(d)
+            start += size
+            size = min(size * 2, MAX_COUNTER_BATCH)
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {"prf": self.prf_cache.stats(), "postings": self.posting_cache.stats()}
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.decrypt_workers, thread_name_prefix="sse-decrypt")
+            return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.blob_store is not None:
+            self.blob_store.close()
+            self.blob_store = None
+
+    def new_get(self, k1: bytes, c: bytes) -> bytes:
+        F = self.PRF(k1, c or b'')
+        return self.index.get(F.encode())
 
     @staticmethod
-    def dec(k2: str, d: str) -> str:
+    def dec(k2: bytes, d: bytes) -> str:
         d_bin = binascii.unhexlify(d)
         iv = d_bin[:16]
         cipher = AES.new(k2[:16], AES.MODE_CBC, iv)
@@ -117,9 +418,18 @@ class SSEEngine:
         return doc.decode()
 
     @staticmethod
-    def PRF(k: str, data: str) -> str:
-        hmac = HMAC.new(k.encode(), data.encode(), SHA256)
-        return hmac.hexdigest()
+    def enc(k2: bytes, doc: str) -> bytes:
+        # Client-side counterpart of dec. NUL padding is dropped again by
+        # the printable filter in lookup.
+        data = doc.encode()
+        data += b"\0" * (-len(data) % AES.block_size)
+        iv = os.urandom(16)
+        cipher = AES.new(k2[:16], AES.MODE_CBC, iv)
+        return binascii.hexlify(iv + cipher.encrypt(data))
+
+    @staticmethod
+    def PRF(k: Union[str, bytes], data: Union[str, bytes]) -> str:
+        return PRF(k, data)
 
     def response(self, event_generator):
         async def streaming_response():
@@ -128,20 +438,16 @@ class SSEEngine:
 
         return JsonResponse(streaming_response())
 
-# The following functions are kept for reference but are not used in the class
-def get(index_n, k1, count):
-    cc = 0
-    while cc < count:
-        F = PRF(k1, str(cc))
-        if (DEBUG > 1): 
-            print("index key = " + index_n[0])
-            print("PRF of k1 and %d = %s\n" % (cc, F))
-        if F == index_n[0]:
-            print("C: " + str(cc))
-            return index_n[1]
-        cc = cc + 1
-    return 0
+def _posting_size(label: bytes, value: Tuple[bytes, str]) -> int:
+    return len(label) + len(value[0]) + len(value[1])
+
+def _map(fd) -> ContextManager[Union[mmap.mmap, bytes]]:
+    # mmap refuses empty files
+    if os.fstat(fd.fileno()).st_size == 0:
+        return contextlib.nullcontext(b"")
+    return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
 
+# The following functions are kept for reference but are not used in the class
 def get_header(index_n, k1, header):
     F = PRF(k1, header)
     if (DEBUG > 1): 
@@ -152,15 +458,25 @@ def get_header(index_n, k1, header):
     return 0
 
 def get_index_len(index):
-    count = 0
-    for k, v in index.items():
-        count = count + 1
-        if (DEBUG > 1):
-            print("K: " + k)
-            print("V: " + v)
-            print("\n")
-    return count
-
-def PRF(k: str, data: str) -> str:
-    hmac = HMAC.new(k.encode(), data.encode(), SHA256)
-    return hmac.hexdigest()
+    # Index stores keep their entry count, so this no longer walks the keys
+    return len(index)
+
+def PRF(k: Union[str, bytes], data: Union[str, bytes]) -> str:
+    if isinstance(k, str):
+        k = k.encode()
+    if isinstance(data, str):
+        data = data.encode()
+    # stdlib hmac runs in C and yields the same HMAC-SHA256 as
+    # Crypto.Hash.HMAC at a fraction of the per-call overhead
+    return hmac.new(k, data, hashlib.sha256).hexdigest()
+
+def prf_labels(k: Union[str, bytes], counters: Iterable[int]) -> Iterator[str]:
+    # Key the HMAC once and copy its state per counter instead of
+    # rekeying, which is most of the cost of a single PRF call.
+    if isinstance(k, str):
+        k = k.encode()
+    keyed = hmac.new(k, digestmod=hashlib.sha256)
+    for counter in counters:
+        h = keyed.copy()
+        h.update(str(counter).encode())
+        yield h.hexdigest()
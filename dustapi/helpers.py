@@ -1,4 +1,5 @@
 import os
+import threading
 import json
 from .responses import JsonResponse
 from werkzeug.utils import secure_filename
@@ -22,3 +23,36 @@ def create_response(data, status=200, content_type='application/json'):
 def render_template(app, template_name, **context):
     """Render a template with the given context."""
     return app.render_template(template_name, **context)
+
+class lazy:
+    """Attribute built by factory(instance) on first access; assigning to it replaces the built value."""
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.lock = threading.RLock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            pass
+        with self.lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.factory(instance)
+            return instance.__dict__[self.name]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+def is_loaded(instance, name):
+    """Whether a lazy attribute has been built or assigned yet."""
+    return name in instance.__dict__
+
+def unload(instance, name):
+    """Drop a lazy attribute so the next access builds it again."""
+    instance.__dict__.pop(name, None)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import subprocess
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+# Reported for every run; lower is better except for rps
+METRICS = ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'rps')
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted samples."""
+    if not samples:
+        return 0.0
+    rank = max(1, -(-len(samples) * q // 100))
+    return samples[int(rank) - 1]
+
+def summarize(latencies: List[float], elapsed: float, errors: int, statuses: Dict[int, int]) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        'requests': total,
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(total / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+async def run_load(url: str, duration: float = 10.0, requests: int = None, concurrency: int = 16, method: str = 'GET',
+                   body: bytes = b'', headers: Dict[str, str] = None, warmup: float = 1.0) -> Dict[str, Any]:
+    """Drive a running server from `concurrency` keep-alive clients.
+
+    Runs for `duration` seconds, or until `requests` have been sent when given.
+    Requests sent during `warmup` are not counted.
+    """
+    from .goha.jmap.client import HTTPConnection
+
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+    ssl = parts.scheme == 'https' or None
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    host_header = parts.netloc
+    headers = headers or {}
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    remaining = requests
+    loop = asyncio.get_running_loop()
+    measuring_from = loop.time() + warmup
+    deadline = measuring_from + duration
+
+    async def client():
+        nonlocal errors, remaining
+        conn = None
+        while True:
+            now = loop.time()
+            measuring = now >= measuring_from
+            if measuring and requests is not None:
+                if remaining <= 0:
+                    break
+                remaining -= 1
+            elif now >= deadline:
+                break
+            start = time.perf_counter()
+            try:
+                if conn is None:
+                    reader, writer = await asyncio.open_connection(host, port, ssl=ssl)
+                    conn = HTTPConnection(reader, writer)
+                status, _, _ = await conn.request(method, host_header, path, body, headers)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                if measuring:
+                    errors += 1
+                if conn is not None:
+                    conn.close()
+                conn = None
+                continue
+            if measuring:
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+            if not conn.reusable:
+                # Servers that close after each response pay for a new connection every time
+                conn.close()
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = loop.time() - measuring_from
+    return summarize(latencies, elapsed, errors, statuses)
+
+# Results are appended as JSON lines so runs from different commits can be compared
+def current_commit(cwd: str = None) -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def record(path: str, name: str, results: Dict[str, Any], commit: str = None) -> Dict[str, Any]:
+    entry = {'name': name, 'commit': commit or current_commit(), 'time': time.time(), 'results': results}
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+    return entry
+
+def history(path: str, name: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return [entry for entry in entries if entry['name'] == name]
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any], threshold: float = 0.1,
+            metrics=METRICS) -> List[str]:
+    """Describe every metric that got worse by more than `threshold` (0.1 is 10%)."""
+    regressions = []
+    for metric in metrics:
+        old, new = previous.get(metric), current.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if metric == 'rps' or metric.endswith('_per_s'):
+            change = -change
+        if change > threshold:
+            regressions.append(f'{metric}: {old} -> {new} ({change:+.0%} worse)')
+    return regressions
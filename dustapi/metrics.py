@@ -0,0 +1,287 @@
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; the same defaults as the Prometheus client libraries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# Requests that matched no route share one label value, so bad URLs can't add series
+UNMATCHED = 'unmatched'
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+class Metric:
+    """A metric whose values live in per-thread shards.
+
+    Recording touches only the calling thread's shard, so the hot path takes
+    no lock. Shards of finished threads are folded into `retired` once.
+    """
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.local = threading.local()
+        self.shards: Dict[int, dict] = {}
+        self.retired: dict = {}
+        self.lock = threading.Lock()
+
+    def shard(self) -> dict:
+        try:
+            return self.local.values
+        except AttributeError:
+            pass
+        values = self.local.values = {}
+        with self.lock:
+            self.shards[id(values)] = values
+        # Thread objects go away with their thread, taking the shard with them
+        weakref.finalize(threading.current_thread(), self.retire, id(values))
+        return values
+
+    def retire(self, key: int) -> None:
+        with self.lock:
+            values = self.shards.pop(key, None)
+            if values:
+                for labels, value in list(values.items()):
+                    self.retired[labels] = self.merge(self.retired.get(labels), value)
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+    def copy(self, value):
+        return value
+
+    def collect(self) -> Dict[Tuple[str, ...], Any]:
+        with self.lock:
+            totals = {labels: self.copy(value) for labels, value in self.retired.items()}
+            shards = list(self.shards.values())
+        for values in shards:
+            # list() of a dict's items runs without releasing the GIL
+            for labels, value in list(values.items()):
+                totals[labels] = self.merge(totals.get(labels), self.copy(value))
+        return totals
+
+class Counter(Metric):
+    kind = COUNTER
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        values = self.shard()
+        values[labels] = values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = GAUGE
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        values = self.shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+class Histogram(Metric):
+    """Per-bucket counts (not cumulative), then the sum and the count."""
+    kind = HISTOGRAM
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        values = self.shard()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 3)
+        # bisect_left puts a value equal to a bound in that bucket, as `le` requires
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def merge(self, total, value):
+        if total is None:
+            return value
+        return [a + b for a, b in zip(total, value)]
+
+    def copy(self, value):
+        return list(value)
+
+class MetricsRegistry:
+    """Metrics for one process.
+
+    With a `directory`, each process also writes its values there (at most every
+    `flush_interval` seconds, and at exit) and collect() adds up every process's
+    file, so any worker can answer a scrape for all of them.
+    """
+    def __init__(self, directory: str = None, flush_interval: float = 1.0):
+        self.metrics: Dict[str, Metric] = {}
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.last_flush = 0.0
+        self.pid = os.getpid()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {'kind': metric.kind, 'values': [[list(labels), value] for labels, value in metric.collect().items()]}
+                for name, metric in self.metrics.items()}
+
+    def path(self, pid: int) -> str:
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def maybe_flush(self) -> None:
+        if self.directory and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.directory:
+            return
+        self.last_flush = time.monotonic()
+        # Forked workers inherit the registry but must write their own file
+        self.pid = os.getpid()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': self.pid, 'metrics': self.snapshot()}, f)
+        os.replace(tmp_path, self.path(self.pid))
+
+    def close(self) -> None:
+        """Write a final snapshot and stop flushing at exit."""
+        if self.directory:
+            self.flush()
+            atexit.unregister(self.flush)
+
+    def other_processes(self) -> Iterable[Tuple[bool, Dict[str, Dict[str, Any]]]]:
+        own = self.path(os.getpid())
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not (name.startswith('metrics-') and name.endswith('.json')) or path == own:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield _alive(data['pid']), data['metrics']
+
+    def collect(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        totals = {name: metric.collect() for name, metric in self.metrics.items()}
+        if self.directory:
+            for alive, metrics in self.other_processes():
+                for name, data in metrics.items():
+                    metric = self.metrics.get(name)
+                    # A dead worker's requests still count; its in-flight gauge doesn't
+                    if metric is None or (metric.kind == GAUGE and not alive):
+                        continue
+                    for labels, value in data['values']:
+                        labels = tuple(labels)
+                        totals[name][labels] = metric.merge(totals[name].get(labels), value)
+        return totals
+
+    def render(self) -> str:
+        """The Prometheus text exposition format."""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {_escape_help(metric.documentation)}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labels, value in sorted(values.items()):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind != HISTOGRAM:
+                    lines.append(f'{name}{_labels(pairs)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(pairs + [("le", _number(bound))])} {_number(cumulative)}')
+                lines.append(f'{name}_sum{_labels(pairs)} {_number(value[-2])}')
+                lines.append(f'{name}_count{_labels(pairs)} {_number(value[-1])}')
+        return '\n'.join(lines) + '\n'
+
+class RequestMetrics(MetricsRegistry):
+    """The metrics Dust records for itself."""
+    def __init__(self, directory: str = None, flush_interval: float = 1.0, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(directory, flush_interval)
+        self.requests = self.counter('dust_requests_total', 'Requests handled.', ('method', 'route', 'status'))
+        self.in_flight = self.gauge('dust_requests_in_flight', 'Requests being handled.')
+        self.latency = self.histogram('dust_request_duration_seconds', 'Time to handle a request.',
+                                      ('method', 'route'), buckets)
+        self.sessions = self.counter('dust_session_lookups_total', 'Session store lookups by result.', ('result',))
+        self.sse_latency = self.histogram('dust_sse_operation_duration_seconds', 'Time spent in SSEEngine operations.',
+                                          ('op',), buckets)
+        self.websockets = self.gauge('dust_websocket_connections', 'Open WebSocket connections.', ('path',))
+        self.websockets_total = self.counter('dust_websocket_connections_total', 'WebSocket connections accepted.',
+                                             ('path',))
+
+    def observe_request(self, method: str, route: Optional[str], status: int, seconds: float) -> None:
+        route = route or UNMATCHED
+        self.requests.inc(method, route, str(status))
+        self.latency.observe(seconds, method, route)
+        self.maybe_flush()
+
+    def observe_session(self, hit: bool) -> None:
+        self.sessions.inc('hit' if hit else 'miss')
+
+    def observe_sse(self, op: str, seconds: float) -> None:
+        self.sse_latency.observe(seconds, op)
+
+    def websocket_opened(self, path: str) -> None:
+        self.websockets.inc(path)
+        self.websockets_total.inc(path)
+
+    def websocket_closed(self, path: str) -> None:
+        self.websockets.dec(path)
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _escape_value(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_value(str(value))}"' for name, value in pairs) + '}'
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -1,6 +1,23 @@
-from pydantic import BaseModel
-from typing import Dict, List
-import yaml
+import gzip
+import json
+import threading
+from typing import Dict, List, Optional
+from .conditional import weak_etag
+
+JSON = 'json'
+YAML = 'yaml'
+MIMETYPES = {JSON: 'application/json', YAML: 'application/yaml'}
+
+# Specs smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+class SpecDocument:
+    """One serialized form of the spec, kept with its gzip copy and ETag."""
+    def __init__(self, data: bytes, fmt: str):
+        self.data = data
+        self.mimetype = MIMETYPES[fmt]
+        self.etag = weak_etag(data)
+        self.gzipped = gzip.compress(data, mtime=0) if len(data) >= GZIP_MIN_SIZE else None
 
 class OpenAPI:
     def __init__(self, title: str, version: str, description: str):
@@ -8,28 +25,92 @@ class OpenAPI:
         self.version = version
         self.description = description
         self.paths = {}
+        self.components = {}
+        # Serialized documents keyed by (format, tag), built on first request
+        self.documents = {}
+        self.generation = 0
+        self.lock = threading.Lock()
 
-    def add_path(self, path: str, method: str, summary: str, description: str, responses: Dict, parameters: List = None, request_body: Dict = None):
-        if path not in self.paths:
-            self.paths[path] = {}
-        self.paths[path][method.lower()] = {
+    def add_path(self, path: str, method: str, summary: str, description: str, responses: Dict, parameters: List = None, request_body: Dict = None, tags: List[str] = None):
+        operation = {
             "summary": summary,
             "description": description,
             "responses": responses
         }
         if parameters:
-            self.paths[path][method.lower()]["parameters"] = parameters
+            operation["parameters"] = parameters
         if request_body:
-            self.paths[path][method.lower()]["requestBody"] = request_body
+            operation["requestBody"] = request_body
+        if tags:
+            operation["tags"] = list(tags)
+        with self.lock:
+            self.paths.setdefault(path, {})[method.lower()] = operation
+            self.generation += 1
+            self.documents.clear()
 
-    def generate(self):
-        openapi_schema = {
-            "openapi": "3.0.0",
+    def add_schemas(self, schemas: Dict[str, Dict]):
+        if not schemas:
+            return
+        with self.lock:
+            self.components.update(schemas)
+            self.generation += 1
+            self.documents.clear()
+
+    def tags(self) -> List[str]:
+        with self.lock:
+            return sorted({tag for operations in self.paths.values() for op in operations.values() for tag in op.get("tags", ())})
+
+    def schema(self, tag: Optional[str] = None) -> Dict:
+        return self._schema(tag)[0]
+
+    def _schema(self, tag: Optional[str] = None):
+        with self.lock:
+            generation = self.generation
+            components = dict(self.components)
+            if tag is None:
+                paths = {path: dict(operations) for path, operations in self.paths.items()}
+            else:
+                # Only walk the operations carrying this tag
+                paths = {}
+                for path, operations in self.paths.items():
+                    tagged = {method: op for method, op in operations.items() if tag in op.get("tags", ())}
+                    if tagged:
+                        paths[path] = tagged
+        schema = {
+            "openapi": "3.1.0",
             "info": {
                 "title": self.title,
                 "version": self.version,
                 "description": self.description
             },
-            "paths": self.paths
+            "paths": paths
         }
-        return yaml.dump(openapi_schema)
+        if components:
+            schema["components"] = {"schemas": components}
+        return schema, generation
+
+    def document(self, fmt: str = JSON, tag: Optional[str] = None) -> SpecDocument:
+        """The serialized spec, or just `tag`'s operations; KeyError for a tag no route has."""
+        if fmt not in MIMETYPES:
+            raise ValueError(f"Unknown OpenAPI format: {fmt}")
+        key = (fmt, tag)
+        document = self.documents.get(key)
+        if document is None:
+            # Tags come from query strings, so only known ones get a cache entry
+            if tag is not None and tag not in self.tags():
+                raise KeyError(tag)
+            schema, generation = self._schema(tag)
+            if fmt == JSON:
+                data = json.dumps(schema, separators=(',', ':')).encode()
+            else:
+                import yaml
+                data = yaml.dump(schema).encode()
+            document = SpecDocument(data, fmt)
+            with self.lock:
+                # Don't cache a document an add_path made stale meanwhile
+                if generation == self.generation:
+                    self.documents[key] = document
+        return document
+
+    def generate(self):
+        return self.document(YAML).data.decode()
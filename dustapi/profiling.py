@@ -0,0 +1,117 @@
+import cProfile
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Phases of Dust.async_wsgi_app, in order; the dispatch phase excludes the handler
+PHASES = ('parse', 'session', 'dispatch', 'handler', 'serialize', 'logging', 'session_save')
+
+# Sent back on a captured request, naming the profile file
+PROFILE_FILE_HEADER = 'X-Dust-Profile-File'
+
+slow_logger = logging.getLogger('dustapi.slow_requests')
+
+class RequestTimer:
+    """Splits a request's time into phases; each mark() ends the current phase."""
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.intervals: List[Tuple[str, float, float]] = []
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.intervals.append((phase, self.last, now))
+        self.last = now
+
+    @property
+    def total(self) -> float:
+        return self.last - self.start
+
+class Profiler:
+    """Per-request cProfile captures and a slow-request log.
+
+    A request is captured when it carries `header` (matching `token` when one is
+    set), when it falls in the sampled `sample_rate` fraction of traffic, or
+    while captures are armed with capture_next(). Each capture is written to
+    `directory` as a file pstats, snakeviz or `python -m pstats` can load.
+    """
+    def __init__(self, directory: str = 'profiles', header: Optional[str] = 'X-Dust-Profile', token: str = None,
+                 sample_rate: float = 0.0, slow_ms: float = None, keep: int = 100):
+        self.directory = directory
+        self.header = header
+        self.token = token
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.slow_requests: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self.captures: Deque[str] = deque(maxlen=keep)
+        self.armed = 0
+        self.armed_path = None
+        self.lock = threading.Lock()
+
+    def capture_next(self, count: int = 1, path: str = None) -> None:
+        """Capture the next `count` requests, or only those for `path`."""
+        with self.lock:
+            self.armed = count
+            self.armed_path = path
+
+    def wants_capture(self, environ) -> bool:
+        if self.header:
+            value = environ.get('HTTP_' + self.header.upper().replace('-', '_'))
+            if value is not None and (self.token is None or hmac.compare_digest(value.encode('latin-1'), self.token.encode())):
+                return True
+        if self.armed:
+            with self.lock:
+                if self.armed and self.armed_path in (None, environ.get('PATH_INFO')):
+                    self.armed -= 1
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, environ) -> Optional[cProfile.Profile]:
+        if not self.wants_capture(environ):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (a debugger, coverage) already owns this thread
+            return None
+        return profile
+
+    def finish(self, request, response, timer: RequestTimer, profile: Optional[cProfile.Profile]) -> None:
+        if profile is not None:
+            profile.disable()
+            name = self.write(profile, request)
+            response.headers[PROFILE_FILE_HEADER] = name
+        total_ms = timer.total * 1000
+        if self.slow_ms is not None and total_ms >= self.slow_ms:
+            entry = {
+                'time': time.time(),
+                'method': request.method,
+                'path': request.path,
+                'route': request.route_path,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 3),
+                'phases_ms': {phase: round(seconds * 1000, 3) for phase, seconds in timer.phases.items()},
+            }
+            self.slow_requests.append(entry)
+            slow_logger.warning(json.dumps(entry))
+
+    def write(self, profile: cProfile.Profile, request) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        route = re.sub(r'[^A-Za-z0-9]+', '_', request.route_path or request.path).strip('_') or 'root'
+        name = f'{time.strftime("%Y%m%dT%H%M%S")}-{request.method}-{route[:60]}-{uuid.uuid4().hex[:8]}.prof'
+        profile.dump_stats(os.path.join(self.directory, name))
+        self.captures.append(name)
+        return name
+
+    def recent_slow_requests(self) -> List[Dict[str, Any]]:
+        return list(self.slow_requests)
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Sequence, Tuple, Union
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+GCRA = 'gcra'
+TOKEN_BUCKET = 'token_bucket'
+
+class Decision:
+    def __init__(self, allowed: bool, limit: int, remaining: int, retry_after: float, reset_after: float):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        # Seconds until a request would be allowed, and until the bucket is full again
+        self.retry_after = retry_after
+        self.reset_after = reset_after
+
+    def headers(self):
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+def gcra(state: Optional[Tuple[float, ...]], now: float, interval: float, burst: int, cost: int):
+    # The whole state is the theoretical arrival time of the next request
+    tat = max(state[0], now) if state else now
+    new_tat = tat + interval * cost
+    allow_at = new_tat - interval * burst
+    if now < allow_at:
+        return state, Decision(False, burst, 0, allow_at - now, tat - now)
+    remaining = int((now - allow_at) / interval + 1e-9)
+    return (new_tat,), Decision(True, burst, remaining, 0.0, new_tat - now)
+
+def token_bucket(state: Optional[Tuple[float, ...]], now: float, interval: float, burst: int, cost: int):
+    tokens, last = state if state else (float(burst), now)
+    tokens = min(float(burst), tokens + max(0.0, now - last) / interval)
+    if tokens < cost:
+        return (tokens, now), Decision(False, burst, int(tokens), (cost - tokens) * interval, (burst - tokens) * interval)
+    tokens -= cost
+    return (tokens, now), Decision(True, burst, int(tokens), 0.0, (burst - tokens) * interval)
+
+ALGORITHMS = {GCRA: gcra, TOKEN_BUCKET: token_bucket}
+
+class MemoryStore:
+    """Limiter state for this process: one small tuple per key, least recently used keys evicted first."""
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def update(self, key: str, decide: Callable) -> Decision:
+        with self.lock:
+            state, decision = decide(self.states.get(key))
+            if state is not None:
+                self.states[key] = state
+                self.states.move_to_end(key)
+                if len(self.states) > self.max_keys:
+                    # An evicted key starts over with a full bucket
+                    self.states.popitem(last=False)
+            return decision
+
+    def __len__(self):
+        return len(self.states)
+
+class SQLiteStore:
+    """Limiter state in a SQLite file, shared by worker processes on one host."""
+    def __init__(self, path: str = 'ratelimit.sqlite3', timeout: float = 5.0, sweep_every: int = 1000):
+        self.path = path
+        self.sweep_every = sweep_every
+        self.updates = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS dust_ratelimit '
+                          '(key TEXT PRIMARY KEY, state TEXT NOT NULL, expires REAL NOT NULL) WITHOUT ROWID')
+
+    def update(self, key: str, decide: Callable) -> Decision:
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so processes can't interleave read and write
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('SELECT state FROM dust_ratelimit WHERE key = ?', (key,)).fetchone()
+                state, decision = decide(tuple(json.loads(row[0])) if row else None)
+                if state is not None:
+                    self.conn.execute('INSERT OR REPLACE INTO dust_ratelimit VALUES (?, ?, ?)',
+                                      (key, json.dumps(state), time.time() + decision.reset_after))
+                self.updates += 1
+                if self.updates % self.sweep_every == 0:
+                    # Keys whose bucket has refilled hold nothing worth keeping
+                    self.conn.execute('DELETE FROM dust_ratelimit WHERE expires < ?', (time.time(),))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            return decision
+
+    def close(self) -> None:
+        self.conn.close()
+
+# Key functions map a request to the key it is limited under; None skips the limit
+def client_ip(request) -> Optional[str]:
+    # Clients with no known address share a bucket rather than go unlimited
+    return request.remote_addr or ''
+
+def forwarded_ip(trusted_proxies: int = 1) -> Callable:
+    """The client address as seen by the outermost of `trusted_proxies` proxies in X-Forwarded-For."""
+    def key(request):
+        hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+        return client_ip(request)
+    return key
+
+def jwt_subject(app, fallback: Callable = client_ip) -> Callable:
+    """The `sub` of a valid bearer token, else `fallback`'s key."""
+    def key(request):
+        auth = request.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            payload, _ = app.jwt_handler.decode(auth[len('Bearer '):])
+            if payload and payload.get('sub') is not None:
+                return f"sub:{payload['sub']}"
+        return fallback(request)
+    return key
+
+class RateLimit:
+    """Allow `rate` requests per `per` seconds for each key, with bursts of up to `burst`."""
+    def __init__(self, rate: float, per: float = 1.0, burst: int = None, algorithm: str = GCRA,
+                 key: Callable = client_ip, store=None, scope: str = '', clock: Callable[[], float] = time.time):
+        if rate <= 0 or per <= 0:
+            raise ValueError("rate and per must be positive")
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        self.interval = per / rate
+        self.burst = burst or max(1, math.ceil(rate))
+        self.algorithm = ALGORITHMS[algorithm]
+        self.key = key
+        self.store = store if store is not None else MemoryStore()
+        self.scope = scope
+        self.clock = clock
+
+    def hit(self, key: str, cost: int = 1) -> Decision:
+        now = self.clock()
+        return self.store.update(f'{self.scope}:{key}',
+                                 lambda state: self.algorithm(state, now, self.interval, self.burst, cost))
+
+    def check(self, request) -> Optional[Decision]:
+        key = self.key(request)
+        if key is None:
+            return None
+        return self.hit(key)
+
+class ConcurrencyLimit:
+    """At most `limit` requests at once. Up to `max_waiting` more queue for a slot
+    for at most `timeout` seconds; the rest are turned away straight away."""
+    def __init__(self, limit: int, max_waiting: int = None, timeout: float = 1.0):
+        self.limit = limit
+        self.max_waiting = limit if max_waiting is None else max_waiting
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(limit)
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    async def acquire(self) -> bool:
+        if self.slots.acquire(blocking=False):
+            return True
+        with self.lock:
+            if self.waiting >= self.max_waiting:
+                return False
+            self.waiting += 1
+        try:
+            # Requests may run on different threads and event loops, so wait on a thread
+            return await asyncio.to_thread(self.slots.acquire, True, self.timeout)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def release(self) -> None:
+        self.slots.release()
+
+def too_many_requests(decision: Decision) -> WerkzeugResponse:
+    body = json.dumps({'error': 'Too Many Requests', 'retry_after': round(decision.retry_after, 3)})
+    return WerkzeugResponse(body, status=429, mimetype='application/json', headers=decision.headers())
+
+def overloaded(limit: ConcurrencyLimit) -> WerkzeugResponse:
+    body = json.dumps({'error': 'Service Unavailable', 'detail': 'Too many concurrent requests'})
+    return WerkzeugResponse(body, status=503, mimetype='application/json',
+                            headers={'Retry-After': str(max(1, math.ceil(limit.timeout)))})
+
+async def enforce(request, rate_limits: Union[RateLimit, Sequence[RateLimit], None],
+                  concurrency: Optional[ConcurrencyLimit], call: Callable) -> Any:
+    """Run `call` if the request is within its rate limits and gets a concurrency slot."""
+    if isinstance(rate_limits, RateLimit):
+        rate_limits = (rate_limits,)
+    for limit in rate_limits or ():
+        decision = limit.check(request)
+        if decision is not None and not decision.allowed:
+            return too_many_requests(decision)
+    if concurrency is None:
+        return await call()
+    if not await concurrency.acquire():
+        return overloaded(concurrency)
+    try:
+        return await call()
+    finally:
+        concurrency.release()
@@ -1,32 +1,122 @@
-from werkzeug.wrappers import Response
-from werkzeug.middleware.shared_data import SharedDataMiddleware
+import gzip
+import mimetypes
 import os
+import threading
+from werkzeug.wrappers import Response
+from .conditional import weak_etag, precompressed_response
+from .openapi import JSON, YAML
+
+SWAGGER_UI_DIR = os.path.join(os.path.dirname(__file__), 'static', 'swagger-ui')
+INDEX = 'index.html'
+
+# Versioned asset URLs never change content, so clients may keep them
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# Text assets below this size are served uncompressed
+GZIP_MIN_SIZE = 1024
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+class Asset:
+    def __init__(self, data, mimetype):
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = weak_etag(data)
+        compressible = mimetype.startswith(COMPRESSIBLE) and len(data) >= GZIP_MIN_SIZE
+        self.gzipped = gzip.compress(data, mtime=0) if compressible else None
 
 class SwaggerUI:
-    def __init__(self, app, openapi_json_path='/openapi.json', swagger_ui_path='/docs'):
+    def __init__(self, app, openapi_json_path='/openapi.json', swagger_ui_path='/docs', assets_path='/swagger-ui', assets_dir=SWAGGER_UI_DIR):
         self.app = app
         self.openapi_json_path = openapi_json_path
+        self.openapi_yaml_path = os.path.splitext(openapi_json_path)[0] + '.yaml'
         self.swagger_ui_path = swagger_ui_path
+        self.assets_path = assets_path
+        self.assets_dir = assets_dir
+        # Asset bytes are read and compressed on the first request
+        self.assets = None
+        self.lock = threading.Lock()
         self.add_swagger_routes()
 
+    def asset_names(self):
+        if not os.path.isdir(self.assets_dir):
+            return []
+        names = []
+        for root, _, files in os.walk(self.assets_dir):
+            for name in files:
+                names.append(os.path.relpath(os.path.join(root, name), self.assets_dir).replace(os.sep, '/'))
+        return sorted(names)
+
     def add_swagger_routes(self):
         # Route to serve the OpenAPI JSON
         self.app.route(self.openapi_json_path, methods=['GET'])(self.serve_openapi_json)
+        self.app.route(self.openapi_yaml_path, methods=['GET'])(self.serve_openapi_yaml)
 
         # Route to serve the Swagger UI
         self.app.route(self.swagger_ui_path, methods=['GET'])(self.serve_swagger_ui)
 
-        # Serve the static Swagger UI files
-        swagger_ui_dir = os.path.join(os.path.dirname(__file__), 'static', 'swagger-ui')
-        self.app.shared_data = SharedDataMiddleware(self.app.shared_data, {
-            '/swagger-ui': swagger_ui_dir
-        })
+        # One exact route per bundled file; listing them reads no contents
+        for name in self.asset_names():
+            if name != INDEX:
+                self.app.route(f'{self.assets_path}/{name}', methods=['GET'])(self.asset_handler(name))
+
+    def load_assets(self):
+        with self.lock:
+            if self.assets is None:
+                assets = {}
+                for name in self.asset_names():
+                    with open(os.path.join(self.assets_dir, name), 'rb') as f:
+                        data = f.read()
+                    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                    assets[name] = Asset(data, mimetype)
+                if INDEX in assets:
+                    assets[INDEX] = Asset(self.version_links(assets[INDEX].data, assets), 'text/html')
+                self.assets = assets
+        return self.assets
+
+    def version_links(self, index, assets):
+        # Point index.html at ?v=<etag> URLs so the assets can be cached as immutable
+        for name, asset in assets.items():
+            if name != INDEX:
+                url = f'{self.assets_path}/{name}'.encode()
+                index = index.replace(url + b'"', url + f'?v={asset.etag}"'.encode())
+        return index
+
+    def serve_asset(self, name, cache_control):
+        from .application import get_request
+
+        asset = self.load_assets().get(name)
+        if asset is None:
+            return Response('Swagger UI assets are not installed', status=404, mimetype='text/plain')
+        request = get_request()
+        if cache_control is None:
+            cache_control = IMMUTABLE if request.args.get('v') == asset.etag else REVALIDATE
+        return precompressed_response(request, asset.data, asset.gzipped, asset.etag, asset.mimetype, cache_control)
+
+    def asset_handler(self, name):
+        async def serve():
+            return self.serve_asset(name, None)
+        return serve
 
     async def serve_openapi_json(self):
-        openapi_json = self.app.openapi.generate()
-        return Response(openapi_json, mimetype='application/json')
+        return self.serve_openapi(JSON)
+
+    async def serve_openapi_yaml(self):
+        return self.serve_openapi(YAML)
+
+    def serve_openapi(self, fmt):
+        from .application import get_request
+
+        # ?tag= serves just that tag's operations, built on first request
+        request = get_request()
+        tag = request.args.get('tag')
+        try:
+            document = self.app.openapi.document(fmt, tag)
+        except KeyError:
+            return Response(f'No operations are tagged {tag!r}', status=404, mimetype='text/plain')
+        return precompressed_response(request, document.data, document.gzipped, document.etag, document.mimetype,
+                                      cache_control=REVALIDATE)
 
     async def serve_swagger_ui(self):
-        with open(os.path.join(os.path.dirname(__file__), 'static', 'swagger-ui', 'index.html'), 'r') as f:
-            content = f.read()
-        return Response(content, mimetype='text/html')
+        # The page itself revalidates so new asset versions are picked up
+        return self.serve_asset(INDEX, REVALIDATE)
@@ -0,0 +1,294 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Mapping, Optional
+
+TRACEPARENT = 'traceparent'
+TRACESTATE = 'tracestate'
+
+# version-trace_id-parent_id-flags, per W3C Trace Context
+TRACEPARENT_RE = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$')
+INVALID_TRACE_ID = '0' * 32
+INVALID_SPAN_ID = '0' * 16
+SAMPLED = 0x01
+
+OK = 'ok'
+ERROR = 'error'
+
+logger = logging.getLogger(__name__)
+
+# The span code is running under, set alongside request_context
+current_span = contextvars.ContextVar('current_span', default=None)
+
+class SpanContext:
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True, tracestate: str = None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+        self.tracestate = tracestate
+
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-{SAMPLED if self.sampled else 0:02x}'
+
+def extract(headers: Mapping[str, str]) -> Optional[SpanContext]:
+    """Read a traceparent header; malformed values are ignored, as the spec asks."""
+    value = headers.get(TRACEPARENT)
+    if not value:
+        return None
+    match = TRACEPARENT_RE.match(value.strip())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    # Version 00 has no trailing fields; later versions may add some
+    if version == 'ff' or (version == '00' and rest) or trace_id == INVALID_TRACE_ID or span_id == INVALID_SPAN_ID:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & SAMPLED), headers.get(TRACESTATE))
+
+def inject(headers: Dict[str, str], span: 'Span' = None) -> Dict[str, str]:
+    """Add the traceparent (and tracestate) of `span`, or the current span, to outgoing headers."""
+    span = span or current_span.get()
+    if span is not None:
+        headers[TRACEPARENT] = span.context.traceparent()
+        if span.context.tracestate:
+            headers[TRACESTATE] = span.context.tracestate
+    return headers
+
+def _new_id(bits: int) -> str:
+    # Ids only need to be unique, not secret
+    return f'{random.getrandbits(bits) or 1:0{bits // 4}x}'
+
+class Span:
+    def __init__(self, tracer: 'Tracer', name: str, context: SpanContext, parent_id: Optional[str] = None,
+                 kind: str = 'internal', attributes: Dict[str, Any] = None, start_ns: int = None):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.status = OK
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, exc: BaseException) -> None:
+        self.status = ERROR
+        self.error = f'{type(exc).__name__}: {exc}'
+
+    def end(self, end_ns: int = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self.context.sampled:
+            self.tracer.processor.on_end(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'service': self.tracer.service_name,
+            'name': self.name,
+            'kind': self.kind,
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+class SpanExporter:
+    def export(self, spans: List[Span]) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        pass
+
+class InMemoryExporter(SpanExporter):
+    """Keeps the last `max_spans` finished spans. For tests and debugging."""
+    def __init__(self, max_spans: int = 10000):
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, spans: List[Span]) -> None:
+        self.spans.extend(spans)
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+class FileExporter(SpanExporter):
+    """Appends one JSON object per span to a file."""
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        lines = ''.join(json.dumps(span.to_dict(), default=str) + '\n' for span in spans)
+        with self.lock, open(self.path, 'a') as f:
+            f.write(lines)
+
+class BatchProcessor:
+    """Hands finished spans to an exporter in batches from a background thread.
+
+    Spans are sent every `interval` seconds, or as soon as `max_batch` are waiting.
+    When more than `max_queue` are waiting, new spans are dropped and counted
+    rather than slowing requests down.
+    """
+    def __init__(self, exporter: SpanExporter, max_batch: int = 512, interval: float = 1.0, max_queue: int = 8192):
+        self.exporter = exporter
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_queue = max_queue
+        self.queue: Deque[Span] = deque()
+        self.dropped = 0
+        self.condition = threading.Condition()
+        # Held for a whole export, so force_flush() returns only once spans are out
+        self.export_lock = threading.Lock()
+        self.thread = None
+        self.stopped = False
+
+    def on_end(self, span: Span) -> None:
+        with self.condition:
+            if len(self.queue) >= self.max_queue:
+                self.dropped += 1
+                return
+            self.queue.append(span)
+            if self.thread is None and not self.stopped:
+                # Started by the first span, so a tracer that never records costs no thread
+                self.thread = threading.Thread(target=self.run, name='dust-span-exporter', daemon=True)
+                self.thread.start()
+                atexit.register(self.shutdown)
+            if len(self.queue) >= self.max_batch:
+                self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                if not self.stopped and len(self.queue) < self.max_batch:
+                    self.condition.wait(self.interval)
+                stopped = self.stopped
+            self.export_pending()
+            if stopped:
+                return
+
+    def export_pending(self) -> None:
+        with self.export_lock:
+            while True:
+                with self.condition:
+                    batch = [self.queue.popleft() for _ in range(min(self.max_batch, len(self.queue)))]
+                if not batch:
+                    return
+                try:
+                    self.exporter.export(batch)
+                except Exception:
+                    logger.exception('Span exporter failed; dropped %d spans', len(batch))
+
+    def force_flush(self) -> None:
+        self.export_pending()
+
+    def shutdown(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+            thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.export_pending()
+        self.exporter.shutdown()
+
+class Tracer:
+    def __init__(self, exporter: SpanExporter = None, service_name: str = 'dustapi', sample_ratio: float = 1.0,
+                 processor: BatchProcessor = None):
+        self.service_name = service_name
+        self.sample_ratio = sample_ratio
+        self.exporter = exporter or InMemoryExporter()
+        self.processor = processor or BatchProcessor(self.exporter)
+
+    def sampled(self, parent: Optional[SpanContext]) -> bool:
+        # Follow the caller's decision so a trace is kept or dropped as a whole
+        if parent is not None:
+            return parent.sampled
+        return self.sample_ratio >= 1.0 or random.random() < self.sample_ratio
+
+    def start_span(self, name: str, parent: Optional[SpanContext] = None, kind: str = 'internal',
+                   attributes: Dict[str, Any] = None, start_ns: int = None) -> Span:
+        """Start a span under `parent`, else under the current span, else a new trace."""
+        tracestate = None
+        if parent is None:
+            current = current_span.get()
+            parent = current.context if current is not None else None
+        if parent is not None:
+            trace_id, parent_id, sampled, tracestate = parent.trace_id, parent.span_id, parent.sampled, parent.tracestate
+        else:
+            trace_id, parent_id, sampled = _new_id(128), None, self.sampled(None)
+        context = SpanContext(trace_id, _new_id(64), sampled, tracestate)
+        return Span(self, name, context, parent_id, kind, attributes, start_ns)
+
+    @contextlib.contextmanager
+    def span(self, name: str, attributes: Dict[str, Any] = None, kind: str = 'internal') -> Iterator[Span]:
+        """Run a block as the current span, recording any exception it raises."""
+        span = self.start_span(name, kind=kind, attributes=attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.record_error(exc)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    def start_request(self, environ) -> Span:
+        headers = {TRACEPARENT: environ.get('HTTP_TRACEPARENT'), TRACESTATE: environ.get('HTTP_TRACESTATE')}
+        parent = extract(headers)
+        if parent is None:
+            parent = SpanContext(_new_id(128), None, self.sampled(None))
+        span = self.start_span(f"{environ.get('REQUEST_METHOD', 'GET')} {environ.get('PATH_INFO', '/')}",
+                               parent, kind='server')
+        span.set_attribute('http.method', environ.get('REQUEST_METHOD'))
+        span.set_attribute('http.target', environ.get('PATH_INFO'))
+        return span
+
+    def finish_request(self, span: Span, request, response, timer=None) -> None:
+        if request.route_path:
+            span.name = f'{request.method} {request.route_path}'
+            span.set_attribute('http.route', request.route_path)
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.status = ERROR
+        if timer is not None and span.context.sampled:
+            # Pipeline phases become child spans; the handler already has a live one
+            offset = span.start_ns - int(timer.start * 1e9)
+            for phase, start, end in timer.intervals:
+                if phase != 'handler':
+                    self.start_span(f'dust.{phase}', span.context, start_ns=offset + int(start * 1e9)).end(
+                        offset + int(end * 1e9))
+            span.end(offset + int(timer.last * 1e9))
+        else:
+            span.end()
+
+    def force_flush(self) -> None:
+        self.processor.force_flush()
+
+    def shutdown(self) -> None:
+        self.processor.shutdown()
+
+@contextlib.contextmanager
+def child_span(name: str, attributes: Dict[str, Any] = None) -> Iterator[Optional[Span]]:
+    """A span under the current one, or nothing at all outside a traced request."""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    with parent.tracer.span(name, attributes) as span:
+        yield span
@@ -0,0 +1,106 @@
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+REF_TEMPLATE = '#/components/schemas/{model}'
+
+VALIDATION_ERROR_RESPONSE = {
+    'description': 'Validation Error',
+    'content': {'application/json': {'schema': {'type': 'object', 'properties': {'detail': {'type': 'array'}}}}},
+}
+
+class RequestValidationError(Exception):
+    def __init__(self, error: ValidationError):
+        super().__init__(str(error))
+        self.error = error
+
+    def response(self):
+        # ValidationError.json serializes ctx values that json.dumps can't
+        body = b'{"detail":' + self.error.json(include_url=False).encode() + b'}'
+        return WerkzeugResponse(body, status=422, mimetype='application/json')
+
+def _schema_name(annotation) -> Optional[str]:
+    return annotation.__name__ if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+
+def _is_array(schema: Dict[str, Any], defs: Dict[str, Any], seen: frozenset = frozenset()) -> bool:
+    # Optional[List[int]] is an anyOf, and aliases and models are $refs
+    ref = schema.get('$ref')
+    if ref is not None:
+        name = ref.rsplit('/', 1)[-1]
+        return name not in seen and name in defs and _is_array(defs[name], defs, seen | {name})
+    kind = schema.get('type')
+    if kind == 'array' or (isinstance(kind, list) and 'array' in kind):
+        return True
+    return any(_is_array(option, defs, seen) for key in ('anyOf', 'oneOf', 'allOf') for option in schema.get(key, ()))
+
+class RouteModels:
+    """Validators and serializers for one route, built once when it is registered."""
+    def __init__(self, body=None, query=None, response=None):
+        self.body = body
+        self.query = query
+        self.response = response
+        self.body_adapter = TypeAdapter(body) if body is not None else None
+        self.query_adapter = TypeAdapter(query) if query is not None else None
+        self.response_adapter = TypeAdapter(response) if response is not None else None
+        self.list_params = set()
+        if self.query_adapter is not None:
+            schema = self.query_adapter.json_schema()
+            defs = schema.get('$defs', {})
+            self.list_params = {name for name, prop in schema.get('properties', {}).items() if _is_array(prop, defs)}
+
+    def parse(self, request) -> Dict[str, Any]:
+        kwargs = {}
+        try:
+            if self.body_adapter is not None:
+                # Parse and validate in one pass, straight from the raw bytes
+                kwargs['body'] = self.body_adapter.validate_json(request.get_data())
+            if self.query_adapter is not None:
+                args = {key: request.args.getlist(key) if key in self.list_params else request.args[key]
+                        for key in request.args}
+                kwargs['query'] = self.query_adapter.validate_python(args)
+        except ValidationError as exc:
+            raise RequestValidationError(exc)
+        return kwargs
+
+    def serialize(self, result):
+        if self.response_adapter is None or isinstance(result, WerkzeugResponse):
+            return result
+        data = self.response_adapter.dump_json(self.response_adapter.validate_python(result))
+        return WerkzeugResponse(data, mimetype='application/json')
+
+    def _schema(self, adapter, annotation, components: Dict[str, Any]) -> Dict[str, Any]:
+        schema = adapter.json_schema(ref_template=REF_TEMPLATE)
+        components.update(schema.pop('$defs', {}))
+        name = _schema_name(annotation)
+        if name is None:
+            return schema
+        components[name] = schema
+        return {'$ref': REF_TEMPLATE.format(model=name)}
+
+    def openapi(self) -> Tuple[List[Dict], Optional[Dict], Dict[str, Dict], Dict[str, Any]]:
+        """Returns (parameters, request body, responses, component schemas)."""
+        components = {}
+        parameters = []
+        if self.query_adapter is not None:
+            schema = self.query_adapter.json_schema(ref_template=REF_TEMPLATE)
+            components.update(schema.pop('$defs', {}))
+            required = set(schema.get('required', ()))
+            for name, prop in schema.get('properties', {}).items():
+                parameters.append({'name': name, 'in': 'query', 'required': name in required, 'schema': prop})
+
+        request_body = None
+        if self.body_adapter is not None:
+            request_body = {
+                'required': True,
+                'content': {'application/json': {'schema': self._schema(self.body_adapter, self.body, components)}},
+            }
+
+        responses = {}
+        if self.response_adapter is not None:
+            responses['200'] = {
+                'description': 'Successful Response',
+                'content': {'application/json': {'schema': self._schema(self.response_adapter, self.response, components)}},
+            }
+        if self.body_adapter is not None or self.query_adapter is not None:
+            responses['422'] = VALIDATION_ERROR_RESPONSE
+        return parameters, request_body, responses, components
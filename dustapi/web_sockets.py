@@ -10,6 +10,8 @@ class WebSocketRouter:
         self.routes = {}
         # WebSocket server instance
         self.server = None
+        # Set by Dust when metrics are enabled
+        self.metrics = None
 
     def add_route(self, path, handler):
         # Add a new WebSocket route with its corresponding handler
@@ -19,7 +21,14 @@ class WebSocketRouter:
         # Main WebSocket handler that routes incoming connections
         if path in self.routes:
             # If the path exists in routes, call the corresponding handler
-            await self.routes[path](websocket, path)
+            if self.metrics is None:
+                await self.routes[path](websocket, path)
+                return
+            self.metrics.websocket_opened(path)
+            try:
+                await self.routes[path](websocket, path)
+            finally:
+                self.metrics.websocket_closed(path)
         else:
             # If the path is not found, close the WebSocket connection
             await websocket.close()
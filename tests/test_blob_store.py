@@ -0,0 +1,47 @@
+# tests/test_blob_store.py
+
+import asyncio
+import os
+import tempfile
+import unittest
+from dustapi.goha.blob_store import BlobStore, TMP_DIR
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = BlobStore(self.tmp.name)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_put_is_sharded_and_content_addressed(self):
+        blob_id = self.store.put(b"ciphertext")
+        self.assertEqual(blob_id, BlobStore.blob_id(b"ciphertext"))
+        path = self.store.path(blob_id)
+        self.assertEqual(os.path.relpath(path, self.tmp.name), os.path.join(blob_id[:2], blob_id[2:4], blob_id))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"ciphertext")
+        self.assertEqual(os.listdir(os.path.join(self.tmp.name, TMP_DIR)), [])
+
+    def test_identical_blobs_are_deduplicated(self):
+        first = self.store.add(b"same", "a.eml")
+        second = self.store.add(b"same", "b.eml")
+        self.assertEqual(first, second)
+        self.assertEqual(self.store.resolve("a.eml"), self.store.resolve("b.eml"))
+
+    def test_relink_replaces_instead_of_overwriting(self):
+        old = self.store.add(b"v1", "mail.eml")
+        new = self.store.add(b"v2", "mail.eml")
+        self.assertEqual(self.store.resolve("mail.eml"), new)
+        self.assertTrue(self.store.exists(old))
+
+    def test_resolve_unknown(self):
+        self.assertIsNone(self.store.resolve("missing.eml"))
+
+    def test_add_async(self):
+        blob_id = asyncio.run(self.store.add_async(b"data", "async.eml"))
+        self.assertEqual(self.store.resolve("async.eml"), blob_id)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# tests/test_cache.py
+
+import unittest
+from dustapi.goha.cache import LRUCache, ENTRY_OVERHEAD
+
+class TestLRUCache(unittest.TestCase):
+    def test_entry_limit_evicts_least_recent(self):
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_byte_limit(self):
+        cache = LRUCache(max_bytes=2 * (ENTRY_OVERHEAD + 10), sizeof=lambda k, v: len(v))
+        cache.put("a", "x" * 10)
+        cache.put("b", "x" * 10)
+        cache.put("c", "x" * 10)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+        cache.put("huge", "x" * 1000)
+        self.assertIsNone(cache.get("huge"))
+
+    def test_invalidate_and_stats(self):
+        cache = LRUCache(max_entries=10)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.invalidate("a")
+        cache.get("a")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 0))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_disabled(self):
+        cache = LRUCache()
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# tests/test_conditional.py
+
+import unittest
+from datetime import datetime, timezone
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request, Response
+from dustapi.conditional import weak_etag, is_not_modified, not_modified_response, make_conditional
+
+def make_request(method='GET', headers=None):
+    return Request(EnvironBuilder(path='/poll', method=method, headers=headers).get_environ())
+
+class TestConditional(unittest.TestCase):
+    def test_auto_etag_is_weak_and_stable(self):
+        first = make_conditional(make_request(), Response('{"state": 1}'))
+        second = make_conditional(make_request(), Response('{"state": 1}'))
+        self.assertTrue(first.headers['ETag'].startswith('W/'))
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertEqual(first.status_code, 200)
+
+    def test_matching_if_none_match_returns_304(self):
+        tag = weak_etag(b'{"state": 1}')
+        request = make_request(headers={'If-None-Match': f'W/"{tag}"'})
+        response = make_conditional(request, Response('{"state": 1}'))
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_body_returns_200(self):
+        tag = weak_etag(b'{"state": 1}')
+        request = make_request(headers={'If-None-Match': f'W/"{tag}"'})
+        response = make_conditional(request, Response('{"state": 2}'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_handler_supplied_etag_is_kept(self):
+        response = Response('body')
+        response.set_etag('v42')
+        response = make_conditional(make_request(headers={'If-None-Match': '"v42"'}), response)
+        self.assertEqual(response.headers['ETag'], '"v42"')
+        self.assertEqual(response.status_code, 304)
+
+    def test_auto_etag_disabled(self):
+        response = make_conditional(make_request(), Response('body'), auto_etag=False)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_non_get_is_untouched(self):
+        response = make_conditional(make_request('POST'), Response('body'))
+        self.assertNotIn('ETag', response.headers)
+
+    def test_version_token_short_circuit(self):
+        request = make_request(headers={'If-None-Match': 'W/"v7"'})
+        self.assertTrue(is_not_modified(request, etag='v7'))
+        self.assertFalse(is_not_modified(request, etag='v8'))
+        self.assertFalse(is_not_modified(make_request()))
+
+    def test_if_modified_since(self):
+        modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        request = make_request(headers={'If-Modified-Since': 'Tue, 02 Jan 2024 00:00:00 GMT'})
+        self.assertTrue(is_not_modified(request, last_modified=modified))
+        response = not_modified_response('v7', modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], 'W/"v7"')
+        self.assertEqual(response.last_modified, modified)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# tests/test_config.py
+
+import json
+import os
+import tempfile
+import unittest
+from click.testing import CliRunner
+from werkzeug.test import Client
+from dustapi.application import Dust, create_app
+from dustapi.cli import cli
+from dustapi.config import DustConfig
+from dustapi.helpers import is_loaded
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+
+class TestDustConfig(unittest.TestCase):
+    def test_from_env_coerces_values(self):
+        config = DustConfig.from_env({"DUST_ENABLE_DOCS": "false", "DUST_LOG_FILE": "", "DUST_STATIC_FOLDER": "assets",
+                                      "OTHER": "x"})
+        self.assertFalse(config.enable_docs)
+        self.assertIsNone(config.log_file)
+        self.assertEqual(config.static_folder, "assets")
+
+    def test_bad_values_are_rejected(self):
+        with self.assertRaises(ValueError):
+            DustConfig.from_env({"DUST_AUTO_ETAG": "maybe"})
+        with self.assertRaises(TypeError):
+            DustConfig(enable_sse="no")
+        with self.assertRaises(ValueError):
+            DustConfig(static_url_path="static")
+        with self.assertRaises(ValueError):
+            DustConfig.from_mapping({"enable_everything": True})
+
+    def test_load_reads_file_then_env(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dust.json")
+            with open(path, "w") as f:
+                json.dump({"template_folder": "views", "auto_etag": False}, f)
+            config = DustConfig.load(environ={"DUST_CONFIG": path, "DUST_TEMPLATE_FOLDER": "pages"})
+            self.assertEqual(config.template_folder, "pages")
+            self.assertFalse(config.auto_etag)
+
+    @unittest.skipIf(tomllib is None, "needs Python 3.11 or tomli")
+    def test_toml_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dust.toml")
+            with open(path, "w") as f:
+                f.write('template_folder = "views"\nenable_sessions = false\n')
+            config = DustConfig.from_file(path)
+            self.assertEqual(config.template_folder, "views")
+            self.assertFalse(config.enable_sessions)
+
+
+class TestFeatureToggles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config = DustConfig(log_file=None)
+
+    def test_disabled_features_are_not_built(self):
+        app = Dust(config=self.config.replace(enable_docs=False, enable_static=False, enable_templates=False,
+                                              enable_sessions=False, enable_sse=False, enable_websockets=False))
+        self.assertIsNone(app.swagger_ui)
+        self.assertEqual(Client(app).get("/docs").status_code, 404)
+        self.assertIsNone(app.session_interface)
+        for call in (lambda: app.render_template("index.html"), lambda: app.sse,
+                     lambda: app.websocket("/ws")):
+            with self.assertRaises(RuntimeError):
+                call()
+        self.assertFalse(is_loaded(app, "websocket_router"))
+
+    def test_configure_rebuilds_dependents(self):
+        for folder, text in (("a", "first"), ("b", "second")):
+            os.makedirs(os.path.join(self.tmp.name, folder))
+            with open(os.path.join(self.tmp.name, folder, "page.html"), "w") as f:
+                f.write(text)
+        app = Dust(config=self.config.replace(template_folder=os.path.join(self.tmp.name, "a"), enable_docs=False))
+
+        @app.route("/page")
+        async def page():
+            return app.render_template("page.html")
+
+        client = Client(app)
+        self.assertEqual(client.get("/page").data, b"first")
+        app.configure(template_folder=os.path.join(self.tmp.name, "b"), static_url_path="/assets")
+        self.assertEqual(client.get("/page").data, b"second")
+        self.assertEqual(app.shared_data.exports[0][0], "/assets")
+
+        app.configure(enable_static=False)
+        self.assertEqual(app.shared_data, app.wsgi_app)
+        with self.assertRaises(ValueError):
+            app.configure(enable_docs=True)
+
+    def test_reconfiguring_the_log_does_not_duplicate_handlers(self):
+        app = Dust(config=self.config.replace(enable_docs=False))
+        self.addCleanup(app.configure, log_file=None)
+        count = len(app.logger.handlers)
+        app.configure(log_file=os.path.join(self.tmp.name, "app.log"))
+        app.configure(log_file=os.path.join(self.tmp.name, "other.log"))
+        self.assertEqual(len(app.logger.handlers), count + 1)
+        app.configure(log_file=None)
+        self.assertEqual(len(app.logger.handlers), count)
+
+    def test_create_app_uses_environment(self):
+        os.environ["DUST_AUTO_ETAG"] = "false"
+        self.addCleanup(os.environ.pop, "DUST_AUTO_ETAG")
+        app = create_app(log_file=self.config.log_file, enable_docs=False)
+        self.assertFalse(app.auto_etag)
+        self.assertFalse(app.config.enable_docs)
+
+
+
+class TestRunserverConfig(unittest.TestCase):
+    def test_file_overrides_only_the_keys_it_sets(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open("app.py", "w") as f:
+                f.write("from dustapi.application import Dust\n"
+                        "app = Dust(swagger_ui=False, log_file=None, template_folder='views')\n"
+                        "app.run = lambda **kwargs: None\n")
+            with open("dust.json", "w") as f:
+                json.dump({"static_folder": "assets"}, f)
+            result = runner.invoke(cli, ["runserver", "--config", "dust.json"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("templates from 'views', static files from 'assets'", result.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
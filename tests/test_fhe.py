@@ -0,0 +1,104 @@
+# tests/test_fhe.py
+
+import sys
+import unittest
+from array import array
+from dustapi.goha.fhe import (MockBackend, SimpleFHEBackend, CiphertextBatch, encrypt_vector, decrypt_vector,
+                              as_doubles, pack_values, unpack_values)
+
+
+class FakeNDArray:
+    # Stands in for numpy.ndarray's buffer conversion
+    def __init__(self, values):
+        self.values = array("d", values)
+
+    def astype(self, dtype):
+        return self
+
+    def tobytes(self):
+        return self.values.tobytes()
+
+
+class FakeCiphertext:
+    # Stands in for a simplefhe ciphertext and its serialized form
+    def __init__(self, value):
+        self.value = value
+
+    def __add__(self, other):
+        return FakeCiphertext(self.value + other.value)
+
+    def __mul__(self, other):
+        return FakeCiphertext(self.value * getattr(other, "value", other))
+
+    def serialize(self):
+        return array("d", [self.value]).tobytes()
+
+
+class FakeKeys:
+    def load_ciphertext(self, data):
+        return FakeCiphertext(array("d", data)[0])
+
+    def encrypt(self, value):
+        return FakeCiphertext(value)
+
+    def decrypt(self, ciphertext):
+        return ciphertext.value
+
+
+class TestFHE(unittest.TestCase):
+    def setUp(self):
+        self.backend = MockBackend(slots=4)
+
+    def test_import_does_not_generate_keys(self):
+        self.assertNotIn("simplefhe", sys.modules)
+
+    def test_round_trip_packs_slots(self):
+        batch = encrypt_vector(range(10), self.backend)
+        self.assertEqual(len(batch.ciphertexts), 3)
+        self.assertEqual(len(batch), 10)
+        self.assertEqual(list(decrypt_vector(batch, self.backend)), [float(n) for n in range(10)])
+
+    def test_buffer_input(self):
+        self.assertEqual(list(as_doubles(FakeNDArray([1.5, 2.5]))), [1.5, 2.5])
+
+    def test_serialization(self):
+        batch = encrypt_vector([1.0, -2.0, 3.5, 4.0, 5.0], self.backend)
+        data = batch.to_bytes()
+        loaded = CiphertextBatch.from_bytes(data)
+        self.assertEqual((loaded.backend, loaded.slots, loaded.length), ("mock", 4, 5))
+        self.assertEqual(loaded.ciphertexts, batch.ciphertexts)
+        for bad in (data[:-1], data + b"x", b"nope"):
+            with self.assertRaises(ValueError):
+                CiphertextBatch.from_bytes(bad)
+
+    def test_process_pool(self):
+        values = list(range(1000))
+        batch = encrypt_vector(values, self.backend, workers=2, parallel_threshold=10)
+        self.assertEqual(batch.ciphertexts, encrypt_vector(values, self.backend, workers=0).ciphertexts)
+        self.assertEqual(list(decrypt_vector(batch, self.backend, workers=2, parallel_threshold=10)),
+                         [float(v) for v in values])
+
+    def test_backend_mismatch(self):
+        batch = CiphertextBatch("other", 4, 0, [])
+        with self.assertRaises(ValueError):
+            decrypt_vector(batch, self.backend)
+
+    def test_value_framing(self):
+        data = pack_values([b"ab", b"", b"c"])
+        self.assertEqual(unpack_values(data), [b"ab", b"", b"c"])
+        for bad in (data[:-1], data + b"x", b"\x00\x00"):
+            with self.assertRaises(ValueError):
+                unpack_values(bad)
+
+    def test_simplefhe_ciphertexts_use_their_own_serialization(self):
+        backend = SimpleFHEBackend()
+        keys = FakeKeys()
+        backend.keys = (keys, keys, keys)
+        a, b = backend.encrypt([1.0, 2.0]), backend.encrypt([3.0, 4.0])
+        self.assertEqual(unpack_values(a)[0], array("d", [1.0]).tobytes())
+        self.assertEqual(backend.decrypt(backend.add(a, b), 2), [4.0, 6.0])
+        self.assertEqual(backend.decrypt(backend.multiply_plain(a, [2.0, 0.5]), 2), [2.0, 1.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
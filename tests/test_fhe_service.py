@@ -0,0 +1,95 @@
+# tests/test_fhe_service.py
+
+import base64
+import tempfile
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.goha.fhe import MockBackend, CiphertextBatch, encrypt_vector
+from dustapi.goha.fhe_service import FHEComputeService, fhe_routes, decrypt_total
+
+
+class TestFHEComputeService(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = MockBackend(slots=4)
+        self.service = FHEComputeService(self.tmp.name, backend=self.backend, workers=0)
+        self.values = [float(n) for n in range(1, 11)]
+        self.service.put_dataset("metrics", encrypt_vector(self.values, self.backend).to_bytes())
+
+    def tearDown(self):
+        self.service.close()
+        self.tmp.cleanup()
+
+    def total(self, result):
+        return decrypt_total(CiphertextBatch.from_bytes(base64.b64decode(result["result"])), self.backend)
+
+    def test_aggregates(self):
+        self.assertEqual(self.service.query("count", "metrics")["count"], 10)
+        self.assertEqual(self.total(self.service.query("sum", "metrics")), 55.0)
+        mean = self.service.query("mean", "metrics")
+        self.assertEqual(self.total(mean) / mean["count"], 5.5)
+
+    def test_dot_products(self):
+        weights = [2.0] * 10
+        self.assertEqual(self.total(self.service.query("dot", "metrics", weights=weights)), 110.0)
+        self.service.put_dataset("other", encrypt_vector(weights, self.backend).to_bytes())
+        self.assertEqual(self.total(self.service.query("dot", "metrics", other="other")), 110.0)
+        with self.assertRaises(ValueError):
+            self.service.query("dot", "metrics", weights=[1.0])
+
+    def test_results_are_cached_until_dataset_changes(self):
+        self.service.query("sum", "metrics")
+        self.service.query("mean", "metrics")
+        self.assertEqual(self.service.cache.stats()["hits"], 1)
+        self.service.put_dataset("metrics", encrypt_vector([1.0, 2.0], self.backend).to_bytes())
+        self.assertEqual(self.total(self.service.query("sum", "metrics")), 3.0)
+
+    def test_rejects_bad_input(self):
+        with self.assertRaises(ValueError):
+            self.service.put_dataset("../escape", encrypt_vector([1.0], self.backend).to_bytes())
+        with self.assertRaises(ValueError):
+            self.service.put_dataset("x", CiphertextBatch("simplefhe", 1, 0, []).to_bytes())
+        with self.assertRaises(ValueError):
+            self.service.query("median", "metrics")
+        with self.assertRaises(KeyError):
+            self.service.query("sum", "missing")
+
+    def test_process_pool(self):
+        service = FHEComputeService(self.tmp.name, backend=self.backend, workers=1)
+        try:
+            self.assertEqual(self.total(service.query("sum", "metrics")), 55.0)
+        finally:
+            service.close()
+
+
+class TestFHERoutes(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = MockBackend(slots=8)
+        self.app = Dust()
+        self.service = fhe_routes(self.app, FHEComputeService(self.tmp.name, backend=self.backend, workers=0))
+        self.client = Client(self.app)
+
+    def tearDown(self):
+        self.service.close()
+        self.tmp.cleanup()
+
+    def test_upload_and_query(self):
+        data = encrypt_vector([1.0, 2.0, 3.0], self.backend).to_bytes()
+        response = self.client.post("/fhe/datasets?name=m", data=data, content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get("/fhe/datasets").json["datasets"][0]["count"], 3)
+
+        response = self.client.post("/fhe/query", json={"op": "sum", "dataset": "m"})
+        batch = CiphertextBatch.from_bytes(base64.b64decode(response.json["result"]))
+        self.assertEqual(decrypt_total(batch, self.backend), 6.0)
+
+        self.assertEqual(self.client.post("/fhe/query", json={"op": "sum", "dataset": "nope"}).status_code, 404)
+        self.assertEqual(self.client.post("/fhe/query", json={"op": "x", "dataset": "m"}).status_code, 400)
+        self.assertEqual(self.client.delete("/fhe/datasets?name=m").status_code, 200)
+        self.assertEqual(self.client.get("/fhe/datasets").json["datasets"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+# tests/test_index_store.py
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from dustapi.goha.index_store import (open_index_store, migrate_index_store, MemoryIndexStore, SqliteIndexStore,
+                                     DbmIndexStore, LmdbIndexStore, SharedLock)
+
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
+class IndexStoreCases:
+    def test_write_batch_and_get_many(self):
+        self.store.write_batch({b"a": b"1", b"b": b"2"})
+        self.store.write_batch({b"c": b"3"}, [b"a", b"missing"])
+        self.assertEqual(self.store.get_many([b"a", b"b", b"c"]), [None, b"2", b"3"])
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(sorted(self.store.keys()), [b"b", b"c"])
+
+    def test_mapping_interface(self):
+        self.store[b"k"] = b"v"
+        self.assertIn(b"k", self.store)
+        self.assertEqual(self.store[b"k"], b"v")
+        del self.store[b"k"]
+        self.assertNotIn(b"k", self.store)
+        with self.assertRaises(KeyError):
+            self.store[b"k"]
+
+    def test_concurrent_readers(self):
+        self.store.write_batch({f"k{i}".encode(): b"v" for i in range(100)})
+        results = []
+
+        def read():
+            results.append(self.store.get_many([f"k{i}".encode() for i in range(100)]))
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(r == [b"v"] * 100 for r in results))
+
+    def test_write_from_worker_thread(self):
+        self.store.write_batch({b"main": b"1"})
+        worker = threading.Thread(target=self.store.write_batch, args=({b"worker": b"2"},))
+        worker.start()
+        worker.join(timeout=10)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(self.store.get(b"worker"), b"2")
+
+class TestMemoryIndexStore(IndexStoreCases, unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryIndexStore()
+
+class TestSqliteIndexStore(IndexStoreCases, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = SqliteIndexStore(os.path.join(self.tmp.name, "index.sqlite3"), sync="full")
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_persists_across_handles(self):
+        self.store.write_batch({b"a": b"1"})
+        other = SqliteIndexStore(self.store.path)
+        self.assertEqual(other.get(b"a"), b"1")
+        other.close()
+
+class TestDbmIndexStore(IndexStoreCases, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DbmIndexStore(os.path.join(self.tmp.name, "index"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_compact_keeps_writes_made_during_the_copy(self):
+        self.store.write_batch({b"a": b"1", b"b": b"2"})
+        get = self.store.get
+
+        def get_and_write(key):
+            # Runs between the per-entry locks of the copy, like a concurrent writer
+            if self.store.journal is not None and b"c" not in self.store.journal:
+                self.store.write_batch({b"c": b"3", b"b": b"22"}, [b"a"])
+            return get(key)
+
+        self.store.get = get_and_write
+        self.store.compact()
+        del self.store.get
+        self.assertEqual(self.store.get_many([b"a", b"b", b"c"]), [None, b"22", b"3"])
+        self.assertEqual(len(self.store), 2)
+        self.assertIsNone(self.store.journal)
+
+@unittest.skipIf(lmdb is None, "lmdb is not installed")
+class TestLmdbIndexStore(IndexStoreCases, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = LmdbIndexStore(os.path.join(self.tmp.name, "index"), map_size=2 ** 24)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_compact_under_concurrent_reads(self):
+        self.store.write_batch({f"k{i}".encode(): b"v" * 200 for i in range(2000)})
+        self.store.write_batch({}, [f"k{i}".encode() for i in range(1500)])
+        before = self.store.size_on_disk()
+        stop = threading.Event()
+        errors = []
+
+        def read():
+            while not stop.is_set():
+                try:
+                    self.store.get_many([b"k1999", b"k1"])
+                except Exception as exc:
+                    errors.append(exc)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        self.store.compact()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLess(self.store.size_on_disk(), before)
+        self.assertEqual(len(self.store), 500)
+
+class TestSharedLock(unittest.TestCase):
+    def test_exclusive_waits_for_shared_holders(self):
+        lock = SharedLock()
+        events = []
+
+        def take():
+            with lock.exclusive():
+                events.append("exclusive")
+
+        with lock.shared():
+            thread = threading.Thread(target=take)
+            thread.start()
+            time.sleep(0.05)
+            events.append("shared done")
+        thread.join()
+        self.assertEqual(events, ["shared done", "exclusive"])
+
+class TestOpenIndexStore(unittest.TestCase):
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            open_index_store("nope")
+
+    def test_unknown_sync_policy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(ValueError):
+                open_index_store("sqlite", os.path.join(tmp, "index"), sync="sometimes")
+
+    def test_memory_backend(self):
+        self.assertIsInstance(open_index_store("memory"), MemoryIndexStore)
+
+    def test_memory_backend_validates_options(self):
+        with self.assertRaises(ValueError):
+            open_index_store("memory", "index")
+        with self.assertRaises(ValueError):
+            open_index_store("memory", sync="sometimes")
+        with self.assertRaises(TypeError):
+            open_index_store("memory", timeout=5)
+
+    def test_migrate_dbm_to_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = DbmIndexStore(os.path.join(tmp, "index"))
+            source.write_batch({f"k{i}".encode(): b"v" for i in range(25)})
+            target = SqliteIndexStore(os.path.join(tmp, "index.sqlite3"))
+            self.assertEqual(migrate_index_store(source, target, batch_size=10), 25)
+            self.assertEqual(len(target), 25)
+            source.close()
+            target.close()
+
+if __name__ == '__main__':
+    unittest.main()
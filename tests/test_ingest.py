@@ -0,0 +1,114 @@
+# tests/test_ingest.py
+
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+from dustapi.goha.sse_engine import SSEEngine, PRF
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.goha.ingest import BulkIngester, MAIL, INDEX, FRAME_CONTENT_TYPE, ingest_route, pack_frame, iter_frames, iter_tar
+
+K2 = b"k2" * 8
+
+def records(count):
+    for n in range(count):
+        yield MAIL, f"{n}.eml", f"cipher{n}".encode()
+        entry = [PRF("k1", str(n)), SSEEngine.enc(K2, f"{n}.eml").decode()]
+        yield INDEX, f"{n}.json", json.dumps([entry]).encode()
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = SSEEngine(self.tmp.name, index_backend="memory")
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmp.cleanup()
+
+    def assertSearchable(self, count):
+        for n in range(count):
+            self.assertEqual(self.engine.lookup([("k1", K2.decode(), str(n))]), [f"{n}.eml"])
+
+    def test_frames_round_trip(self):
+        expected = list(records(3))
+        stream = io.BytesIO(b"".join(pack_frame(*r) for r in expected))
+        self.assertEqual(list(iter_frames(stream)), expected)
+
+    def test_truncated_frame(self):
+        stream = io.BytesIO(pack_frame(MAIL, "a.eml", b"data")[:-2])
+        with self.assertRaises(ValueError):
+            list(iter_frames(stream))
+
+    def test_tar(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as archive:
+            for kind, name, data in records(2):
+                info = tarfile.TarInfo(("mail/" if kind == MAIL else "index/") + name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        buf.seek(0)
+        stats = BulkIngester(self.engine, batch_size=3).ingest(iter_tar(buf))
+        self.assertEqual((stats["mail"], stats["index"]), (2, 2))
+        self.assertSearchable(2)
+
+    def test_resume_from_checkpoint(self):
+        checkpoint = os.path.join(self.tmp.name, "ingest.json")
+
+        def failing():
+            for n, record in enumerate(records(5)):
+                if n == 6:
+                    raise RuntimeError("connection lost")
+                yield record
+
+        ingester = BulkIngester(self.engine, batch_size=2, checkpoint_path=checkpoint)
+        with self.assertRaises(RuntimeError):
+            ingester.ingest(failing())
+        self.assertEqual(ingester.load_checkpoint(), 6)
+
+        stats = ingester.ingest(records(5))
+        self.assertEqual(stats["skipped"], 6)
+        self.assertEqual(stats["mail"], 2)
+        self.assertSearchable(5)
+
+    def test_ingest_route(self):
+        app = Dust()
+        app.sse = self.engine
+        ingest_route(app)
+        body = b"".join(pack_frame(*r) for r in records(2))
+        response = Client(app).post('/sse/ingest', data=body, content_type=FRAME_CONTENT_TYPE)
+        self.assertEqual(json.loads(response.get_data()), {"results": {"mail": 2, "index": 2, "skipped": 0}})
+        self.assertSearchable(2)
+
+        response = Client(app).post('/sse/ingest', data=b"junk", content_type="text/plain")
+        self.assertEqual(response.status_code, 415)
+
+    def test_ingest_route_resumes_a_job(self):
+        app = Dust()
+        app.sse = self.engine
+        ingest_route(app, batch_size=2, checkpoint_dir=os.path.join(self.tmp.name, "jobs"))
+        client = Client(app)
+        frames = [pack_frame(*r) for r in records(3)]
+        # The connection drops partway through the fourth record
+        response = client.post('/sse/ingest?job=box1', data=b"".join(frames[:3]) + frames[3][:5],
+                               content_type=FRAME_CONTENT_TYPE)
+        self.assertEqual(response.status_code, 400)
+
+        response = client.post('/sse/ingest?job=box1', data=b"".join(frames), content_type=FRAME_CONTENT_TYPE)
+        self.assertEqual(json.loads(response.get_data()), {"results": {"mail": 2, "index": 2, "skipped": 2}})
+        self.assertSearchable(3)
+        self.assertEqual(client.post('/sse/ingest?job=../x', data=b"", content_type=FRAME_CONTENT_TYPE).status_code, 400)
+
+    def test_malformed_delta_is_rejected(self):
+        app = Dust()
+        app.sse = self.engine
+        ingest_route(app)
+        for delta in (b'{"a": 1}', b'[1, 2]', b'[["a"]]', b'not json'):
+            body = pack_frame(MAIL, "x.eml", b"c") + pack_frame(INDEX, "bad.json", delta)
+            response = Client(app).post('/sse/ingest', data=body, content_type=FRAME_CONTENT_TYPE)
+            self.assertEqual(response.status_code, 400, delta)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+# tests/test_jmap_client.py
+
+import asyncio
+import tempfile
+import threading
+import unittest
+from werkzeug.serving import make_server
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.goha.sse_engine import SSEEngine, PRF
+from dustapi.goha.jmap import JMAPClient, JMAPError
+from dustapi.goha.jmap.client import is_read_only
+from dustapi.goha.jmap.dispatcher import jmap_route
+
+K2 = "k2" * 8
+
+class TestJMAPClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.app = Dust()
+        cls.app.sse = SSEEngine(cls.tmp.name, index_backend="memory")
+        cls.dispatcher = jmap_route(cls.app)
+
+        @cls.dispatcher.register("Count/get", "Count/get")
+        def count(args):
+            return {"n": args["n"]}
+
+        cls.server = make_server("127.0.0.1", 0, cls.app, threaded=True)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/jmap"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.app.sse.close()
+        cls.tmp.cleanup()
+
+    def run_client(self, coro_fn, **options):
+        async def main():
+            async with JMAPClient(self.url, **options) as client:
+                return await coro_fn(client), client
+        return asyncio.run(main())
+
+    def test_round_trip(self):
+        async def scenario(client):
+            entry = [PRF("k1", "body"), SSEEngine.enc(K2.encode(), "a.eml").decode()]
+            await client.add_file(b"cipher", "a.eml")
+            await client.update([entry])
+            return await client.search([["k1", K2, "body"]])
+
+        result, _ = self.run_client(scenario)
+        self.assertEqual(result["results"], ["636970686572"])
+
+    def test_calls_are_batched(self):
+        async def scenario(client):
+            first = await asyncio.gather(*(client.call("Count/get", {"n": n}) for n in range(20)))
+            second = await asyncio.gather(*(client.call("Count/get", {"n": n}) for n in range(5)))
+            return first + second
+
+        results, client = self.run_client(scenario, batch_window=0.01)
+        self.assertEqual([r["n"] for r in results], list(range(20)) + list(range(5)))
+        # The development server closes every connection
+        self.assertEqual(client.pool.opened, 2)
+
+    def test_keep_alive_connections_are_reused(self):
+        # werkzeug's development server never keeps connections open, so
+        # serve the app through a minimal HTTP/1.1 keep-alive front end
+        wsgi = Client(self.app)
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            while not reader.at_eof():
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                lines = head.decode().split("\r\n")
+                headers = dict(line.split(": ", 1) for line in lines[1:] if line)
+                body = await reader.readexactly(int(headers["Content-Length"]))
+                response = await asyncio.to_thread(wsgi.post, lines[0].split()[1], data=body,
+                                                   content_type=headers["Content-Type"])
+                data = response.get_data()
+                writer.write(f"HTTP/1.1 {response.status}\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+            writer.close()
+
+        async def main():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with JMAPClient(f"http://127.0.0.1:{port}/jmap") as client:
+                for n in range(3):
+                    self.assertEqual(await client.call("Count/get", {"n": n}), {"n": n})
+                opened = client.pool.opened
+            server.close()
+            return opened
+
+        self.assertEqual(asyncio.run(main()), 1)
+        self.assertEqual(len(connections), 1)
+
+    def test_max_batch_size_splits_requests(self):
+        async def scenario(client):
+            return await asyncio.gather(*(client.call("Count/get", {"n": n}) for n in range(10)))
+
+        results, _ = self.run_client(scenario, max_batch_size=3, max_in_flight=2)
+        self.assertEqual([r["n"] for r in results], list(range(10)))
+
+    def test_method_error_raises(self):
+        async def scenario(client):
+            ok, bad = await asyncio.gather(client.call("Count/get", {"n": 1}),
+                                           client.call("No/such", {}), return_exceptions=True)
+            return ok, bad
+
+        (ok, bad), _ = self.run_client(scenario)
+        self.assertEqual(ok, {"n": 1})
+        self.assertIsInstance(bad, JMAPError)
+        self.assertEqual(bad.error_type, "unknownMethod")
+
+    def test_upload(self):
+        async def scenario(client):
+            blob = await client.upload(b"large message", "message/rfc822")
+            await client.add_blob(blob["blobId"], "b.eml")
+            return blob
+
+        blob, _ = self.run_client(scenario)
+        self.assertEqual(self.app.sse.blobs().resolve("b.eml"), blob["blobId"])
+
+    def test_connection_refused_is_retried_then_raised(self):
+        async def main():
+            async with JMAPClient("http://127.0.0.1:1/jmap", retries=1, backoff=0) as client:
+                await client.call("Count/get", {"n": 1})
+        with self.assertRaises(OSError):
+            asyncio.run(main())
+
+    def test_semaphores_are_created_in_the_running_loop(self):
+        client = JMAPClient(self.url)
+        self.assertIsNone(client.in_flight)
+        self.assertIsNone(client.pool.slots)
+
+        async def main():
+            async with client:
+                await client.call("Count/get", {"n": 1})
+        asyncio.run(main())
+        self.assertIsNotNone(client.in_flight)
+        self.assertIsNotNone(client.pool.slots)
+
+
+class TestJMAPClientRetries(unittest.TestCase):
+    """Runs against a raw server that answers every request with 503."""
+
+    def run_against_failing_server(self, scenario):
+        requests = []
+
+        async def handle(reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+            requests.append(await reader.readexactly(length))
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 2\r\n"
+                         b"Connection: close\r\n\r\n{}")
+            await writer.drain()
+            writer.close()
+
+        async def main():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                async with JMAPClient(f"http://127.0.0.1:{port}/jmap", retries=2, backoff=0) as client:
+                    with self.assertRaises(JMAPError):
+                        await scenario(client)
+            finally:
+                server.close()
+                await server.wait_closed()
+        asyncio.run(main())
+        return requests
+
+    def test_read_only_calls_are_retried(self):
+        requests = self.run_against_failing_server(lambda client: client.search([["k1", K2, "body"]]))
+        self.assertEqual(len(requests), 3)
+
+    def test_updates_are_not_retried(self):
+        requests = self.run_against_failing_server(lambda client: client.update([["a", "b"]]))
+        self.assertEqual(len(requests), 1)
+
+    def test_mixed_batch_is_not_retried(self):
+        async def scenario(client):
+            await asyncio.gather(client.call("Count/get", {"n": 1}), client.add_blob("b", "a.eml"))
+        self.assertEqual(len(self.run_against_failing_server(scenario)), 1)
+
+    def test_is_read_only(self):
+        self.assertTrue(is_read_only("getEncryptedMessages"))
+        self.assertTrue(is_read_only("Mailbox/get"))
+        self.assertFalse(is_read_only("updateEncryptedIndex"))
+        self.assertFalse(is_read_only("Mailbox/set"))
+
+
+if __name__ == "__main__":
+    unittest.main()
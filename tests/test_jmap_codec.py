@@ -0,0 +1,120 @@
+# tests/test_jmap_codec.py
+
+import base64
+import binascii
+import io
+import json
+import tempfile
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.goha.sse_engine import SSEEngine
+from dustapi.goha.jmap.jmap import ADD_FILE_METHOD
+from dustapi.goha.jmap.codec import SpooledString, StreamingParser, decode_chunks, encode_items, encode_stream
+from dustapi.goha.jmap.dispatcher import jmap_route, ADD_FILE_RESPONSE
+
+SAMPLES = [
+    {"methodCalls": [["getEncryptedMessages", {"query": [["a", "b", "c"]], "limit": 10}, "#1"]]},
+    [1, -2.5, 3e10, True, False, None, "", [], {}],
+    {"escapes": "quote \" slash \\ / \b\f\n\r\t", "unicode": "café \U0001F600  "},
+    {"nested": [[[{"a": [1, {"b": "c"}]}]]], "spaced": "  x  "},
+]
+
+
+def parse(text, chunk_size=3, stream_fields=None):
+    return StreamingParser(io.BytesIO(text.encode()), stream_fields, chunk_size=chunk_size).parse()
+
+
+class TestStreamingParser(unittest.TestCase):
+    def test_matches_json_loads(self):
+        for sample in SAMPLES:
+            for ensure_ascii in (True, False):
+                text = json.dumps(sample, ensure_ascii=ensure_ascii, indent=1)
+                for chunk_size in (1, 2, 7, 4096):
+                    self.assertEqual(parse(text, chunk_size), json.loads(text))
+        self.assertEqual(parse(r'"a\/b"'), "a/b")
+
+    def test_rejects_invalid_json(self):
+        for text in ['{"a": 1', '[1, 2', '{"a" 1}', '"open', '[1] x', 'nope', '{"a": "\x01"}']:
+            with self.assertRaises(ValueError, msg=text):
+                parse(text)
+
+    def test_streamed_field_is_spooled(self):
+        payload = "ab" * 5000
+        text = json.dumps(["putEncryptedMessage", {"file": payload, "filename": "a.eml"}, "#1"])
+        result = parse(text, chunk_size=100, stream_fields={"file": SpooledString})
+        self.assertIsInstance(result[1]["file"], SpooledString)
+        self.assertEqual(result[1]["file"].read(), payload)
+        self.assertEqual(len(result[1]["file"]), len(payload))
+        self.assertEqual(result[1]["filename"], "a.eml")
+
+
+class TestChunkCodecs(unittest.TestCase):
+    def test_decode_chunks_across_boundaries(self):
+        data = bytes(range(256)) * 3
+        for encoding, text in (("hex", binascii.hexlify(data).decode()), ("base64", base64.b64encode(data).decode())):
+            chunks = [text[i:i + 5] for i in range(0, len(text), 5)]
+            self.assertEqual(b"".join(decode_chunks(chunks, encoding)), data)
+
+    def test_decode_chunks_rejects_bad_input(self):
+        with self.assertRaises(ValueError):
+            list(decode_chunks(["abc"], "hex"))
+        with self.assertRaises(ValueError):
+            list(decode_chunks(["zz"], "hex"))
+        with self.assertRaises(ValueError):
+            list(decode_chunks(["00"], "rot13"))
+
+    def test_encode_stream_round_trip(self):
+        for sample in SAMPLES:
+            chunks = list(encode_stream(sample, chunk_size=8))
+            self.assertTrue(all(chunks))
+            self.assertEqual(json.loads(b"".join(chunks)), sample)
+
+    def test_encode_items(self):
+        self.assertEqual(json.loads(b"".join(encode_items(iter(SAMPLES), chunk_size=8))), SAMPLES)
+        wrapped = b"".join(encode_items(iter([]), '{"methodResponses":[', ']}'))
+        self.assertEqual(json.loads(wrapped), {"methodResponses": []})
+
+
+class TestStreamingRoutes(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = Dust()
+        self.app.sse = SSEEngine(self.tmp.name, index_backend="memory")
+        jmap_route(self.app)
+        self.client = Client(self.app)
+
+    def tearDown(self):
+        self.app.sse.close()
+        self.tmp.cleanup()
+
+    def test_streamed_add_file(self):
+        data = b"cipher" * 1000
+        body = json.dumps({"methodCalls": [[ADD_FILE_METHOD, {"file": binascii.hexlify(data).decode(), "filename": "a.eml"}, "#1"]]})
+        response = self.client.post("/jmap", data=body, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        name, args, _ = response.json["methodResponses"][0]
+        self.assertEqual(name, ADD_FILE_RESPONSE)
+        self.assertEqual(self.app.sse.blobs().resolve("a.eml"), args["blobId"])
+
+    def test_upload_then_reference(self):
+        data = b"large encrypted message"
+        upload = self.client.post("/jmap/upload", data=data, content_type="message/rfc822")
+        self.assertEqual(upload.status_code, 201)
+        self.assertEqual(upload.json["size"], len(data))
+        self.assertEqual(upload.json["type"], "message/rfc822")
+
+        calls = [[ADD_FILE_METHOD, {"blobId": upload.json["blobId"], "filename": "b.eml"}, "#1"],
+                 [ADD_FILE_METHOD, {"blobId": "0" * 64, "filename": "c.eml"}, "#2"]]
+        response = self.client.post("/jmap", data=json.dumps(calls), content_type="application/json")
+        self.assertEqual(response.json[0][0], ADD_FILE_RESPONSE)
+        self.assertEqual(response.json[1][1]["type"], "invalidArguments")
+        self.assertEqual(self.app.sse.blobs().resolve("b.eml"), upload.json["blobId"])
+
+    def test_not_json(self):
+        response = self.client.post("/jmap", data=b"{nope", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+# tests/test_jmap_dispatcher.py
+
+import asyncio
+import binascii
+import json
+import tempfile
+import threading
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.goha.sse_engine import SSEEngine, PRF
+from dustapi.goha.jmap.jmap import pack_search, pack_update, pack_add_file
+from dustapi.goha.jmap.dispatcher import JMAPDispatcher, jmap_route, resolve_path, SEARCH_RESPONSE
+
+K2 = "k2" * 8
+
+class TestJMAPDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = SSEEngine(self.tmp.name, index_backend="memory")
+        self.dispatcher = JMAPDispatcher(self.engine)
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmp.cleanup()
+
+    def dispatch(self, calls):
+        return asyncio.run(self.dispatcher.dispatch(calls))
+
+    def test_batch_runs_in_order(self):
+        entry = [PRF("k1", "body"), SSEEngine.enc(K2.encode(), "a.eml").decode()]
+        calls = [
+            json.loads(pack_add_file(binascii.hexlify(b"cipher").decode(), "#1", "a.eml")),
+            json.loads(pack_update([entry], "#2")),
+            json.loads(pack_search([["k1", K2, "body"]], "#3")),
+        ]
+        responses = self.dispatch(calls)
+        self.assertEqual([r[2] for r in responses], ["#1", "#2", "#3"])
+        self.assertEqual(responses[2], [SEARCH_RESPONSE, {"results": [binascii.hexlify(b"cipher").decode()]}, "#3"])
+
+    def test_back_reference(self):
+        @self.dispatcher.register("Echo/get", "Echo/get")
+        def echo(args):
+            return {"list": [{"id": i} for i in args["ids"]]}
+
+        responses = self.dispatch([
+            ["Echo/get", {"ids": ["a", "b"]}, "c1"],
+            ["Echo/get", {"#ids": {"resultOf": "c1", "name": "Echo/get", "path": "/list/*/id"}}, "c2"],
+        ])
+        self.assertEqual(responses[1][1], {"list": [{"id": "a"}, {"id": "b"}]})
+
+    def test_independent_calls_run_concurrently(self):
+        running = []
+
+        @self.dispatcher.register("Slow/get", "Slow/get")
+        async def slow(args):
+            running.append(args["n"])
+            await asyncio.sleep(0.05)
+            return {"seen": len(running)}
+
+        responses = self.dispatch([["Slow/get", {"n": n}, str(n)] for n in range(3)])
+        self.assertEqual([r[1]["seen"] for r in responses], [3, 3, 3])
+
+    def test_errors(self):
+        responses = self.dispatch([
+            ["Nope/get", {}, "c1"],
+            ["getEncryptedMessages", {}, "c2"],
+            ["getEncryptedMessages", {"#query": {"resultOf": "c9", "name": "x", "path": "/"}}, "c3"],
+            "junk",
+        ])
+        self.assertEqual([r[1]["type"] for r in responses],
+                         ["unknownMethod", "invalidArguments", "invalidResultReference", "notRequest"])
+
+    def test_resolve_path(self):
+        self.assertEqual(resolve_path({"a": [{"b": 1}, {"b": 2}]}, "/a/*/b"), [1, 2])
+        self.assertEqual(resolve_path({"a/b": 3}, "/a~1b"), 3)
+
+    def test_route(self):
+        app = Dust()
+        app.sse = self.engine
+        jmap_route(app)
+        body = {"using": [], "methodCalls": [json.loads(pack_search([["k1", K2, "body"]], "#1"))]}
+        response = Client(app).post('/jmap', data=json.dumps(body), content_type="application/json")
+        self.assertEqual(json.loads(response.get_data()),
+                         {"methodResponses": [[SEARCH_RESPONSE, {"results": "Found no results for query"}, "#1"]]})
+        response = Client(app).post('/jmap', data="{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_route_streams_each_response_when_ready(self):
+        release = threading.Event()
+
+        @self.dispatcher.register("Fast/get", "Fast/get")
+        def fast(args):
+            return {"n": 1}
+
+        @self.dispatcher.register("Blocked/get", "Blocked/get")
+        def blocked(args):
+            return {"released": release.wait(2)}
+
+        app = Dust()
+        jmap_route(app, self.dispatcher)
+        calls = [["Fast/get", {}, "c1"], ["Blocked/get", {}, "c2"]]
+        response = Client(app).post('/jmap', data=json.dumps(calls), content_type="application/json", buffered=False)
+        body = iter(response.response)
+        received = b""
+        while b"c1" not in received:
+            received += next(body)
+        # The first response is out while the second call is still running
+        release.set()
+        received += b"".join(body)
+        self.assertEqual(json.loads(received), [["Fast/get", {"n": 1}, "c1"], ["Blocked/get", {"released": True}, "c2"]])
+
+if __name__ == '__main__':
+    unittest.main()
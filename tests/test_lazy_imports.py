@@ -0,0 +1,38 @@
+# tests/test_lazy_imports.py
+
+import subprocess
+import sys
+import tempfile
+import unittest
+from dustapi.application import Dust
+from dustapi.helpers import is_loaded
+
+DEFERRED = ["jinja2", "cryptography", "jwt", "pydantic", "yaml", "websockets", "Crypto", "dustapi.goha.sse_engine"]
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_import_and_construct_skip_optional_subsystems(self):
+        script = ("import sys\nfrom dustapi.application import Dust\nDust(log_file='/dev/null')\n"
+                  f"print(' '.join(m for m in {DEFERRED!r} if m in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "")
+
+    def test_subsystems_build_on_first_use(self):
+        with tempfile.NamedTemporaryFile(suffix=".log") as log:
+            app = Dust(log_file=log.name, swagger_ui=False)
+            for name in ("template_env", "secret_key", "session_interface", "jwt_handler", "sse", "websocket_router"):
+                self.assertFalse(is_loaded(app, name), name)
+            self.assertIs(app.jwt_handler, app.jwt_handler)
+            self.assertTrue(is_loaded(app, "jwt_handler"))
+            self.assertTrue(app.session_interface.secret_key)
+
+            app.sse = "replaced"
+            self.assertEqual(app.sse, "replaced")
+
+    def test_explicit_secret_key_is_kept(self):
+        with tempfile.NamedTemporaryFile(suffix=".log") as log:
+            self.assertEqual(Dust(log_file=log.name, secret_key="k").secret_key, "k")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# tests/test_loadgen.py
+
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from werkzeug.serving import make_server
+from dustapi.application import Dust
+from dustapi.config import DustConfig
+from dustapi.loadgen import percentile, run_load, record, history, compare
+
+
+class TestLoadgen(unittest.TestCase):
+    def test_percentile_is_nearest_rank(self):
+        samples = [float(n) for n in range(1, 101)]
+        self.assertEqual(percentile(samples, 50), 50.0)
+        self.assertEqual(percentile(samples, 99), 99.0)
+        self.assertEqual(percentile([3.0], 99), 3.0)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_results_are_stored_and_compared(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "results", "load.jsonl")
+            record(path, "GET /", {"rps": 1000.0, "p99_ms": 2.0}, commit="aaa")
+            record(path, "POST /", {"rps": 10.0}, commit="aaa")
+            record(path, "GET /", {"rps": 950.0, "p99_ms": 3.0}, commit="bbb")
+            runs = history(path, "GET /")
+            self.assertEqual([run["commit"] for run in runs], ["aaa", "bbb"])
+            regressions = compare(runs[1]["results"], runs[0]["results"], threshold=0.1)
+            self.assertEqual(len(regressions), 1)
+            self.assertTrue(regressions[0].startswith("p99_ms"))
+            self.assertEqual(compare({"rps": 800.0}, {"rps": 1000.0}, 0.1), ["rps: 1000.0 -> 800.0 (+20% worse)"])
+
+    def test_run_load_against_a_server(self):
+        app = Dust(config=DustConfig(log_file=None, enable_docs=False))
+
+        @app.route("/hello")
+        async def hello():
+            return "Hello, World!"
+
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/hello"
+            results = asyncio.run(run_load(url, requests=40, concurrency=4, warmup=0))
+        finally:
+            server.shutdown()
+        self.assertEqual(results["requests"], 40)
+        self.assertEqual(results["errors"], 0)
+        self.assertEqual(results["statuses"], {"200": 40})
+        self.assertGreater(results["rps"], 0)
+        self.assertLessEqual(results["p50_ms"], results["p99_ms"])
+        self.assertLessEqual(results["p99_ms"], results["max_ms"])
+
+
+if __name__ == "__main__":
+    unittest.main()
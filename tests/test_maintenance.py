@@ -0,0 +1,72 @@
+# tests/test_maintenance.py
+
+import json
+import os
+import tempfile
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.goha.sse_engine import SSEEngine, PRF
+from dustapi.goha.maintenance import IndexMaintenance, maintenance_routes, COMPACT, VERIFY
+
+class MaintenanceCases:
+    backend = None
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = SSEEngine(self.tmp.name, index_backend=self.backend, index_path=os.path.join(self.tmp.name, "index"))
+        self.engine.bulk_import((PRF("k1", str(n)), SSEEngine.enc(b"k2" * 8, f"m{n}").decode()) for n in range(200))
+        self.maintenance = IndexMaintenance(self.engine)
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmp.cleanup()
+
+    def test_cached_count_tracks_updates(self):
+        self.assertEqual(len(self.engine.index), 200)
+        self.engine.update([(PRF("k1", "0"), "00" * 32), (PRF("k1", "new"), "00" * 32, PRF("k1", "1"))])
+        self.assertEqual(len(self.engine.index), 200)
+        self.engine.update([("gone", "00", PRF("k1", "2"))])
+        self.assertEqual(self.maintenance.stats()["entries"], 200)
+
+    def test_compact_keeps_entries(self):
+        self.engine.update([(PRF("k1", "x"), "00", PRF("k1", str(n))) for n in range(150)])
+        self.assertTrue(self.maintenance.start(COMPACT))
+        status = self.maintenance.wait(COMPACT, timeout=30)
+        self.assertEqual(status["state"], "done")
+        self.assertEqual(len(self.engine.index), 51)
+        self.assertEqual(self.engine.lookup([("k1", "k2" * 8, "199")]), ["m199"])
+
+    def test_verify_reports_bad_entries(self):
+        clean = self.maintenance.verify()
+        self.assertEqual((clean["entries"], clean["invalid"], clean["backend_errors"]), (200, [], []))
+        self.engine.update([(PRF("k1", "bad"), "zz")])
+        report = self.maintenance.verify()
+        self.assertEqual(len(report["invalid"]), 1)
+        self.assertNotEqual(report["checksum"], clean["checksum"])
+
+    def test_histogram(self):
+        histogram = self.maintenance.histogram()["value_bytes"]
+        self.assertEqual(histogram["count"], 200)
+        self.assertEqual(sum(b["count"] for b in histogram["buckets"]), 200)
+
+class TestSqliteMaintenance(MaintenanceCases, unittest.TestCase):
+    backend = "sqlite"
+
+class TestDbmMaintenance(MaintenanceCases, unittest.TestCase):
+    backend = "dbm"
+
+class TestMaintenanceRoutes(unittest.TestCase):
+    def test_admin_endpoints(self):
+        app = Dust()
+        app.sse = SSEEngine(index_backend="memory")
+        maintenance = maintenance_routes(app)
+        client = Client(app)
+        self.assertEqual(json.loads(client.get('/sse/admin/stats').get_data())["entries"], 0)
+        response = client.post('/sse/admin/verify')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(maintenance.wait(VERIFY, timeout=30)["state"], "done")
+        self.assertIn("value_bytes", json.loads(client.get('/sse/admin/histogram').get_data()))
+
+if __name__ == '__main__':
+    unittest.main()
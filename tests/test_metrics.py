@@ -0,0 +1,121 @@
+# tests/test_metrics.py
+
+import gc
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.config import DustConfig
+from dustapi.metrics import MetricsRegistry, RequestMetrics
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_histogram_exposition(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            latency.observe(value, '/a"b')
+        text = registry.render()
+        self.assertIn("# TYPE latency_seconds histogram", text)
+        self.assertIn('latency_seconds_bucket{route="/a\\"b",le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="/a\\"b",le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{route="/a\\"b",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_sum{route="/a\\"b"} 3.65', text)
+        self.assertIn('latency_seconds_count{route="/a\\"b"} 4', text)
+
+    def test_thread_shards_are_summed_and_retired(self):
+        registry = MetricsRegistry()
+        hits = registry.counter("hits_total", "Hits.", ("kind",))
+
+        def work():
+            for _ in range(1000):
+                hits.inc("a")
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        del threads, thread
+        gc.collect()
+        self.assertEqual(hits.collect(), {("a",): 8000})
+        self.assertEqual(hits.shards, {})
+        self.assertIn('hits_total{kind="a"} 8000', registry.render())
+
+    def test_processes_share_a_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            script = ("from dustapi.metrics import RequestMetrics\n"
+                      f"m = RequestMetrics({tmp!r})\n"
+                      "m.in_flight.inc()\n"
+                      "m.observe_request('GET', '/a', 200, 0.01)\n")
+            subprocess.run([sys.executable, "-c", script], check=True)
+
+            metrics = RequestMetrics(tmp)
+            metrics.in_flight.inc()
+            metrics.observe_request("GET", "/a", 200, 0.02)
+            totals = metrics.collect()
+            self.assertEqual(totals["dust_requests_total"], {("GET", "/a", "200"): 2})
+            # The other process has exited, so its in-flight request no longer counts
+            self.assertEqual(totals["dust_requests_in_flight"], {(): 1})
+            metrics.close()
+
+
+class TestAppMetrics(unittest.TestCase):
+    def setUp(self):
+        self.app = Dust(config=DustConfig(log_file=None, enable_docs=False, enable_metrics=True))
+
+        @self.app.route("/hello")
+        async def hello():
+            return "Hello"
+
+        self.client = Client(self.app)
+
+    def test_requests_are_counted_by_route(self):
+        self.client.get("/hello")
+        self.client.get("/hello")
+        self.client.get("/nowhere/1")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        text = response.get_data(as_text=True)
+        self.assertIn('dust_requests_total{method="GET",route="/hello",status="200"} 2', text)
+        self.assertIn('dust_requests_total{method="GET",route="unmatched",status="404"} 1', text)
+        self.assertIn('dust_request_duration_seconds_count{method="GET",route="/hello"} 2', text)
+        self.assertIn("dust_requests_in_flight 1", text)
+
+    def test_session_lookups(self):
+        self.client.set_cookie("session_id", "missing")
+        self.client.get("/hello")
+        self.assertEqual(self.app.metrics.sessions.collect(), {("miss",): 1})
+
+    def test_sse_operations_are_timed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.app.sse.upload_folder = tmp
+            self.app.sse.index_backend = "memory"
+            self.app.sse.lookup([("k1", "k2" * 8, "body")])
+            self.app.sse.close()
+        self.assertEqual(self.app.metrics.sse_latency.collect()[("lookup",)][-1], 1)
+
+    def test_in_flight_is_released_when_the_pipeline_fails(self):
+        from dustapi.application import request_context
+
+        def broken_form(environ):
+            raise RuntimeError("bad form")
+
+        self.app.parse_form_data = broken_form
+        with self.assertRaises(RuntimeError):
+            self.client.post("/hello")
+        self.assertEqual(self.app.metrics.in_flight.collect(), {(): 0})
+        self.assertIsNone(request_context.get(None))
+
+    def test_metrics_are_fixed_at_construction(self):
+        with self.assertRaises(ValueError):
+            self.app.configure(metrics_path="/stats")
+        with self.assertRaises(RuntimeError):
+            Dust(config=DustConfig(log_file=None, enable_docs=False)).metrics
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# tests/test_openapi.py
+
+import gzip
+import json
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.openapi import OpenAPI, JSON, YAML
+
+
+class TestOpenAPI(unittest.TestCase):
+    def setUp(self):
+        self.openapi = OpenAPI("t", "1", "d")
+        self.openapi.add_path("/users", "GET", "List", "List users", {"200": {"description": "ok"}}, tags=["users"])
+        self.openapi.add_path("/items", "GET", "List", "List items", {"200": {"description": "ok"}}, tags=["items"])
+
+    def test_documents_are_cached_until_add_path(self):
+        first = self.openapi.document(JSON)
+        self.assertIs(self.openapi.document(JSON), first)
+        self.assertEqual(set(json.loads(first.data)["paths"]), {"/users", "/items"})
+
+        self.openapi.add_path("/more", "POST", "Add", "Add", {"201": {"description": "ok"}})
+        second = self.openapi.document(JSON)
+        self.assertIsNot(second, first)
+        self.assertNotEqual(second.etag, first.etag)
+        self.assertIn("/more", json.loads(second.data)["paths"])
+
+    def test_per_tag_documents(self):
+        self.assertEqual(self.openapi.tags(), ["items", "users"])
+        self.assertEqual(list(json.loads(self.openapi.document(JSON, "users").data)["paths"]), ["/users"])
+        with self.assertRaises(KeyError):
+            self.openapi.document(JSON, "nobody")
+
+    def test_yaml(self):
+        self.assertEqual(self.openapi.document(YAML).mimetype, "application/yaml")
+        self.assertIn("/users", self.openapi.generate())
+
+
+class TestOpenAPIRoutes(unittest.TestCase):
+    def setUp(self):
+        self.app = Dust()
+        for n in range(40):
+            self.app.route(f"/r{n}", summary="Route", description="A route", responses={"200": {"description": "ok"}},
+                           tags=["even" if n % 2 == 0 else "odd"])(self.handler)
+        self.client = Client(self.app)
+
+    async def handler(self):
+        return "ok"
+
+    def test_serves_json_with_etag_and_gzip(self):
+        response = self.client.get("/openapi.json")
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(len(response.json["paths"]), 40)
+        etag = response.headers["ETag"]
+
+        self.assertEqual(self.client.get("/openapi.json", headers={"If-None-Match": etag}).status_code, 304)
+
+        compressed = self.client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(compressed.data)), response.json)
+
+    def test_tag_and_yaml(self):
+        self.assertEqual(len(self.client.get("/openapi.json?tag=odd").json["paths"]), 20)
+        for n in range(50):
+            self.assertEqual(self.client.get(f"/openapi.json?tag=x{n}").status_code, 404)
+        self.assertEqual(len(self.app.openapi.documents), 1)
+        self.assertEqual(self.client.get("/openapi.yaml").mimetype, "application/yaml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# tests/test_profiling.py
+
+import os
+import pstats
+import tempfile
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.config import DustConfig
+from dustapi.profiling import PHASES, PROFILE_FILE_HEADER
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.app = self.make_app(profile_token="s3cret")
+
+    def make_app(self, **settings):
+        app = Dust(config=DustConfig(log_file=None, enable_docs=False, enable_profiling=True,
+                                     profile_dir=self.tmp.name).replace(**settings))
+
+        @app.route("/work")
+        async def work():
+            return str(sum(range(1000)))
+
+        @app.route("/other")
+        async def other():
+            return "other"
+        return app
+
+    def test_header_capture_writes_a_loadable_profile(self):
+        client = Client(self.app)
+        self.assertNotIn(PROFILE_FILE_HEADER, client.get("/work", headers={"X-Dust-Profile": "wrong"}).headers)
+
+        response = client.get("/work", headers={"X-Dust-Profile": "s3cret"})
+        name = response.headers[PROFILE_FILE_HEADER]
+        stats = pstats.Stats(os.path.join(self.tmp.name, name))
+        self.assertTrue(any(func[2] == "work" for func in stats.stats))
+        self.assertEqual(os.listdir(self.tmp.name), [name])
+
+    def test_armed_and_sampled_captures(self):
+        client = Client(self.app)
+        self.app.profiler.capture_next(1, path="/other")
+        self.assertNotIn(PROFILE_FILE_HEADER, client.get("/work").headers)
+        self.assertIn(PROFILE_FILE_HEADER, client.get("/other").headers)
+        self.assertNotIn(PROFILE_FILE_HEADER, client.get("/other").headers)
+
+        self.app.configure(profile_sample_rate=1.0)
+        self.assertIn(PROFILE_FILE_HEADER, Client(self.app).get("/work").headers)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 2)
+
+    def test_slow_requests_are_logged_with_phases(self):
+        app = self.make_app(slow_request_ms=0.0)
+        with self.assertLogs("dustapi.slow_requests", "WARNING") as logs:
+            Client(app).get("/work")
+        self.assertEqual(len(logs.records), 1)
+        entry = app.profiler.recent_slow_requests()[0]
+        self.assertEqual((entry["route"], entry["status"]), ("/work", 200))
+        self.assertEqual(tuple(entry["phases_ms"]), PHASES)
+        self.assertAlmostEqual(sum(entry["phases_ms"].values()), entry["total_ms"], delta=0.01)
+
+    def test_disabled_by_default(self):
+        app = Dust(config=DustConfig(log_file=None, enable_docs=False))
+        with self.assertRaises(RuntimeError):
+            app.profiler
+        with self.assertRaises(ValueError):
+            DustConfig(profile_sample_rate=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+# tests/test_ratelimit.py
+
+import os
+import tempfile
+import threading
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.config import DustConfig
+from dustapi.ratelimit import (RateLimit, ConcurrencyLimit, MemoryStore, SQLiteStore, TOKEN_BUCKET, forwarded_ip,
+                               jwt_subject)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAlgorithms(unittest.TestCase):
+    def test_gcra_allows_a_burst_then_spaces_requests(self):
+        clock = Clock()
+        limit = RateLimit(2, per=1.0, burst=3, clock=clock)
+        self.assertEqual([limit.hit("a").remaining for _ in range(3)], [2, 1, 0])
+        denied = limit.hit("a")
+        self.assertFalse(denied.allowed)
+        self.assertAlmostEqual(denied.retry_after, 0.5)
+        self.assertTrue(limit.hit("b").allowed)
+        clock.now += 0.5
+        self.assertTrue(limit.hit("a").allowed)
+        self.assertFalse(limit.hit("a").allowed)
+
+    def test_token_bucket_refills(self):
+        clock = Clock()
+        limit = RateLimit(1, per=2.0, burst=2, algorithm=TOKEN_BUCKET, clock=clock)
+        self.assertTrue(limit.hit("a").allowed)
+        self.assertTrue(limit.hit("a").allowed)
+        denied = limit.hit("a")
+        self.assertFalse(denied.allowed)
+        self.assertAlmostEqual(denied.retry_after, 2.0)
+        clock.now += 2.0
+        self.assertTrue(limit.hit("a").allowed)
+        self.assertFalse(limit.hit("a").allowed)
+
+    def test_memory_store_evicts_least_recently_used(self):
+        clock = Clock()
+        store = MemoryStore(max_keys=2)
+        limit = RateLimit(1, burst=1, store=store, clock=clock)
+        limit.hit("a")
+        limit.hit("b")
+        limit.hit("a")
+        limit.hit("c")
+        self.assertEqual(len(store), 2)
+        self.assertTrue(limit.hit("b").allowed)
+        self.assertFalse(limit.hit("c").allowed)
+
+    def test_sqlite_store_is_shared(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "limits.sqlite3")
+            clock = Clock()
+            first, second = SQLiteStore(path), SQLiteStore(path)
+            try:
+                self.assertTrue(RateLimit(1, burst=1, store=first, clock=clock).hit("a").allowed)
+                self.assertFalse(RateLimit(1, burst=1, store=second, clock=clock).hit("a").allowed)
+            finally:
+                first.close()
+                second.close()
+
+
+class TestRouteLimits(unittest.TestCase):
+    def setUp(self):
+        self.app = Dust(config=DustConfig(log_file=None, enable_docs=False, jwt_secret_key="k"))
+
+    def test_rate_limited_route_returns_429(self):
+        @self.app.route("/search", rate_limit=RateLimit(1, per=60, burst=2))
+        async def search():
+            return "ok"
+
+        client = Client(self.app)
+        statuses = [client.get("/search").status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        response = client.get("/search")
+        self.assertEqual(response.headers["Retry-After"], "60")
+        self.assertEqual(response.headers["RateLimit-Remaining"], "0")
+        self.assertEqual(response.json["error"], "Too Many Requests")
+        # Another address has its own bucket
+        self.assertEqual(client.get("/search", environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code, 200)
+
+    def test_key_functions(self):
+        @self.app.route("/me", rate_limit=RateLimit(1, per=60, burst=1, key=jwt_subject(self.app)))
+        async def me():
+            return "ok"
+
+        client = Client(self.app)
+        alice = {"Authorization": "Bearer " + self.app.jwt_handler.encode({"sub": "alice"})}
+        bob = {"Authorization": "Bearer " + self.app.jwt_handler.encode({"sub": "bob"})}
+        self.assertEqual(client.get("/me", headers=alice).status_code, 200)
+        self.assertEqual(client.get("/me", headers=alice).status_code, 429)
+        self.assertEqual(client.get("/me", headers=bob).status_code, 200)
+
+        request = type("Request", (), {"headers": {"X-Forwarded-For": "1.1.1.1, 2.2.2.2"}, "remote_addr": "3.3.3.3"})
+        self.assertEqual(forwarded_ip(1)(request), "2.2.2.2")
+        self.assertEqual(forwarded_ip(2)(request), "1.1.1.1")
+        self.assertEqual(forwarded_ip(3)(request), "3.3.3.3")
+
+    def test_concurrency_limit_queues_then_turns_away(self):
+        limit = ConcurrencyLimit(1, max_waiting=1, timeout=0.05)
+
+        @self.app.route("/upload", methods=["POST"], concurrency=limit)
+        async def upload():
+            return "stored"
+
+        client = Client(self.app)
+        self.assertEqual(client.post("/upload").status_code, 200)
+
+        limit.slots.acquire()
+        response = client.post("/upload")
+        self.assertEqual((response.status_code, response.headers["Retry-After"]), (503, "1"))
+
+        # A queued request gets the slot once it is released within the deadline
+        limit.timeout = 5
+        threading.Timer(0.05, limit.release).start()
+        self.assertEqual(client.post("/upload").status_code, 200)
+
+        limit.max_waiting = 0
+        limit.slots.acquire()
+        self.assertEqual(client.post("/upload").status_code, 503)
+        limit.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
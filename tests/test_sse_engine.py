@@ -0,0 +1,192 @@
+# tests/test_sse_engine.py
+
+import os
+import tempfile
+import unittest
+import asyncio
+import base64
+import binascii
+import json
+import struct
+import threading
+from dustapi.goha.sse_engine import SSEEngine, DELIMETER, COUNTER, PRF, prf_labels
+
+class TestSSEEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = SSEEngine(self.tmp.name, index_backend="sqlite", index_path=os.path.join(self.tmp.name, "index.sqlite3"))
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmp.cleanup()
+
+    def test_update_replaces_old_key(self):
+        self.engine.update([("old", "v1")])
+        self.engine.update([("new", "v2", "old")])
+        self.assertNotIn(b"old", self.engine.index)
+        self.assertEqual(self.engine.index[b"new"], b"v2")
+
+    def test_update_applies_batch_in_order(self):
+        self.engine.update([("a", "1"), ("b", "2", "a"), ("a", "3")])
+        self.assertEqual(self.engine.index[b"a"], b"3")
+        self.assertEqual(self.engine.index[b"b"], b"2")
+
+    def test_update_missing_replacement_key(self):
+        self.engine.update([("a", "1", "missing")])
+        self.assertEqual(self.engine.index[b"a"], b"1")
+
+    def test_update_from_worker_thread(self):
+        self.engine.update([("a", "1")])
+        worker = threading.Thread(target=self.engine.update, args=([("b", "2")],))
+        worker.start()
+        worker.join(timeout=10)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(self.engine.index[b"b"], b"2")
+
+    def test_concurrent_first_use_opens_one_store(self):
+        engine = SSEEngine(self.tmp.name, index_backend="dbm", index_path=os.path.join(self.tmp.name, "lazy"))
+        barrier = threading.Barrier(8)
+        indexes, errors = [], []
+
+        def first_use():
+            barrier.wait()
+            try:
+                engine.initialize_index()
+                indexes.append(engine.index)
+                engine.blobs()
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=first_use) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.close()
+        self.assertEqual(errors, [])
+        self.assertEqual(len({id(index) for index in indexes}), 1)
+
+    def test_bulk_import(self):
+        count = self.engine.bulk_import(((f"k{i}", f"v{i}") for i in range(25)), batch_size=10)
+        self.assertEqual(count, 25)
+        self.assertEqual(self.engine.index[b"k24"], b"v24")
+
+    def add_posting(self, k1, k2, c, messages):
+        label = SSEEngine.PRF(k1, c)
+        self.engine.update([(label, SSEEngine.enc(k2.encode(), DELIMETER.join(messages)).decode())])
+        for name in messages:
+            with open(os.path.join(self.tmp.name, name), "wb") as f:
+                f.write(name.encode())
+
+    def test_search(self):
+        self.add_posting("k1a", "k2a" * 6, "body", ["m1", "m2"])
+        self.add_posting("k1b", "k2b" * 6, "body", ["m2", "m3"])
+        query = [("k1a", "k2a" * 6, "body"), ("k1b", "k2b" * 6, "body"), ("k1c", "k2c" * 6, "body")]
+        self.assertEqual(self.engine.lookup(query), ["m1", "m2", "m3"])
+        results = self.engine.search(query)["results"]
+        self.assertEqual(results, [binascii.hexlify(m.encode()).decode() for m in ["m1", "m2", "m3"]])
+
+    def test_parallel_decrypt_matches_serial(self):
+        self.engine.parallel_threshold = 1
+        for n in range(10):
+            self.add_posting(f"k1{n}", "k2" * 8, "", [f"m{n}", "shared"])
+        query = [(f"k1{n}", "k2" * 8) for n in range(10)]
+        self.assertEqual(self.engine.lookup(query), ["m0", "shared"] + [f"m{n}" for n in range(1, 10)])
+
+    def test_search_no_results(self):
+        self.assertEqual(self.engine.search([("x", "y" * 16, "z")]), {"results": "Found no results for query"})
+
+    def test_search_pagination(self):
+        self.add_posting("k1", "k2" * 8, "body", ["m1", "m2", "m3"])
+        query = [("k1", "k2" * 8, "body")]
+        first = self.engine.search(query, limit=2)
+        self.assertEqual(len(first["results"]), 2)
+        second = self.engine.search(query, limit=2, cursor=first["cursor"])
+        self.assertEqual(second["results"], [binascii.hexlify(b"m3").decode()])
+        self.assertNotIn("cursor", second)
+
+    def test_search_rejects_bad_paging(self):
+        query = [("k1", "k2" * 8, "body")]
+        for kwargs in ({"cursor": "abc"}, {"cursor": "-1"}, {"limit": 0}, {"limit": -2}):
+            with self.assertRaises(ValueError):
+                self.engine.search(query, **kwargs)
+
+    def test_search_base64(self):
+        self.add_posting("k1", "k2" * 8, "body", ["m1"])
+        results = self.engine.search([("k1", "k2" * 8, "body")], encoding="base64")["results"]
+        self.assertEqual(results, [base64.b64encode(b"m1").decode()])
+        with self.assertRaises(ValueError):
+            self.engine.search([("k1", "k2" * 8, "body")], encoding="raw")
+
+    def test_search_stream(self):
+        self.add_posting("k1", "k2" * 8, "body", ["m1", "m2"])
+
+        async def collect():
+            return [r async for r in self.engine.search_stream([("k1", "k2" * 8, "body")], encoding="raw")]
+
+        self.assertEqual(asyncio.run(collect()), [{"name": "m1", "data": b"m1"}, {"name": "m2", "data": b"m2"}])
+
+    def test_stream_response_ndjson(self):
+        self.add_posting("k1", "k2" * 8, "body", ["m1", "m2"])
+        response = self.engine.stream_response([("k1", "k2" * 8, "body")], limit=1)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(response.headers["X-Search-Cursor"], "1")
+        lines = response.get_data().decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"name": "m1", "data": binascii.hexlify(b"m1").decode()}])
+
+    def test_stream_response_raw(self):
+        self.add_posting("k1", "k2" * 8, "body", ["m1"])
+        body = self.engine.stream_response([("k1", "k2" * 8, "body")], encoding="raw").get_data()
+        self.assertEqual(body, struct.pack(">I", 2) + b"m1" + struct.pack(">Q", 2) + b"m1")
+
+    def test_posting_cache_hits_and_invalidation(self):
+        self.add_posting("k1", "k2" * 8, "body", ["m1"])
+        query = [("k1", "k2" * 8, "body")]
+        self.assertEqual(self.engine.lookup(query), ["m1"])
+        self.assertEqual(self.engine.lookup(query), ["m1"])
+        stats = self.engine.cache_stats()
+        self.assertEqual(stats["postings"]["hits"], 1)
+        self.assertEqual(stats["prf"]["hits"], 1)
+
+        self.add_posting("k1", "k2" * 8, "body", ["m2"])
+        self.assertEqual(self.engine.lookup(query), ["m2"])
+
+    def test_stale_posting_is_not_cached_after_update(self):
+        self.add_posting("k1", "k2" * 8, "body", ["m1"])
+        generation = self.engine.generation
+        label = SSEEngine.PRF("k1", "body").encode()
+        self.add_posting("k1", "k2" * 8, "body", ["m2"])
+        self.engine._cache_posting(generation, label, (b"k2" * 8, "m1"))
+        self.assertIsNone(self.engine.posting_cache.get(label))
+        self.assertEqual(self.engine.lookup([("k1", "k2" * 8, "body")]), ["m2"])
+
+    def test_caches_disabled(self):
+        engine = SSEEngine(self.tmp.name, index_backend="memory", prf_cache_size=0, posting_cache_bytes=0)
+        engine.update([(SSEEngine.PRF("k1", "body"), SSEEngine.enc(b"k2" * 8, "m1").decode())])
+        engine.lookup([("k1", "k2" * 8, "body")])
+        self.assertEqual(engine.cache_stats()["postings"]["entries"], 0)
+        self.assertEqual(engine.cache_stats()["prf"]["entries"], 0)
+
+    def test_add_mail_is_searchable(self):
+        self.engine.add_mail(b"ciphertext", "../inbox/1.eml", "#1")
+        k2 = b"k2" * 8
+        self.engine.update([(PRF("k1", "body"), SSEEngine.enc(k2, "inbox_1.eml").decode())])
+        results = self.engine.search([("k1", k2.decode(), "body")])["results"]
+        self.assertEqual(results, [binascii.hexlify(b"ciphertext").decode()])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "inbox_1.eml")))
+
+    def test_prf_labels_match_prf(self):
+        self.assertEqual(list(prf_labels("k1", range(3))), [PRF("k1", str(c)) for c in range(3)])
+
+    def test_counter_lookup_stops_at_first_miss(self):
+        k2 = b"k2" * 8
+        entries = [(label, SSEEngine.enc(k2, f"m{n}").decode()) for n, label in enumerate(prf_labels("k1", range(40)))]
+        # A gap at counter 40 hides everything after it
+        entries.append((PRF("k1", "41"), SSEEngine.enc(k2, "hidden").decode()))
+        self.engine.bulk_import(entries)
+        self.assertEqual(len(self.engine.counter_entries(b"k1")), 40)
+        found = self.engine.lookup([("k1", k2.decode(), COUNTER), ("kx", k2.decode(), COUNTER)])
+        self.assertEqual(found, [f"m{n}" for n in range(40)])
+
+if __name__ == '__main__':
+    unittest.main()
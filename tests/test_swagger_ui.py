@@ -0,0 +1,66 @@
+# tests/test_swagger_ui.py
+
+import gzip
+import os
+import tempfile
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.swagger_ui import SwaggerUI, IMMUTABLE
+
+BUNDLE = b"/* swagger */" + b"var x = 1;" * 500
+INDEX = b'<html><script src="/swagger-ui/swagger-ui-bundle.js"></script></html>'
+
+
+class TestSwaggerUI(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp.name, "index.html"), "wb") as f:
+            f.write(INDEX)
+        with open(os.path.join(self.tmp.name, "swagger-ui-bundle.js"), "wb") as f:
+            f.write(BUNDLE)
+        self.app = Dust(swagger_ui=False)
+        self.app.swagger_ui = SwaggerUI(self.app, assets_dir=self.tmp.name)
+        self.client = Client(self.app)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_assets_load_lazily(self):
+        self.assertIsNone(self.app.swagger_ui.assets)
+        self.client.get("/docs")
+        self.assertEqual(set(self.app.swagger_ui.assets), {"index.html", "swagger-ui-bundle.js"})
+
+    def test_index_links_versioned_assets(self):
+        page = self.client.get("/docs")
+        self.assertEqual(page.mimetype, "text/html")
+        self.assertEqual(page.headers["Cache-Control"], "no-cache")
+        etag = self.app.swagger_ui.assets["swagger-ui-bundle.js"].etag
+        self.assertIn(f"/swagger-ui/swagger-ui-bundle.js?v={etag}".encode(), page.data)
+
+        asset = self.client.get(f"/swagger-ui/swagger-ui-bundle.js?v={etag}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(asset.headers["Cache-Control"], IMMUTABLE)
+        self.assertEqual(asset.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(asset.data), BUNDLE)
+
+        plain = self.client.get("/swagger-ui/swagger-ui-bundle.js")
+        self.assertEqual(plain.headers["Cache-Control"], "no-cache")
+        self.assertEqual(plain.data, BUNDLE)
+        self.assertEqual(self.client.get("/swagger-ui/swagger-ui-bundle.js",
+                                         headers={"If-None-Match": plain.headers["ETag"]}).status_code, 304)
+
+    def test_disabled(self):
+        app = Dust(swagger_ui=False)
+        client = Client(app)
+        self.assertIsNone(app.swagger_ui)
+        self.assertEqual(client.get("/docs").status_code, 404)
+        self.assertEqual(client.get("/openapi.json").status_code, 404)
+
+    def test_missing_assets(self):
+        app = Dust(swagger_ui=False)
+        app.swagger_ui = SwaggerUI(app, assets_dir=os.path.join(self.tmp.name, "missing"))
+        self.assertEqual(Client(app).get("/docs").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
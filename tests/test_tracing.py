@@ -0,0 +1,113 @@
+# tests/test_tracing.py
+
+import json
+import os
+import tempfile
+import unittest
+from werkzeug.test import Client
+from dustapi.application import Dust
+from dustapi.config import DustConfig
+from dustapi.goha.sse_engine import SSEEngine
+from dustapi.tracing import (Tracer, InMemoryExporter, FileExporter, BatchProcessor, SpanContext, current_span,
+                             extract, inject)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class TestPropagation(unittest.TestCase):
+    def test_extract(self):
+        context = extract({"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01", "tracestate": "a=1"})
+        self.assertEqual((context.trace_id, context.span_id, context.sampled, context.tracestate),
+                         (TRACE_ID, PARENT_ID, True, "a=1"))
+        self.assertFalse(extract({"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"}).sampled)
+        # Later versions may append fields
+        self.assertIsNotNone(extract({"traceparent": f"01-{TRACE_ID}-{PARENT_ID}-01-extra"}))
+        for bad in (f"ff-{TRACE_ID}-{PARENT_ID}-01", f"00-{'0' * 32}-{PARENT_ID}-01", f"00-{TRACE_ID}-{'0' * 16}-01",
+                    f"00-{TRACE_ID.upper()}-{PARENT_ID}-01", f"00-{TRACE_ID}-{PARENT_ID}-01-extra", "garbage"):
+            self.assertIsNone(extract({"traceparent": bad}), bad)
+
+    def test_inject_uses_the_current_span(self):
+        self.assertEqual(inject({}), {})
+        tracer = Tracer()
+        with tracer.span("outer") as span:
+            headers = inject({})
+        self.assertEqual(headers["traceparent"], f"00-{span.context.trace_id}-{span.context.span_id}-01")
+        self.assertIsNone(current_span.get())
+
+
+class TestRequestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.app = Dust(config=DustConfig(log_file=None, enable_docs=False, enable_tracing=True))
+        self.exporter = self.app.tracer.exporter
+        self.app.sse = SSEEngine(self.tmp.name, index_backend="memory")
+        self.addCleanup(self.app.sse.close)
+
+        @self.app.route("/search")
+        async def search():
+            return str(self.app.sse.lookup([("k1", "k2" * 8, "body")]))
+
+    def spans(self):
+        self.app.tracer.force_flush()
+        return {span.name: span for span in self.exporter.spans}
+
+    def test_request_joins_the_callers_trace(self):
+        response = Client(self.app).get("/search", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+        self.assertEqual(response.status_code, 200)
+        spans = self.spans()
+        root = spans["GET /search"]
+        self.assertEqual((root.context.trace_id, root.parent_id, root.kind), (TRACE_ID, PARENT_ID, "server"))
+        self.assertEqual(root.attributes["http.status_code"], 200)
+
+        handler = spans["dust.handler"]
+        self.assertEqual(handler.parent_id, root.context.span_id)
+        self.assertEqual(spans["sse.lookup"].parent_id, handler.context.span_id)
+        for phase in ("parse", "session", "dispatch", "serialize", "logging", "session_save"):
+            span = spans[f"dust.{phase}"]
+            self.assertEqual(span.parent_id, root.context.span_id)
+            self.assertTrue(root.start_ns <= span.start_ns <= span.end_ns <= root.end_ns)
+        self.assertEqual({span.context.trace_id for span in spans.values()}, {TRACE_ID})
+
+    def test_unsampled_traces_are_not_exported(self):
+        Client(self.app).get("/search", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"})
+        self.assertEqual(self.spans(), {})
+
+    def test_new_trace_without_traceparent(self):
+        Client(self.app).get("/missing")
+        root = self.spans()["GET /missing"]
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(root.attributes["http.status_code"], 404)
+
+
+class TestExporters(unittest.TestCase):
+    def test_file_exporter_batches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "spans.jsonl")
+            exporter = FileExporter(path)
+            tracer = Tracer(exporter, service_name="svc", processor=BatchProcessor(exporter, max_batch=2))
+            for n in range(5):
+                with tracer.span(f"s{n}"):
+                    pass
+            tracer.shutdown()
+            with open(path) as f:
+                spans = [json.loads(line) for line in f]
+        self.assertEqual(sorted(span["name"] for span in spans), [f"s{n}" for n in range(5)])
+        self.assertEqual(spans[0]["service"], "svc")
+
+    def test_full_queue_drops_spans(self):
+        exporter = InMemoryExporter()
+        processor = BatchProcessor(exporter, max_queue=2, interval=60)
+        tracer = Tracer(exporter, processor=processor)
+        parent = SpanContext(TRACE_ID, PARENT_ID)
+        processor.stopped = True  # keep the export thread from draining the queue
+        for n in range(4):
+            tracer.start_span(f"s{n}", parent).end()
+        self.assertEqual(processor.dropped, 2)
+        tracer.force_flush()
+        self.assertEqual([span.name for span in exporter.spans], ["s0", "s1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
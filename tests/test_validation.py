@@ -0,0 +1,84 @@
+# tests/test_validation.py
+
+import unittest
+from typing import List, Optional
+from pydantic import BaseModel
+from werkzeug.test import Client
+from dustapi.application import Dust
+
+
+class Item(BaseModel):
+    name: str
+    price: float
+    tags: List[str] = []
+
+
+class ItemOut(BaseModel):
+    name: str
+    total: float
+
+
+class Paging(BaseModel):
+    limit: int = 10
+    ids: List[int] = []
+    q: Optional[str] = None
+
+
+class Filters(BaseModel):
+    ids: Optional[List[int]] = None
+
+
+class TestRouteModels(unittest.TestCase):
+    def setUp(self):
+        self.app = Dust()
+
+        @self.app.route('/items', methods=['POST'], body=Item, query=Paging, response_model=ItemOut, tags=['items'])
+        async def create_item(body, query):
+            """Create an item."""
+            return {"name": body.name, "total": body.price * query.limit, "secret": "dropped"}
+
+        @self.app.route('/plain', methods=['GET'])
+        async def plain():
+            return 'ok'
+
+        self.client = Client(self.app)
+
+    def test_valid_request(self):
+        response = self.client.post('/items?limit=2&ids=1&ids=2', json={"name": "a", "price": 1.5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.json, {"name": "a", "total": 3.0})
+
+    def test_invalid_body_and_query(self):
+        response = self.client.post('/items', json={"name": "a", "price": "lots"})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json["detail"][0]["loc"], ["price"])
+
+        self.assertEqual(self.client.post('/items', data=b'{not json', content_type='application/json').status_code, 422)
+        self.assertEqual(self.client.post('/items?limit=x', json={"name": "a", "price": 1}).status_code, 422)
+
+    def test_optional_list_query_param(self):
+        @self.app.route('/filtered', methods=['GET'], query=Filters)
+        async def filtered(query):
+            return str(query.ids)
+
+        self.assertEqual(self.client.get('/filtered?ids=1&ids=2').data, b'[1, 2]')
+        self.assertEqual(self.client.get('/filtered').data, b'None')
+
+    def test_routes_without_models_are_unchanged(self):
+        self.assertEqual(self.client.get('/plain').data, b'ok')
+
+    def test_schemas_are_emitted(self):
+        spec = self.client.get('/openapi.json').json
+        operation = spec["paths"]["/items"]["post"]
+        self.assertEqual(operation["summary"], "create_item")
+        self.assertEqual(operation["description"], "Create an item.")
+        self.assertEqual(operation["tags"], ["items"])
+        self.assertEqual(operation["requestBody"]["content"]["application/json"]["schema"], {"$ref": "#/components/schemas/Item"})
+        self.assertEqual({p["name"] for p in operation["parameters"]}, {"limit", "ids", "q"})
+        self.assertIn("422", operation["responses"])
+        self.assertEqual(set(spec["components"]["schemas"]), {"Item", "ItemOut"})
+
+
+if __name__ == "__main__":
+    unittest.main()